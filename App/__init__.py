@@ -1,8 +1,14 @@
 from App.client_app import ClientApp
 from App.server_app import ServerApp
-from App.message_app import MotMessage, generate_rides_example_file, ride_generator
+from App.shard_app import ShardedServerApp, ShardMap, shard_key, SHARD_ROUND_ROBIN, SHARD_HASH, SHARD_STRATEGIES
+from App.message_app import MotMessage, generate_rides_example_file, ride_generator, StationDictionary, \
+    load_station_dictionary, decode_binary_messages, decode_binary_columns, decode_text_columns
+from App.load_app import LoadGenerator, ArrivalProcess, ConstantArrivals, PoissonArrivals, ProfileArrivals
 
 __all__ = ['ClientApp',
            'ServerApp',
-           'MotMessage', 'generate_rides_example_file', 'ride_generator'
+           'ShardedServerApp', 'ShardMap', 'shard_key', 'SHARD_ROUND_ROBIN', 'SHARD_HASH', 'SHARD_STRATEGIES',
+           'MotMessage', 'generate_rides_example_file', 'ride_generator', 'StationDictionary',
+           'load_station_dictionary', 'decode_binary_messages', 'decode_binary_columns', 'decode_text_columns',
+           'LoadGenerator', 'ArrivalProcess', 'ConstantArrivals', 'PoissonArrivals', 'ProfileArrivals',
            ]
@@ -6,6 +6,10 @@ import pandas as pd
 from NetworkNode import *
 from App.message_app import MotMessage, ride_generator, LINE_NUMBER, OPERATOR, BOARDING_TIME, \
     STATION_DEST, STATION_SOURCE, TRAVEL_CODE, COLS
+from App.shard_app import ShardMap, shard_key
+
+# default delay (in seconds) between two messages sent by the demo client
+SEND_INTERVAL = 1
 
 
 class ClientApp:
@@ -15,7 +19,9 @@ class ClientApp:
 
     def __init__(self, client_address: str, relays: List[Relay],
                  host: str, port: int, host_pb_key=None,
-                 n_msgs: int = 1) -> None:
+                 n_msgs: int = 1, *, send_interval: float = SEND_INTERVAL, cover_rate: float = 0,
+                 batch_window: float = 0, binary: bool = False, layer_format: str = LAYER_AEAD,
+                 circuit_mode: bool = False, shards: ShardMap = None, config: NodeConfig = None) -> None:
         """
         init a client-application instance
         :param client_address: ip address of client
@@ -24,9 +30,20 @@ class ClientApp:
         :param port: port number of server
         :param host_pb_key: public key of server
         :param n_msgs: number of messages to send
+        :param send_interval: delay in seconds between two sent messages
+        :param cover_rate: mean dummy onions per second sent while the client is active (0 for no cover traffic)
+        :param batch_window: seconds the messages are queued for, before being sent together inside a single onion
+        (0 to send every message on its own)
+        :param binary: send the rides with the compact binary encoding (station names as dictionary indexes)
+        :param layer_format: format of the onion layers of the client (LAYER_AEAD or LAYER_FERNET)
+        :param circuit_mode: send the messages through a circuit (only the first one is an onion)
+        :param shards: shards of a sharded server, the rides are spread over (default: host::port only). in circuit
+        mode, the frames of a circuit reach the shard its setup onion was sent to
+        :param config: tuning of the client (tries and timeout of its sends, depth of its onion pool)
         """
         # client instance bound to this client application + setup relay chain for this client + set host pb key
-        self.client = Client(client_address)
+        self.client = Client(client_address, layer_format=layer_format, circuit_mode=circuit_mode,
+                             config=config if config is not None else NodeConfig())
         self.client.set_relays_chain(relays)
         self.client.set_host_pb_key(host_pb_key)
         # relays chain through which the client sends messages
@@ -35,8 +52,21 @@ class ClientApp:
         self._host = host
         # server port
         self._port = port
+        # shards of the server
+        self._shards = shards if shards is not None else ShardMap([(host, port)])
         # rides history of client
         self._rides_history = pd.DataFrame(columns=COLS)
+        # delay between two sent messages
+        self._send_interval = send_interval
+        # cover traffic of the client
+        self._cover = CoverTraffic(self.client, cover_rate)
+        # messages queued during the current batch window, and the timer flushing them at the end of the window
+        self._batch_window = batch_window
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._flush_timer = None
+        # encoding of the sent rides
+        self._binary = binary
 
         # set up threads
         self._thread_app = threading.Thread(target=self.demo_client, args=(n_msgs,), name=str(self))
@@ -75,8 +105,36 @@ class ClientApp:
         :return:
         """
         mot_msg = MotMessage(line, operator, code, boarding, st_src, st_dst)
-        core_msg = POST + mot_msg.get_formatted_message() + END
-        self.client.send_through_chain(self._host, self._port, core_msg)
+        try:
+            ride = mot_msg.get_binary_message() if self._binary else mot_msg.get_formatted_message()
+        # a station missing from the dictionary, or a field too wide for the binary encoding, can only be sent as text
+        except ValueError:
+            ride = mot_msg.get_formatted_message()
+        core_msg = POST + ride + END
+        if self._batch_window <= 0:
+            self.client.send_through_chain(*self._shards.pick(shard_key(line)), core_msg)
+            return
+        # queue the message: the first message of a window starts the timer flushing the window
+        with self._queue_lock:
+            self._queue.append((shard_key(line), core_msg))
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self._batch_window, self.flush_messages)
+                self._flush_timer.start()
+
+    def flush_messages(self) -> None:
+        """
+        send all the queued messages together (a batch per shard), through the mixnet chain
+        :return:
+        """
+        with self._queue_lock:
+            queue, self._queue = self._queue, []
+            timer, self._flush_timer = self._flush_timer, None
+        if timer is not None:
+            timer.cancel()
+        if len(queue) == 0:
+            return
+        for (host, port), indexes in self._shards.assign([key for key, _ in queue]).items():
+            self.client.send_batch_through_chain(host, port, [queue[i][1] for i in indexes])
 
     def get_rides_history(self) -> pd.DataFrame:
         """
@@ -92,13 +150,14 @@ class ClientApp:
         """
         # call to sleep, so the os scheduler queue the client thread to run after all the relays are setup
         time.sleep(1)
+        self._cover.start()
         gride = ride_generator(n_msgs)
         for i in range(n_msgs):
             # print(f'{self.client}: sending message...\n')
             # get ride data
             ride = next(gride)
             # add ride to rides history
-            self._rides_history = self._rides_history.append(ride, ignore_index=True)
+            self._rides_history = pd.concat([self._rides_history, ride], ignore_index=True)
             line = ride.loc[:, LINE_NUMBER].values[0]
             op = ride.loc[:, OPERATOR].values[0]
             code = ride.loc[:, TRAVEL_CODE].values[0]
@@ -107,5 +166,10 @@ class ClientApp:
             st_dst = ride.loc[:, STATION_DEST].values[0]
             self.send_message(line, op, code, boarding_time, st_src, st_dst)
             # create delay between sent messages
-            time.sleep(1)
+            if self._send_interval > 0:
+                time.sleep(self._send_interval)
+        # send the messages of the last batch window
+        self.flush_messages()
+        self._cover.stop()
+        self.client.stop_onion_pool()
         print(f'{self.client} done.\n')
@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Iterator
+import random
+import threading
+import time
+import pandas as pd
+
+from NetworkNode import *
+from NetworkNode.metrics import percentile
+from App.message_app import MotMessage, COLS, BOARDING_TIME, RIDES_EXAMPLE_FILE
+from App.shard_app import ShardMap, shard_key
+
+# relative rides rate of every hour of the day (00:00 to 23:00), recorded on a weekday with morning and evening peaks
+RUSH_HOUR_PROFILE = [0.05, 0.03, 0.02, 0.02, 0.05, 0.2, 0.6, 1.0, 0.95, 0.6, 0.45, 0.45,
+                     0.5, 0.5, 0.55, 0.7, 0.9, 1.0, 0.8, 0.55, 0.4, 0.3, 0.2, 0.1]
+# default number of threads sending the generated rides
+N_WORKERS = 32
+# an arrival dispatched more than LATE_SEC seconds after its scheduled time is counted as late
+LATE_SEC = 0.01
+# number of rides sampled in advance from the rides file
+N_RIDES_SAMPLE = 4096
+# default maximal number of rides waiting to be sent: over it, new arrivals are shed instead of queued
+MAX_PENDING = 1024
+
+
+class ArrivalProcess:
+    """
+    base class of the processes generating the arrival times of the rides
+    """
+
+    def times(self, duration: float) -> Iterator[float]:
+        """
+        :param duration: length of the run in seconds
+        :return: generator of the arrival times (seconds since the start of the run), in increasing order
+        """
+        raise NotImplementedError
+
+    def mean_rate(self, duration: float) -> float:
+        """
+        :param duration: length of the run in seconds
+        :return: mean offered rate (arrivals per second) over the run
+        """
+        raise NotImplementedError
+
+
+class ConstantArrivals(ArrivalProcess):
+    """
+    arrivals at a constant rate
+    """
+
+    def __init__(self, rate: float) -> None:
+        """
+        :param rate: arrivals per second
+        """
+        self.rate = rate
+
+    def __str__(self) -> str:
+        return f'constant({self.rate}/s)'
+
+    def times(self, duration: float) -> Iterator[float]:
+        t = 0.
+        while t < duration:
+            yield t
+            t += 1 / self.rate
+
+    def mean_rate(self, duration: float) -> float:
+        return self.rate
+
+
+class PoissonArrivals(ArrivalProcess):
+    """
+    arrivals of a poisson process: exponentially distributed inter-arrival times
+    """
+
+    def __init__(self, rate: float) -> None:
+        """
+        :param rate: mean arrivals per second
+        """
+        self.rate = rate
+
+    def __str__(self) -> str:
+        return f'poisson({self.rate}/s)'
+
+    def times(self, duration: float) -> Iterator[float]:
+        t = random.expovariate(self.rate)
+        while t < duration:
+            yield t
+            t += random.expovariate(self.rate)
+
+    def mean_rate(self, duration: float) -> float:
+        return self.rate
+
+
+class ProfileArrivals(ArrivalProcess):
+    """
+    arrivals of a poisson process whose rate follows a recorded profile (e.g. the rush hours of a day),
+    replayed in compressed time: every slot of the profile lasts duration / len(profile) seconds
+    """
+
+    def __init__(self, peak_rate: float, profile: List[float] = None) -> None:
+        """
+        :param peak_rate: arrivals per second at the peak of the profile
+        :param profile: relative rate of every slot (default: RUSH_HOUR_PROFILE)
+        """
+        self.peak_rate = peak_rate
+        profile = RUSH_HOUR_PROFILE if profile is None else profile
+        peak = max(profile)
+        self.profile = [w / peak for w in profile]
+
+    def __str__(self) -> str:
+        return f'profile(peak {self.peak_rate}/s, {len(self.profile)} slots)'
+
+    @staticmethod
+    def from_rides_file(peak_rate: float, path: str = f'./App/{RIDES_EXAMPLE_FILE}'):
+        """
+        build the hourly profile of recorded rides
+        :param peak_rate: arrivals per second at the peak of the profile
+        :param path: csv file of recorded rides (with a boarding time column, hh:mm)
+        :return: arrival process following the hourly histogram of the boarding times
+        """
+        hours = pd.read_csv(path, usecols=[BOARDING_TIME])[BOARDING_TIME].str[:2].astype(int)
+        counts = hours.value_counts().reindex(range(24), fill_value=0)
+        return ProfileArrivals(peak_rate, counts.tolist())
+
+    def rate_at(self, t: float, duration: float) -> float:
+        """
+        :param t: time since the start of the run
+        :param duration: length of the run in seconds
+        :return: offered rate at time t
+        """
+        slot = min(int(t / duration * len(self.profile)), len(self.profile) - 1)
+        return self.peak_rate * self.profile[slot]
+
+    def times(self, duration: float) -> Iterator[float]:
+        # thinning of a poisson process at the peak rate
+        t = random.expovariate(self.peak_rate)
+        while t < duration:
+            if random.random() * self.peak_rate < self.rate_at(t, duration):
+                yield t
+            t += random.expovariate(self.peak_rate)
+
+    def mean_rate(self, duration: float) -> float:
+        return self.peak_rate * sum(self.profile) / len(self.profile)
+
+
+def sample_rides(n: int = N_RIDES_SAMPLE, path: str = f'./App/{RIDES_EXAMPLE_FILE}') -> List[MotMessage]:
+    """
+    sample rides of the rides file in advance, so generating a ride does not cost a dataframe sample
+    :param n: number of rides to sample
+    :param path: csv file of rides
+    :return: list of rides messages
+    """
+    df = pd.read_csv(path)[COLS]
+    return [MotMessage(*row) for row in df.sample(n, replace=True).itertuples(index=False)]
+
+
+class LoadGenerator:
+    """
+    open-loop load generator: rides arrive according to an arrival process, independently of how fast the mixnet
+    absorbs them. every arrival is sent by a random virtual client, from a pool of sending threads
+    """
+
+    def __init__(self, clients: List[Client], host: str, port: int, arrivals: ArrivalProcess,
+                 n_workers: int = N_WORKERS, max_pending: int = MAX_PENDING, shards: ShardMap = None) -> None:
+        """
+        init a load generator instance
+        :param clients: virtual clients sending the rides
+        :param host: ip address of host server
+        :param port: port number of server
+        :param arrivals: arrival process of the rides
+        :param n_workers: number of threads sending the rides
+        :param max_pending: rides dispatched but not sent yet, over which the new arrivals are shed (the mixnet is
+        not keeping up: queueing them would only grow the memory and the latency of the generator)
+        :param shards: shards of a sharded server, the rides are spread over (default: host::port only)
+        """
+        self._clients = clients
+        self._host = host
+        self._port = port
+        self._shards = shards if shards is not None else ShardMap([(host, port)])
+        self._arrivals = arrivals
+        self._n_workers = n_workers
+        self._max_pending = max_pending
+        self._rides = sample_rides()
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._rejected = 0
+        self._last_completion = 0.
+
+    def __str__(self) -> str:
+        return f'LoadGenerator-{self._arrivals}'
+
+    def run(self, duration: float) -> dict:
+        """
+        generate the load for the given duration, and wait for all the generated rides to be sent
+        :param duration: length of the run in seconds
+        :return: report of offered versus achieved rate, and how far the generator fell behind its schedule
+        """
+        lags = []
+        max_backlog = 0
+        scheduled = 0
+        shed = 0
+        self._completed = 0
+        self._rejected = 0
+        executor = ThreadPoolExecutor(max_workers=self._n_workers, thread_name_prefix=str(self))
+        start = time.monotonic()
+        for t in self._arrivals.times(duration):
+            delay = start + t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # time between the scheduled arrival and its dispatch
+            lags.append(max(time.monotonic() - start - t, 0.))
+            scheduled += 1
+            with self._lock:
+                backlog = scheduled - 1 - shed - self._completed - self._rejected
+            max_backlog = max(max_backlog, backlog)
+            if backlog >= self._max_pending:
+                shed += 1
+                continue
+            executor.submit(self._send_ride, random.choice(self._clients), random.choice(self._rides))
+        executor.shutdown(wait=True)
+        elapsed = max(self._last_completion - start, duration)
+        lags.sort()
+        report = {'arrivals': str(self._arrivals),
+                  'duration': duration,
+                  'offered_rate': self._arrivals.mean_rate(duration),
+                  'scheduled': scheduled,
+                  'sent': self._completed,
+                  'rejected': self._rejected,
+                  'shed': shed,
+                  'achieved_rate': self._completed / elapsed if elapsed > 0 else 0.,
+                  'drain_time': max(self._last_completion - start - duration, 0.),
+                  'lag_p50': percentile(lags, 50),
+                  'lag_p99': percentile(lags, 99),
+                  'lag_max': lags[-1] if lags else 0.,
+                  'late': sum(lag > LATE_SEC for lag in lags),
+                  'max_backlog': max_backlog}
+        METRICS.set_gauge(str(self), 'achieved_rate', report['achieved_rate'])
+        METRICS.inc(str(self), 'rides_shed', shed)
+        return report
+
+    def _send_ride(self, client: Client, ride: MotMessage) -> None:
+        """
+        send a ride through the mixnet
+        :param client: virtual client sending the ride
+        :param ride: ride to send
+        :return:
+        """
+        host, port = self._shards.pick(shard_key(ride.line_number))
+        status = client.send_through_chain(host, port, POST + ride.get_formatted_message() + END)
+        with self._lock:
+            if status == SEND_OK:
+                self._completed += 1
+            else:
+                self._rejected += 1
+            self._last_completion = time.monotonic()
@@ -1,4 +1,8 @@
 import random
+import struct
+import zlib
+from functools import lru_cache
+from typing import List
 import pandas as pd
 import os
 
@@ -23,6 +27,78 @@ RIDES_EXAMPLE_FILE = 'rides_example.csv'
 SEP = b';'
 MOT_MSG_FORMAT = b'{ln};{op};{code};{brd};{st_src};{st_dst}'
 
+# first byte of a binary MotMessage: it is not a digit, so it never starts a text MotMessage
+BINARY_MAGIC = b'\xb1'
+# binary MotMessage: magic, dictionary version, line number, operator index, travel code,
+# boarding time (minutes since midnight), source and destination stations indexes
+BINARY_FORMAT = struct.Struct('>cHHBBHHH')
+# boarding times (hh:mm) by minutes since midnight
+BOARDING_TIMES = [f'{m // 60:02d}:{m % 60:02d}' for m in range(24 * 60)]
+
+
+class StationDictionary:
+    """
+    versioned dictionary of the stations (and operators) names, shared by the clients and the server to encode
+    the names of binary MotMessages as indexes. the version is a checksum of the names: a message encoded with
+    another dictionary is rejected
+    """
+
+    def __init__(self, stations: List[str], operators: List[str] = OPERATORS) -> None:
+        """
+        init a station dictionary instance
+        :param stations: names of the stations, in the order of their indexes
+        :param operators: names of the operators, in the order of their indexes
+        """
+        self.stations = list(stations)
+        self.operators = list(operators)
+        self.version = zlib.crc32('\n'.join(self.stations + self.operators).encode()) & 0xffff
+        # duplicated names are encoded with the index of their first occurrence
+        self._station_idx = {}
+        for idx, name in enumerate(self.stations):
+            self._station_idx.setdefault(name, idx)
+        self._operator_idx = {name: idx for idx, name in enumerate(self.operators)}
+
+    def __str__(self) -> str:
+        return f'StationDictionary-v{self.version}'
+
+    @staticmethod
+    def from_file(path: str) -> 'StationDictionary':
+        """
+        :param path: file of the stations names, one per line
+        :return: station dictionary of the stations of the file
+        """
+        with open(path, 'r') as file:
+            return StationDictionary([line.strip('\n') for line in file])
+
+    def station_index(self, name: str) -> int:
+        """
+        :param name: name of a station
+        :return: index of the station
+        """
+        try:
+            return self._station_idx[name]
+        except KeyError:
+            raise ValueError(f'{self}: unknown station {name}')
+
+    def operator_index(self, name: str) -> int:
+        """
+        :param name: name of an operator
+        :return: index of the operator
+        """
+        try:
+            return self._operator_idx[name]
+        except KeyError:
+            raise ValueError(f'{self}: unknown operator {name}')
+
+
+@lru_cache(maxsize=None)
+def load_station_dictionary(path: str = None) -> StationDictionary:
+    """
+    :param path: file of the stations names (default: the cities file of the app)
+    :return: station dictionary of the file, loaded once
+    """
+    return StationDictionary.from_file(os.path.abspath(f'./App/{CITIES_FILENAME}') if path is None else path)
+
 
 class MotMessage:
     """
@@ -59,6 +135,81 @@ class MotMessage:
                + self.st_source.encode() + SEP \
                + self.st_dest.encode()
 
+    def get_binary_message(self, dictionary: StationDictionary = None) -> bytes:
+        """
+        :param dictionary: station dictionary encoding the names (default: the dictionary of the cities file)
+        :return: a compact binary message (BINARY_FORMAT), with the names encoded as dictionary indexes
+        """
+        if dictionary is None:
+            dictionary = load_station_dictionary()
+        hours, minutes = self.boarding_time.split(':')
+        if not 0 <= int(minutes) < 60:
+            raise ValueError(f'invalid boarding time {self.boarding_time}')
+        # every field must fit its width in BINARY_FORMAT: the ride is sent as text otherwise
+        fields = [('line number', self.line_number, 0xffff),
+                  ('operator index', dictionary.operator_index(self.operator), 0xff),
+                  ('travel code', self.travel_code, 0xff),
+                  ('boarding time', int(hours) * 60 + int(minutes), len(BOARDING_TIMES) - 1),
+                  ('source station index', dictionary.station_index(self.st_source), 0xffff),
+                  ('destination station index', dictionary.station_index(self.st_dest), 0xffff)]
+        for name, value, limit in fields:
+            if not 0 <= value <= limit:
+                raise ValueError(f'{name} {value} does not fit the binary encoding (0 to {limit})')
+        return BINARY_FORMAT.pack(BINARY_MAGIC, dictionary.version, *(value for _, value, _ in fields))
+
+
+def decode_binary_columns(msgs: List[bytes], dictionary: StationDictionary = None) -> List[list]:
+    """
+    decode binary MotMessages into rides columns, as the text MotMessages fields (strings, in the order of COLS)
+    :param msgs: binary messages, as returned by MotMessage.get_binary_message
+    :param dictionary: station dictionary the messages were encoded with (default: the dictionary of the cities file)
+    :return: rides columns
+    """
+    if dictionary is None:
+        dictionary = load_station_dictionary()
+    if len(msgs) == 0:
+        return [[] for _ in COLS]
+    buffer = b''.join(msgs)
+    if len(buffer) != len(msgs) * BINARY_FORMAT.size:
+        raise ValueError(f'binary messages must be {BINARY_FORMAT.size} bytes long')
+    magics, versions, lines, ops, codes, boardings, srcs, dsts = zip(*BINARY_FORMAT.iter_unpack(buffer))
+    if set(magics) != {BINARY_MAGIC}:
+        raise ValueError('not binary messages: missing magic byte')
+    if set(versions) != {dictionary.version}:
+        raise ValueError(f'{dictionary}: messages encoded with dictionary versions {set(versions)}')
+    stations = dictionary.stations.__getitem__
+    return [list(map(str, lines)),
+            list(map(dictionary.operators.__getitem__, ops)),
+            list(map(str, codes)),
+            list(map(BOARDING_TIMES.__getitem__, boardings)),
+            list(map(stations, srcs)),
+            list(map(stations, dsts))]
+
+
+def decode_binary_messages(msgs: List[bytes], dictionary: StationDictionary = None) -> List[list]:
+    """
+    decode binary MotMessages into rides rows, as the text MotMessages fields (strings, in the order of COLS)
+    :param msgs: binary messages, as returned by MotMessage.get_binary_message
+    :param dictionary: station dictionary the messages were encoded with (default: the dictionary of the cities file)
+    :return: rides rows
+    """
+    return [list(row) for row in zip(*decode_binary_columns(msgs, dictionary))]
+
+
+def decode_text_columns(msgs: List[bytes]) -> List[list]:
+    """
+    decode text MotMessages into rides columns, with a single split of the joined messages
+    :param msgs: text messages, as returned by MotMessage.get_formatted_message
+    :return: rides columns (strings, in the order of COLS)
+    """
+    if len(msgs) == 0:
+        return [[] for _ in COLS]
+    # every message is checked: a message with an extra field and another one missing a field would shift the columns
+    if any(msg.count(SEP) != len(COLS) - 1 for msg in msgs):
+        raise ValueError(f'text messages must hold {len(COLS)} fields')
+    fields = SEP.join(msgs).decode('utf-8').split(SEP.decode())
+    return [fields[i::len(COLS)] for i in range(len(COLS))]
+
 
 def gen_line_number(n: int):
     """
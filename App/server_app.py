@@ -1,12 +1,19 @@
 from collections import deque
+from typing import List
 import threading
+import time
 import pandas as pd
 
 from NetworkNode import *
-from App.message_app import COLS
+from NetworkNode.profiling import PROFILER
+from App.message_app import COLS, BINARY_MAGIC, decode_binary_columns, decode_text_columns
 
 # delimiter of different data fields inside a sent MotMessage
 DELIM = ';'
+# maximal number of buffered messages drained and stored at once
+INGEST_BATCH = 4096
+# delay (in seconds) of the ingest loop when no message is buffered
+IDLE_SLEEP = 0.001
 
 
 class ServerApp:
@@ -14,24 +21,41 @@ class ServerApp:
     represents the server application side
     """
 
-    def __init__(self, host: str, port: int, name: str = 'ServerApp') -> None:
+    def __init__(self, host: str, port: int, name: str = 'ServerApp', timeout: float = SOCKET_TIMEOUT,
+                 verbose: bool = False, ingest_batch: int = INGEST_BATCH, n_workers: int = 1,
+                 transport: str = TRANSPORT_TCP) -> None:
         """
         init a server application instance
         :param host: ip address of server
         :param port: port number of server
         :param name: name of application (optional)
+        :param timeout: seconds without incoming messages before the server disconnects
+        :param verbose: print every received message
+        :param ingest_batch: maximal number of buffered messages drained and stored at once
+        :param n_workers: number of processes accepting and decrypting the messages on host:port (SO_REUSEPORT):
+        the server thread of the app, and n_workers - 1 worker processes
+        :param transport: name of the transport the server listens on (worker processes need tcp)
         """
         # name of server application
         self.name = name
         # network server instance
-        self.server = Server(host, port)
+        self.server = Server(host, port, timeout=timeout, reuse_port=n_workers > 1, transport=transport)
         # buffer to pass to the server receive method to store received messages
         self._buffer = deque()
+        # worker processes of the server, feeding the buffer
+        self._workers = None
+        if n_workers > 1:
+            self._workers = ServerWorkers(self.server, n_workers - 1, self._buffer, timeout=timeout)
         # init app and server threads
         self._thread_server = threading.Thread(target=self.server.receive, args=(self._buffer,), name=str(self.server))
         self._thread_app = threading.Thread(target=self.receive_messages, name=str(self))
-        # rides database dataframe of server application
+        # rides database dataframe of server application. stored batches are kept as chunks, and concatenated
+        # to the database only when it is read
         self._rides_database = pd.DataFrame(columns=COLS)
+        self._rides_chunks = []
+        self._database_lock = threading.Lock()
+        self._verbose = verbose
+        self._ingest_batch = ingest_batch
 
     def __str__(self) -> str:
         return f'{self.name}-{self.server.address}'
@@ -45,6 +69,8 @@ class ServerApp:
         :return:
         """
         self._thread_server.start()
+        if self._workers is not None:
+            self._workers.start()
         self._thread_app.start()
 
     def join_app(self) -> None:
@@ -53,27 +79,47 @@ class ServerApp:
         :return:
         """
         self._thread_server.join()
+        if self._workers is not None:
+            self._workers.join()
         self._thread_app.join()
 
     def receive_messages(self) -> None:
         """
-        receive message from the server and add it to the server data base
+        receive messages from the server and add them to the server data base, a batch at a time
         :return:
         """
-        n = 0
         print(f'{self}: ready to receive...\n')
         while True:
-            if len(self._buffer) > 0:
-                msg = self._buffer.popleft()
-                self._add_ride_to_database(msg)
-                n += 1
-                # msg_parsed = self._parse_msg(msg)
-                print(f'{self} received: {msg}\n')
-            if not self.server.is_connected():
+            PROFILER.checkpoint(str(self))
+            # check the connection before draining: messages buffered before the disconnection are still stored
+            connected = self.server.is_connected() or (self._workers is not None and self._workers.is_alive())
+            msgs = self._drain_buffer()
+            if len(msgs) > 0:
+                with PROFILER.section('_add_rides_to_database'):
+                    self._add_rides_to_database(msgs)
+                METRICS.mark(str(self), 'rides_stored', len(msgs))
+                METRICS.set_gauge(str(self), 'ingest_batch', len(msgs))
+                if self._verbose:
+                    for msg in msgs:
+                        print(f'{self} received: {msg}\n')
+            elif not connected:
                 self.close_app()
+                PROFILER.finish()
                 break
+            else:
+                time.sleep(IDLE_SLEEP)
         print(f'{self} disconnecting...\n')
 
+    def get_rides_database(self) -> pd.DataFrame:
+        """
+        :return: rides database of the server application
+        """
+        with self._database_lock:
+            if len(self._rides_chunks) > 0:
+                self._rides_database = pd.concat([self._rides_database] + self._rides_chunks, ignore_index=True)
+                self._rides_chunks = []
+            return self._rides_database
+
     def close_app(self) -> None:
         """
         close the socket of the server
@@ -81,10 +127,48 @@ class ServerApp:
         """
         self.server.close_socket()
 
-    def _add_ride_to_database(self, msg: bytes) -> None:
+    def _drain_buffer(self) -> List[bytes]:
         """
-        parse a ride message and add it to the server database
-        :param msg: message received from the network
+        :return: up to ingest_batch messages popped from the buffer
+        """
+        popleft = self._buffer.popleft
+        return [popleft() for _ in range(min(len(self._buffer), self._ingest_batch))]
+
+    def _add_rides_to_database(self, msgs: List[bytes]) -> None:
+        """
+        decode a batch of ride messages into columns, and add them to the server database at once
+        :param msgs: messages received from the network
         :return:
         """
-        self._rides_database.loc[len(self._rides_database)] = msg.decode('utf-8').split(DELIM)
+        binary = [msg for msg in msgs if msg[:1] == BINARY_MAGIC]
+        text = [msg for msg in msgs if msg[:1] != BINARY_MAGIC] if binary else msgs
+        chunks = []
+        for decode, batch in ((decode_binary_columns, binary), (decode_text_columns, text)):
+            if len(batch) == 0:
+                continue
+            try:
+                columns = decode(batch)
+            # a malformed message fails the whole batch: decode the messages one by one, and drop the malformed ones
+            except (ValueError, UnicodeDecodeError):
+                columns = self._decode_one_by_one(decode, batch)
+            chunks.append(pd.DataFrame(dict(zip(COLS, columns)), columns=COLS))
+        with self._database_lock:
+            self._rides_chunks.extend(chunks)
+
+    def _decode_one_by_one(self, decode: callable, msgs: List[bytes]) -> List[list]:
+        """
+        decode messages one at a time, dropping the malformed ones
+        :param decode: columns decoder of the messages
+        :param msgs: messages to decode
+        :return: rides columns of the well-formed messages
+        """
+        columns = [[] for _ in COLS]
+        for msg in msgs:
+            try:
+                ride = decode([msg])
+            except (ValueError, UnicodeDecodeError):
+                METRICS.inc(str(self), 'rides_malformed')
+                continue
+            for column, value in zip(columns, ride):
+                column.extend(value)
+        return columns
@@ -0,0 +1,211 @@
+from typing import Dict, List, Tuple
+import itertools
+import threading
+import zlib
+import pandas as pd
+
+from NetworkNode import *
+from App.message_app import COLS
+from App.server_app import ServerApp
+
+# strategies spreading the rides over the shards: round-robin, or a hash of the line number of the ride (a field
+# shared by all the riders of a line, so it identifies no rider)
+SHARD_ROUND_ROBIN = 'round-robin'
+SHARD_HASH = 'hash'
+SHARD_STRATEGIES = (SHARD_ROUND_ROBIN, SHARD_HASH)
+# default seconds between two merges of the shards databases into the merged rides database
+MERGE_INTERVAL = 1
+
+
+def shard_key(line_number: int) -> bytes:
+    """
+    :param line_number: line number of a ride
+    :return: key of the ride for the hash strategy
+    """
+    return str(line_number).encode()
+
+
+class ShardMap:
+    """
+    addresses of the shards of the MoT server, and the shard every ride is sent to. the shards share the key pair of
+    the server, so a client encrypts its rides the same way for all of them
+    """
+
+    def __init__(self, shards: List[Tuple[str, int]], strategy: str = SHARD_ROUND_ROBIN) -> None:
+        """
+        init a shard map instance
+        :param shards: ip address and port number of every shard
+        :param strategy: strategy spreading the rides over the shards (SHARD_ROUND_ROBIN or SHARD_HASH)
+        """
+        if len(shards) == 0:
+            raise ValueError('a shard map needs at least one shard')
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f'unknown shard strategy {strategy}')
+        self.shards = list(shards)
+        self.strategy = strategy
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def __str__(self) -> str:
+        return f'{len(self.shards)} shards ({self.strategy})'
+
+    @staticmethod
+    def consecutive(address: str, port: int, n_shards: int, strategy: str = SHARD_ROUND_ROBIN):
+        """
+        :param address: ip address of the shards
+        :param port: port number of the first shard, the next shards listen on the next port numbers
+        :param n_shards: number of shards
+        :param strategy: strategy spreading the rides over the shards
+        :return: shard map of the shards
+        """
+        return ShardMap([(address, port + i) for i in range(n_shards)], strategy)
+
+    def pick(self, key: bytes) -> Tuple[str, int]:
+        """
+        :param key: key of a ride (used by the hash strategy only)
+        :return: ip address and port number of the shard of the ride
+        """
+        if len(self.shards) == 1:
+            return self.shards[0]
+        if self.strategy == SHARD_HASH:
+            return self.shards[zlib.crc32(key) % len(self.shards)]
+        with self._lock:
+            return self.shards[next(self._next) % len(self.shards)]
+
+    def assign(self, keys: List[bytes]) -> Dict[Tuple[str, int], List[int]]:
+        """
+        spread a batch of rides over the shards. with the round-robin strategy, the whole batch goes to the next
+        shard (so it stays inside a single onion)
+        :param keys: keys of the rides
+        :return: indexes of the rides of every shard
+        """
+        if self.strategy != SHARD_HASH:
+            return {self.pick(b''): list(range(len(keys)))}
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.pick(key), []).append(i)
+        return groups
+
+
+class ShardedServerApp:
+    """
+    sharded MoT server: several server apps (the shards) listening on consecutive ports and sharing the key pair of
+    the server, each one ingesting its rides into its own database on its own threads. the databases of the shards
+    are merged periodically into a single rides database
+    """
+
+    def __init__(self, host: str, port: int, n_shards: int, name: str = 'ShardedServerApp',
+                 timeout: float = SOCKET_TIMEOUT, verbose: bool = False, n_workers: int = 1,
+                 transport: str = TRANSPORT_TCP, merge_interval: float = MERGE_INTERVAL) -> None:
+        """
+        init a sharded server application instance
+        :param host: ip address of the shards
+        :param port: port number of the first shard, the next shards listen on the next port numbers
+        :param n_shards: number of shards
+        :param name: name of application (optional)
+        :param timeout: seconds without incoming messages before a shard disconnects
+        :param verbose: print every received message
+        :param n_workers: number of processes of every shard
+        :param transport: name of the transport the shards listen on
+        :param merge_interval: seconds between two merges of the shards databases
+        """
+        if n_shards <= 0:
+            raise ValueError('the number of shards must be positive')
+        self.name = name
+        self.shards = []
+        try:
+            for i in range(n_shards):
+                self.shards.append(ServerApp(host, port + i, name=f'{name}-shard{i}', timeout=timeout,
+                                             verbose=verbose, n_workers=n_workers, transport=transport))
+        # release the ports of the shards already set up
+        except OSError:
+            for shard in self.shards:
+                shard.close_app()
+            raise
+        # the first shard stands for the whole server (address, port and public key)
+        self.server = self.shards[0].server
+        # merged rides database, and the number of rows of every shard database already merged into it
+        self._rides_database = pd.DataFrame(columns=COLS)
+        self._merged_rows = [0] * n_shards
+        self._merge_lock = threading.Lock()
+        self._merge_interval = merge_interval
+        self._stop = threading.Event()
+        self._thread_merge = threading.Thread(target=self.merge_periodically, name=f'{self}-merge')
+
+    def __str__(self) -> str:
+        return f'{self.name}-{self.server.address}'
+
+    def __repr__(self) -> str:
+        return self.name
+
+    def shard_map(self, strategy: str = SHARD_ROUND_ROBIN) -> ShardMap:
+        """
+        :param strategy: strategy spreading the rides over the shards
+        :return: shard map of the shards, for the clients
+        """
+        return ShardMap([(shard.server.get_ip_address(), shard.server.get_port()) for shard in self.shards],
+                        strategy)
+
+    def start_app(self) -> None:
+        """
+        start the threads of the shards, and the periodic merge
+        :return:
+        """
+        for shard in self.shards:
+            shard.start_app()
+        self._thread_merge.start()
+
+    def join_app(self) -> None:
+        """
+        join the threads of the shards (once all of them disconnected), then the periodic merge
+        :return:
+        """
+        for shard in self.shards:
+            shard.join_app()
+        self._stop.set()
+        self._thread_merge.join()
+
+    def close_app(self) -> None:
+        """
+        close the sockets of the shards
+        :return:
+        """
+        for shard in self.shards:
+            shard.close_app()
+
+    def merge_periodically(self) -> None:
+        """
+        merge the databases of the shards every merge interval, until the shards are joined
+        :return:
+        """
+        while not self._stop.wait(self._merge_interval):
+            self.merge()
+        self.merge()
+
+    def merge(self) -> int:
+        """
+        append the rows stored by the shards since the previous merge to the merged rides database
+        :return: number of merged rows
+        """
+        with self._merge_lock:
+            chunks = []
+            for i, shard in enumerate(self.shards):
+                database = shard.get_rides_database()
+                if len(database) > self._merged_rows[i]:
+                    chunks.append(database.iloc[self._merged_rows[i]:])
+                    self._merged_rows[i] = len(database)
+            merged = sum(len(chunk) for chunk in chunks)
+            if merged > 0:
+                self._rides_database = pd.concat([self._rides_database] + chunks, ignore_index=True)
+                METRICS.mark(str(self), 'rides_merged', merged)
+            return merged
+
+    def get_rides_database(self) -> pd.DataFrame:
+        """
+        :return: merged rides database of all the shards
+        """
+        self.merge()
+        return self._rides_database
@@ -1,13 +1,42 @@
 from NetworkNode.node import Node, MSG_MAX_SIZE, POST, DEST, PORT, SOCKET_TIMEOUT, PSEUDONYM_LEN, \
-    DEBUG_MODE, END
-from NetworkNode.server import Server
+    DEBUG_MODE, END, SEND_OK, SEND_BUSY, SEND_FAILED, LAYER_AEAD, LAYER_FERNET, LAYER_FORMATS
+from NetworkNode.server import Server, LISTEN_BACKLOG, BUFFER_HIGH_WATER
 from NetworkNode.client import Client
-from NetworkNode.relay import Relay, POOL_SIZE, Packet
+from NetworkNode.relay import Relay, POOL_SIZE, POOL_HIGH_WATER, Packet
+from NetworkNode.cover import CoverTraffic, COVER_RATE
+from NetworkNode.workers import ServerWorkers
+from NetworkNode.replay import ReplayFilter
+from NetworkNode.circuit import Circuit, CircuitTable, CIRCUIT_CAPACITY, CIRCUIT_TTL
+from NetworkNode.transport import Transport, TcpTransport, UnixTransport, InprocTransport, Routes, ROUTES, \
+    TRANSPORTS, TRANSPORT_TCP, TRANSPORT_UNIX, TRANSPORT_INPROC
+from NetworkNode.mixpool import MixPool, MixingPolicy, ThresholdPolicy, TimedPolicy, PoolPolicy, make_policy, \
+    POLICIES, POLICY_THRESHOLD, POLICY_TIMED, POLICY_POOL
+from NetworkNode.anonymity import FLUSH_OBSERVER, FlushObserver
+from NetworkNode.health import HealthTracker
+from NetworkNode.config import NodeConfig, ConfigWatcher
+from NetworkNode.precompute import OnionPool, ONION_POOL_DEPTH
+from NetworkNode.metrics import METRICS, Metrics, MetricsServer, MetricsDumper
+from NetworkNode.tracing import TRACER, Tracer
+from NetworkNode.profiling import PROFILER, Profiler
 
 __all__ = ['Node', 'MSG_MAX_SIZE', 'POST', 'DEST', 'PORT', 'SOCKET_TIMEOUT', 'PSEUDONYM_LEN',
-           'DEBUG_MODE', 'END',
+           'DEBUG_MODE', 'END', 'SEND_OK', 'SEND_BUSY', 'SEND_FAILED', 'LAYER_AEAD', 'LAYER_FERNET', 'LAYER_FORMATS',
 
-           'Server',
+           'Server', 'ServerWorkers', 'LISTEN_BACKLOG', 'BUFFER_HIGH_WATER',
            'Client',
-           'Relay', 'POOL_SIZE', 'Packet',
+           'Relay', 'POOL_SIZE', 'POOL_HIGH_WATER', 'Packet',
+           'CoverTraffic', 'COVER_RATE',
+           'ReplayFilter',
+           'Circuit', 'CircuitTable', 'CIRCUIT_CAPACITY', 'CIRCUIT_TTL',
+           'Transport', 'TcpTransport', 'UnixTransport', 'InprocTransport', 'Routes', 'ROUTES',
+           'TRANSPORTS', 'TRANSPORT_TCP', 'TRANSPORT_UNIX', 'TRANSPORT_INPROC',
+           'MixPool', 'MixingPolicy', 'ThresholdPolicy', 'TimedPolicy', 'PoolPolicy', 'make_policy',
+           'POLICIES', 'POLICY_THRESHOLD', 'POLICY_TIMED', 'POLICY_POOL',
+           'FLUSH_OBSERVER', 'FlushObserver',
+           'HealthTracker',
+           'NodeConfig', 'ConfigWatcher',
+           'OnionPool', 'ONION_POOL_DEPTH',
+           'METRICS', 'Metrics', 'MetricsServer', 'MetricsDumper',
+           'TRACER', 'Tracer',
+           'PROFILER', 'Profiler',
            ]
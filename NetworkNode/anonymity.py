@@ -0,0 +1,153 @@
+# python imports
+import bisect
+import math
+import threading
+from collections import Counter
+from typing import Dict, List
+
+# project imports
+from NetworkNode.metrics import percentile
+
+# input groups whose probability of being inside a flush drops below this weight are forgotten
+MIN_WEIGHT = 1e-9
+# percentiles of the per-flush entropy reported by the summary
+ENTROPY_PERCENTILES = (5, 50)
+
+
+class _RelayFlushes:
+    """
+    flushes of a single relay. the inputs of the relay are grouped by the flush interval they arrived in: the inputs of
+    a group are indistinguishable to an observer of the relay, and every input still inside the pool is equally likely
+    to be taken by a flush (MixPool.take_random), so a group keeps the probability of having survived every flush since
+    its arrival
+    """
+
+    def __init__(self) -> None:
+        # [number of inputs, probability for each of them to still be inside the pool] of every input group
+        self.groups = []
+        # pool size left after the previous flush
+        self.left = 0
+        # times of the flushes, and a record of every flush
+        self.times = []
+        self.flushes = []
+        # number of flushes every output waited inside the pool for
+        self.rounds = Counter()
+
+    def flush(self, now: float, pool_size: int, arrivals: List[float]) -> dict:
+        """
+        account a flush of the relay
+        :param now: monotonic time of the flush
+        :param pool_size: number of packets inside the pool before the flush
+        :param arrivals: arrival times of the flushed packets
+        :return: record of the flush
+        """
+        # the inputs which arrived since the previous flush form a new group
+        arrived = max(pool_size - self.left, 0)
+        if arrived > 0:
+            self.groups.append([arrived, 1.])
+        # an output of this flush is any input still inside the pool, with a probability proportional to the
+        # probability of the input to be still inside it
+        total = sum(count * weight for count, weight in self.groups)
+        entropy = 0.
+        for count, weight in self.groups:
+            p = weight / total
+            entropy -= count * p * math.log2(p)
+        record = {'time': now, 'pool_size': pool_size, 'flushed': len(arrivals), 'arrived': arrived,
+                  'anonymity_set': sum(count for count, _ in self.groups), 'entropy': entropy}
+        # the rounds every flushed packet waited for: the flushes of the relay since its arrival
+        for arrival in arrivals:
+            self.rounds[len(self.times) - bisect.bisect_left(self.times, arrival)] += 1
+        # every input still inside the pool survives the flush with probability 1 - flushed / pool_size
+        survival = 1 - len(arrivals) / pool_size if pool_size else 0.
+        self.groups = [[count, weight * survival] for count, weight in self.groups if weight * survival >= MIN_WEIGHT]
+        self.left = pool_size - len(arrivals)
+        self.times.append(now)
+        self.flushes.append(record)
+        return record
+
+
+class FlushObserver:
+    """
+    instrumentation of the mixing of the relays, for benchmark runs only. when enabled, every relay reports the
+    composition of every flush: the size of its pool and the arrival times of the flushed packets. the observer
+    derives, for every flush, the anonymity set of its outputs (the inputs each output may be) and its entropy (in
+    bits): the entropy of the probability distribution of the input an output is, as seen by an observer of the
+    inputs and the outputs of the relay.
+    when disabled (the default), the relays report nothing.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._relays: Dict[str, _RelayFlushes] = {}
+
+    def enable(self) -> None:
+        """
+        start observing the flushes (the previous observations are dropped)
+        :return:
+        """
+        with self._lock:
+            self._relays = {}
+        self.enabled = True
+
+    def disable(self) -> None:
+        """
+        stop observing the flushes (the observations are kept for the summary)
+        :return:
+        """
+        self.enabled = False
+
+    def record_flush(self, relay: str, now: float, pool_size: int, arrivals: List[float]) -> None:
+        """
+        record a flush of a relay
+        :param relay: name of the relay
+        :param now: monotonic time of the flush
+        :param pool_size: number of packets inside the pool before the flush
+        :param arrivals: arrival times of the flushed packets
+        :return:
+        """
+        with self._lock:
+            flushes = self._relays.get(relay)
+            if flushes is None:
+                flushes = self._relays[relay] = _RelayFlushes()
+            flushes.flush(now, pool_size, arrivals)
+
+    def summary(self) -> dict:
+        """
+        :return: per relay and overall: number of flushes, mean anonymity set, mean and percentiles of the entropy
+        per flush (weighted by the flushed packets), effective anonymity set (2 ** entropy), and the histogram of
+        the flushes every packet waited inside the pool for
+        """
+        with self._lock:
+            relays = {relay: self._summarize(flushes.flushes, flushes.rounds)
+                      for relay, flushes in self._relays.items()}
+            all_flushes = [record for flushes in self._relays.values() for record in flushes.flushes]
+            rounds = sum((flushes.rounds for flushes in self._relays.values()), Counter())
+        summary = self._summarize(all_flushes, rounds)
+        summary['relays'] = relays
+        return summary
+
+    @staticmethod
+    def _summarize(flushes: List[dict], rounds: Counter) -> dict:
+        """
+        :param flushes: records of flushes
+        :param rounds: histogram of the flushes the packets waited for
+        :return: summary of the flushes
+        """
+        outputs = sum(record['flushed'] for record in flushes)
+        # every flushed packet gets the entropy of its flush
+        entropies = sorted(e for record in flushes for e in [record['entropy']] * record['flushed'])
+        mean_entropy = sum(entropies) / outputs if outputs else 0.
+        summary = {'flushes': len(flushes),
+                   'outputs': outputs,
+                   'anonymity_set': sum(r['anonymity_set'] * r['flushed'] for r in flushes) / outputs if outputs else 0.,
+                   'entropy': mean_entropy,
+                   'effective_set': 2 ** mean_entropy,
+                   'entropy_min': entropies[0] if entropies else 0.,
+                   'rounds': {str(n): count for n, count in sorted(rounds.items())}}
+        for q in ENTROPY_PERCENTILES:
+            summary[f'entropy_p{q}'] = percentile(entropies, q)
+        return summary
+
+
+FLUSH_OBSERVER = FlushObserver()
@@ -0,0 +1,197 @@
+# python imports
+import struct
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from secrets import token_bytes
+from typing import List, Optional, Tuple
+
+# project imports
+from NetworkNode.utils import AEAD_KEY_LEN, AEAD_NONCE_LEN, AEAD_TAG_LEN, generate_aead_key, encrypt_aead, \
+    decrypt_aead
+
+# size in bytes of a circuit id (chosen by the client, a different one for every hop of the circuit)
+CIRCUIT_ID_LEN = 16
+# default maximal number of circuits remembered by a relay
+CIRCUIT_CAPACITY = 65536
+# default seconds a relay remembers a circuit after its setup
+CIRCUIT_TTL = 600
+# default maximal number of frames kept by a relay while their circuit is not set up yet, and seconds they are kept
+CIRCUIT_PENDING = 1024
+CIRCUIT_PENDING_TTL = 10
+# a client renews its circuit after this fraction of the ttl of the relays, before they forget it
+CIRCUIT_RENEW = 0.5
+# marker of the layer setting up a circuit at a relay, heading its encrypted header
+CIRCUIT_LAYER = b'CIRC'
+# header of a circuit setup layer (encrypted with the public key of the relay): marker, key of the circuit at the relay
+# (also encrypting the setup layer itself), nonce and ciphertext length of the setup layer, circuit id at the relay
+CIRCUIT_HEADER = struct.Struct(f'>{len(CIRCUIT_LAYER)}s{AEAD_KEY_LEN}s{AEAD_NONCE_LEN}sI{CIRCUIT_ID_LEN}s')
+# header of a circuit frame (in the clear, authenticated with the frame): circuit id, nonce, ciphertext length
+CIRCUIT_FRAME = struct.Struct(f'>{CIRCUIT_ID_LEN}s{AEAD_NONCE_LEN}sI')
+
+# a circuit at a relay: its key, the next hop of its frames, and its expiry (monotonic time)
+CircuitHop = namedtuple('CircuitHop', ['key', 'dest', 'port', 'expires'])
+
+
+class CircuitTable:
+    """
+    bounded table of the circuits set up at a relay, by circuit id. circuits expire ttl seconds after their setup;
+    when the table is full, the oldest circuit is forgotten (its client sets up a new one when it renews it).
+    the setup onion of a circuit is mixed in the pools like any packet, so the first frames of the circuit may overtake
+    it: a frame of an unknown circuit is kept (for a while) until the setup arrives.
+    """
+
+    def __init__(self, capacity: int = CIRCUIT_CAPACITY, ttl: float = CIRCUIT_TTL, pending: int = CIRCUIT_PENDING,
+                 pending_ttl: float = CIRCUIT_PENDING_TTL) -> None:
+        """
+        init a circuit table instance
+        :param capacity: maximal number of circuits
+        :param ttl: seconds a circuit is remembered after its setup
+        :param pending: maximal number of frames kept while their circuit is unknown
+        :param pending_ttl: seconds such a frame is kept
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.pending = pending
+        self.pending_ttl = pending_ttl
+        # circuits by id, in setup order (which is also the expiry order)
+        self._circuits = OrderedDict()
+        # frames of unknown circuits, in arrival order: (circuit id, frame, expiry)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._circuits)
+
+    def add(self, circuit_id: bytes, key: bytes, dest: bytes, port: int) -> List[bytes]:
+        """
+        remember a circuit set up at the relay
+        :param circuit_id: id of the circuit at the relay
+        :param key: key of the circuit at the relay
+        :param dest: ip address of the next hop
+        :param port: port number of the next hop
+        :return: frames of the circuit received before its setup
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._circuits.pop(circuit_id, None)
+            while len(self._circuits) >= self.capacity:
+                self._circuits.popitem(last=False)
+            self._circuits[circuit_id] = CircuitHop(key, dest, port, now + self.ttl)
+            if not self._pending:
+                return []
+            frames = [frame for pending_id, frame, _ in self._pending if pending_id == circuit_id]
+            if frames:
+                self._pending = deque(item for item in self._pending if item[0] != circuit_id)
+            return frames
+
+    def defer(self, circuit_id: bytes, frame: bytes) -> None:
+        """
+        keep a frame of an unknown circuit until the circuit is set up (the oldest kept frame is dropped when too many
+        frames are kept)
+        :param circuit_id: id of the circuit of the frame
+        :param frame: received frame
+        :return:
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if len(self._pending) >= self.pending:
+                self._pending.popleft()
+            self._pending.append((circuit_id, frame, now + self.pending_ttl))
+
+    def get(self, circuit_id: bytes) -> Optional[CircuitHop]:
+        """
+        :param circuit_id: id of a circuit at the relay
+        :return: the circuit, or None if it is unknown or expired
+        """
+        with self._lock:
+            circuit = self._circuits.get(circuit_id)
+            if circuit is None:
+                return None
+            if circuit.expires <= time.monotonic():
+                del self._circuits[circuit_id]
+                return None
+            return circuit
+
+    def _expire(self, now: float) -> None:
+        """
+        forget the expired circuits (the oldest ones), and the expired kept frames
+        :param now: current monotonic time
+        :return:
+        """
+        while self._circuits:
+            circuit_id, circuit = next(iter(self._circuits.items()))
+            if circuit.expires > now:
+                break
+            del self._circuits[circuit_id]
+        while self._pending and self._pending[0][2] <= now:
+            self._pending.popleft()
+
+
+class Circuit:
+    """
+    circuit of a client through its relays chain: a circuit id and a key for every hop, set up by a single setup onion.
+    the next messages are sent as nested frames encrypted with the keys of the hops only (no public key operation)
+    """
+
+    def __init__(self, n_hops: int, ttl: float = CIRCUIT_TTL * CIRCUIT_RENEW) -> None:
+        """
+        init a new circuit (not set up yet)
+        :param n_hops: number of relays of the circuit
+        :param ttl: seconds the client uses the circuit before renewing it
+        """
+        # circuit id and key of every hop, from the head relay to the last one
+        self.hops = [(token_bytes(CIRCUIT_ID_LEN), generate_aead_key()) for _ in range(n_hops)]
+        self.expires = time.monotonic() + ttl
+        # true once the setup onion was accepted by the head relay
+        self.established = False
+
+    def is_expired(self) -> bool:
+        """
+        :return: true if the circuit should be renewed
+        """
+        return time.monotonic() >= self.expires
+
+    def frame(self, msg: bytes, nonces: List[bytes] = None) -> bytes:
+        """
+        wrap a message into the nested frames of the circuit
+        :param msg: message for the destination of the circuit
+        :param nonces: filled with the nonce of every hop (from the head relay), if given
+        :return: frame for the head relay
+        """
+        frame = msg
+        hop_nonces = []
+        for circuit_id, key in reversed(self.hops):
+            nonce = token_bytes(AEAD_NONCE_LEN)
+            header = CIRCUIT_FRAME.pack(circuit_id, nonce, len(frame) + AEAD_TAG_LEN)
+            frame = header + encrypt_aead(key, nonce, frame, header)
+            hop_nonces.append(nonce)
+        if nonces is not None:
+            nonces.extend(reversed(hop_nonces))
+        return frame
+
+
+def is_frame(data: bytes) -> bool:
+    """
+    :param data: received packet (possibly followed by padding)
+    :return: true if the packet is well-formed as a circuit frame: its clear header, followed by a ciphertext of the
+    length of the header. a random packet (or an onion layer) is taken for a frame with a probability of about 2^-20
+    """
+    if len(data) < CIRCUIT_FRAME.size + AEAD_TAG_LEN:
+        return False
+    _, _, length = CIRCUIT_FRAME.unpack_from(data)
+    return AEAD_TAG_LEN <= length <= len(data) - CIRCUIT_FRAME.size
+
+
+def open_frame(frame: bytes, circuit: CircuitHop) -> Tuple[bytes, bytes]:
+    """
+    decrypt the frame of a circuit at a relay
+    :param frame: received frame (possibly followed by padding)
+    :param circuit: circuit of the frame at the relay
+    :return: nonce of the frame, and its content: the frame for the next hop
+    """
+    header = frame[:CIRCUIT_FRAME.size]
+    _, nonce, length = CIRCUIT_FRAME.unpack(header)
+    return nonce, decrypt_aead(circuit.key, nonce, frame[CIRCUIT_FRAME.size:CIRCUIT_FRAME.size + length], header)
@@ -1,11 +1,21 @@
 # python imports
+import threading
 from typing import List, Tuple
 from secrets import token_bytes
 
 # project imports
-from NetworkNode.node import Node, PSEUDONYM_LEN, DEBUG_MODE, CORE_MSG_SIZE, MAX_TRIES
+from NetworkNode.node import Node, PSEUDONYM_LEN, DEBUG_MODE, CORE_MSG_SIZE, MAX_TRIES, COVER_HOST, COVER_PORT, \
+    MSG_MAX_SIZE, HYBRID, HYBRID_HEADER, SEND_OK, SEND_FAILED, LAYER_AEAD, LAYER_FERNET, LAYER_FORMATS, AEAD_LAYER, \
+    LAYER_HEADER, FERNET_HEADER, POST, DEST, PORT, END, DEST_WIDTH, PORT_WIDTH
 from NetworkNode.relay import Relay
 from NetworkNode.utils import *
+from NetworkNode.metrics import METRICS
+from NetworkNode.entropy import random_bytes
+from NetworkNode.circuit import Circuit, CIRCUIT_LAYER, CIRCUIT_HEADER
+from NetworkNode.tracing import TRACER, STAGE_CLIENT_START, STAGE_ONION_BUILT, STAGE_CLIENT_SENT
+from NetworkNode.health import HealthTracker
+from NetworkNode.config import NodeConfig
+from NetworkNode.precompute import OnionPool
 
 
 class Client(Node):
@@ -13,13 +23,21 @@ class Client(Node):
     represents a client in the network
     """
 
-    def __init__(self, address: str, keys: Tuple[str, str] = ('client_pr_key', 'client_pb_key')) -> None:
+    def __init__(self, address: str, keys: Tuple[str, str] = ('client_pr_key', 'client_pb_key'),
+                 layer_format: str = LAYER_AEAD, circuit_mode: bool = False, config: NodeConfig = None) -> None:
         """
         init a client instance
         :param address: ip address of the client
         :param keys: private and public keys of the client
+        :param layer_format: format of the onion layers (LAYER_AEAD or LAYER_FERNET). the relays peel both formats
+        :param circuit_mode: set up a circuit through the relays chain with the first message (an onion), and send the
+        next messages as circuit frames: the relays then peel them with symmetric keys only
+        :param config: tuning of the client (tries and timeout of its sends, depth of its onion pool)
         """
-        super().__init__(address, keys)
+        if layer_format not in LAYER_FORMATS:
+            raise ValueError(f'unknown layer format {layer_format}')
+        super().__init__(address, keys, config)
+        self.layer_format = layer_format
         # set of all known relay nodes
         self._relays = set()
         # head relay in the chain
@@ -28,6 +46,15 @@ class Client(Node):
         self._host_pb_key = None
         # symmetric key for onion encryption
         self._key_sym = load_key('client_key_sym')
+        # circuit through the relays chain (in circuit mode)
+        self.circuit_mode = circuit_mode
+        # circuits of the messages and of the cover traffic: their circuit and its path, by kind (cover or not)
+        self._circuits = {}
+        self._circuit_lock = threading.Lock()
+        # liveness of the relays, as seen by the sends of the client
+        self.health = HealthTracker(name=repr(self))
+        # onion shells precomputed in idle time (None: the onions are built on the send path)
+        self._onion_pool = OnionPool(self.config.onion_pool, repr(self)) if self.config.onion_pool > 0 else None
 
     def __str__(self) -> str:
         return f'Client-{self.address}'
@@ -44,38 +71,133 @@ class Client(Node):
     def __hash__(self) -> int:
         return hash((self.address, self.get_public_key()))
 
-    def send(self, host: str, port: int, msg: bytes) -> None:
+    def send(self, host: str, port: int, msg: bytes) -> str:
         """
         send the given message to host::port
         :param host: host ip address
         :param port: port number of host
         :param msg: message to send
-        :return:
+        :return: status of the sending (SEND_OK, SEND_BUSY or SEND_FAILED)
         """
         # print(f'{self}: sending...', end='')
-        super().send(host, port, msg)
+        return super().send(host, port, msg, self.config.max_tries, self.config.send_timeout, self.health)
 
-    def send_through_chain(self, host: str, port: int, msg: bytes) -> None:
+    def send_through_chain(self, host: str, port: int, msg: bytes) -> str:
         """
-        send the given message to host::port through the mixnet chain
+        send the given message to host::port through the mixnet chain, around the relays taken for down. a head relay
+        detected down while sending fails over: the message is sent again, through the next relays of the chain
         :param host: host/server ip address: last destination in the onion layers
         :param port: port number of the host/server
         :param msg: message to be sent to the server
-        :return:
+        :return: status of the sending to the first hop (SEND_OK, SEND_BUSY or SEND_FAILED)
         """
         # if no relays are known to the client, send original message directly to the server
         if self._head_relay is None:
             # add random bytes to the message
-            self.send(host, port, token_bytes(PSEUDONYM_LEN) + msg)
+            status = self.send(host, port, random_bytes(PSEUDONYM_LEN) + msg)
         # send onion message through the known relays chain
         else:
             # add random bytes to the core-message
-            core_msg = token_bytes(PSEUDONYM_LEN) + msg
-            onion = self.onion_msg(host, port, core_msg, self._head_relay)
-            # assert len(onion) <= MSG_MAX_SIZE, f'size is {len(onion)}'
-            # print(f'onion size is: {len(onion)}')
-            wrapped_onion = Node.wrap_message(onion)
-            self.send(self._head_relay.address, self._head_relay.port, wrapped_onion)
+            core_msg = random_bytes(PSEUDONYM_LEN) + msg
+            # in benchmark mode, the random prefix of the core message is the trace id of the message
+            if TRACER.enabled:
+                TRACER.record(core_msg[:PSEUDONYM_LEN], str(self), STAGE_CLIENT_START)
+            for _ in range(len(self._relays)):
+                path = self._path()
+                with METRICS.timer(repr(self), 'onion_latency'):
+                    onion, circuit = self._route_msg(host, port, core_msg, path=path)
+                if TRACER.enabled:
+                    TRACER.record(core_msg[:PSEUDONYM_LEN], str(self), STAGE_ONION_BUILT)
+                # assert len(onion) <= MSG_MAX_SIZE, f'size is {len(onion)}'
+                # print(f'onion size is: {len(onion)}')
+                wrapped_onion = Node.wrap_frame(onion)
+                with METRICS.timer(repr(self), 'send_latency'):
+                    status = self.send(path[0].address, path[0].port, wrapped_onion)
+                self.circuit_sent(circuit, status)
+                if not self._fail_over(path, status):
+                    break
+            if TRACER.enabled:
+                TRACER.record(core_msg[:PSEUDONYM_LEN], str(self), STAGE_CLIENT_SENT)
+        if status != SEND_OK:
+            return status
+        METRICS.inc(repr(self), 'messages_sent')
+        METRICS.inc(repr(self), 'onions_sent')
+        return status
+
+    def send_batch_through_chain(self, host: str, port: int, msgs: List[bytes]) -> str:
+        """
+        send a batch of messages to host::port through the mixnet chain, inside as few onions as possible.
+        the batch is encrypted once for the host (hybrid encryption), instead of once per message. a batch too large
+        for a single onion is split in halves. like a single message, a batch fails over a head relay detected down
+        :param host: host/server ip address: last destination in the onion layers
+        :param port: port number of the host/server
+        :param msgs: messages to be sent to the server
+        :return: status of the sending to the first hop (SEND_OK, SEND_BUSY or SEND_FAILED; the worst status of the
+        onions of a split batch)
+        """
+        if len(msgs) == 0:
+            return SEND_OK
+        # random prefix of the core message (trace id of the batch in benchmark mode)
+        pseudonym = random_bytes(PSEUDONYM_LEN)
+        if TRACER.enabled:
+            TRACER.record(pseudonym, str(self), STAGE_CLIENT_START)
+        with METRICS.timer(repr(self), 'onion_latency'):
+            core_msg = self._seal_batch(pseudonym, msgs)
+            circuit = None
+            path = self._path()
+            if self._head_relay is None:
+                onion = core_msg
+            else:
+                onion, circuit = self._route_msg(host, port, core_msg, sealed=True, trace_id=pseudonym, path=path)
+        if len(onion) > MSG_MAX_SIZE:
+            if len(msgs) == 1:
+                raise ValueError(f'message is too large for an onion of {MSG_MAX_SIZE} bytes')
+            half = len(msgs) // 2
+            first = self.send_batch_through_chain(host, port, msgs[:half])
+            second = self.send_batch_through_chain(host, port, msgs[half:])
+            return first if first != SEND_OK else second
+        if TRACER.enabled:
+            TRACER.record(pseudonym, str(self), STAGE_ONION_BUILT)
+        with METRICS.timer(repr(self), 'send_latency'):
+            if self._head_relay is None:
+                status = self.send(host, port, onion)
+            else:
+                status = self.send(path[0].address, path[0].port, Node.wrap_frame(onion))
+                self.circuit_sent(circuit, status)
+        if self._head_relay is not None and self._fail_over(path, status):
+            return self.send_batch_through_chain(host, port, msgs)
+        if TRACER.enabled:
+            TRACER.record(pseudonym, str(self), STAGE_CLIENT_SENT)
+        if status != SEND_OK:
+            return status
+        METRICS.inc(repr(self), 'messages_sent', len(msgs))
+        METRICS.inc(repr(self), 'onions_sent')
+        return status
+
+    def send_cover(self) -> None:
+        """
+        send a cover (dummy) message through the mixnet chain. it is sized like a real message and is
+        indistinguishable from one until the last relay, which drops it instead of sending it to COVER_HOST
+        :return:
+        """
+        if self._head_relay is None:
+            return
+        path = self._path()
+        msg, circuit = self.cover_message(path)
+        status = self.send(path[0].address, path[0].port, Node.wrap_frame(msg))
+        self.circuit_sent(circuit, status)
+        METRICS.inc(repr(self), 'cover_sent')
+
+    def cover_message(self, path: List[Relay]) -> Tuple[bytes, Circuit]:
+        """
+        build a cover message to COVER_HOST through path: an onion, or in circuit mode a frame of the cover circuit of
+        the client (an onion setting up a new one, if it has no established cover circuit through path). the real
+        messages and the cover traffic are then built alike: onions, or frames after a setup onion
+        :param path: relays the message goes through
+        :return: message for the head relay of the path, and the circuit it sets up (None if it sets up no circuit)
+        """
+        # random bytes sized like a core message encrypted with the host public key
+        return self._route_msg(COVER_HOST, COVER_PORT, random_bytes(CORE_MSG_SIZE), sealed=True, path=path, cover=True)
 
     def get_relays(self) -> List[Relay]:
         """
@@ -99,6 +221,11 @@ class Client(Node):
         while current_relay.prev is not None:
             current_relay = current_relay.prev
         self._head_relay = current_relay
+        # circuits, or onion shells, through the previous chain are useless
+        with self._circuit_lock:
+            self._circuits.clear()
+        if self._onion_pool is not None:
+            self._onion_pool.invalidate()
 
     def set_host_pb_key(self, pb_key: rsa.RSAPublicKey) -> None:
         """
@@ -109,7 +236,9 @@ class Client(Node):
         if pb_key is not None:
             self._host_pb_key = pb_key
 
-    def onion_msg(self, host: str, port: int, msg: bytes, relay: Relay) -> bytes:
+    def onion_msg(self, host: str, port: int, msg: bytes, relay: Relay, sealed: bool = False,
+                  trace_id: bytes = None, circuit: List[Tuple[bytes, bytes]] = None,
+                  path: List[Relay] = None) -> bytes:
         """
         create msg following the onion encryption protocol.
 
@@ -117,15 +246,21 @@ class Client(Node):
         :param port: port number of the host server
         :param msg: core msg to send to the server
         :param relay: relay corresponding to the current layer
+        :param sealed: true if msg is already encrypted for the host (it is then used as the inner layer as is)
+        :param trace_id: trace id of the message in benchmark mode (default: the random prefix of msg)
+        :param circuit: circuit id and key of every hop from relay: the onion then sets up the circuit
+        :param path: relays after relay, the onion goes through (default: the chain after relay)
         :return: onion message
         """
         # if went through all the chain, or no chain was set for this client:
         # return the original message (no need to onion anything)
         if len(self._relays) == 0 or relay is None:
             return encrypt(self._host_pb_key, msg)
-        # if reached the last relay in the chain, return the last inner layer
-        if relay.next is None:
-            if DEBUG_MODE or self._host_pb_key is None:
+        if path is None:
+            path = Client.chain(relay.next)
+        # if reached the last relay in the path, return the last inner layer
+        if len(path) == 0:
+            if DEBUG_MODE or self._host_pb_key is None or sealed:
                 inner_layer = msg
             else:
                 # encrypt core msg with host public key
@@ -134,25 +269,261 @@ class Client(Node):
             cur_layer = Node.format_message(inner_layer,
                                             host.encode(),
                                             str(port).encode())
-            return self._encrypt_layer(relay.get_public_key(), cur_layer)
-        # recursive call with the next relay in the chain
+        # recursive call with the next relay in the path
         else:
-            cur_layer = Node.format_message(self.onion_msg(host, port, msg, relay.next),
-                                            relay.next.get_ip_address().encode(),
-                                            str(relay.next.get_port()).encode())
-            return self._encrypt_layer(relay.get_public_key(), cur_layer)
+            cur_layer = Node.format_message(self.onion_msg(host, port, msg, path[0], sealed, trace_id,
+                                                           circuit[1:] if circuit else None, path[1:]),
+                                            path[0].get_ip_address().encode(),
+                                            str(path[0].get_port()).encode())
+        # in benchmark mode, link the random prefix of the layer (seen by the relay) to the trace id
+        if TRACER.enabled:
+            TRACER.link(trace_id or msg[:PSEUDONYM_LEN], str(relay), cur_layer[:PSEUDONYM_LEN])
+        return self._encrypt_layer(relay.get_public_key(), cur_layer, circuit[0] if circuit else None)
+
+    def _route_msg(self, host: str, port: int, msg: bytes, sealed: bool = False, trace_id: bytes = None,
+                   path: List[Relay] = None, cover: bool = False) -> Tuple[bytes, Circuit]:
+        """
+        build the message for the head relay of the path: an onion, or in circuit mode a circuit frame (an onion
+        setting up a new circuit, if the client has no established circuit through the path)
+        :param host: ip address of the host server: last destination in the chain
+        :param port: port number of the host server
+        :param msg: core msg to send to the server
+        :param sealed: true if msg is already encrypted for the host
+        :param trace_id: trace id of the message in benchmark mode (default: the random prefix of msg)
+        :param path: relays the message goes through (default: the chain, around the relays taken for down)
+        :param cover: true for a cover message: sent on the cover circuit, apart from the circuit of the messages
+        :return: message for the head relay, and the circuit it sets up (None if it sets up no circuit)
+        """
+        if path is None:
+            path = self._path()
+        if not self.circuit_mode or DEBUG_MODE:
+            return self._onion(host, port, msg, path, sealed, trace_id), None
+        with self._circuit_lock:
+            circuit, circuit_path = self._circuits.get(cover, (None, None))
+            # a circuit through another path is useless
+            if circuit is None or circuit.is_expired() or circuit_path != path:
+                circuit = Circuit(len(path))
+                self._circuits[cover] = (circuit, path)
+        # until its setup onion was accepted, the messages set up the circuit again
+        if not circuit.established:
+            return self.onion_msg(host, port, msg, path[0], sealed, trace_id, circuit.hops, path[1:]), circuit
+        trace_id = trace_id or msg[:PSEUDONYM_LEN]
+        if not sealed and self._host_pb_key is not None:
+            msg = encrypt(self._host_pb_key, msg)
+        nonces = [] if TRACER.enabled else None
+        frame = circuit.frame(msg, nonces)
+        # in benchmark mode, link the nonce of every frame (seen by the relay) to the trace id
+        if TRACER.enabled:
+            for relay, nonce in zip(path, nonces):
+                TRACER.link(trace_id, str(relay), nonce[:PSEUDONYM_LEN])
+        if not cover:
+            METRICS.inc(repr(self), 'circuit_frames')
+        return frame, None
+
+    def stop_onion_pool(self) -> None:
+        """
+        stop precomputing onion shells (the next onions are built on the send path)
+        :return:
+        """
+        if self._onion_pool is not None:
+            self._onion_pool.stop()
+            self._onion_pool = None
+
+    def _onion(self, host: str, port: int, msg: bytes, path: List[Relay], sealed: bool = False,
+               trace_id: bytes = None) -> bytes:
+        """
+        build an onion through path, as onion_msg: from a precomputed shell if the onion pool holds one for the path,
+        on the spot otherwise. the shells are precomputed for single messages, whose inner layer (the core message
+        encrypted with the host public key) has a fixed size; a sealed batch is built on the spot
+        :param host: ip address of the host server: last destination in the chain
+        :param port: port number of the host server
+        :param msg: core msg to send to the server
+        :param path: relays the onion goes through
+        :param sealed: true if msg is already encrypted for the host
+        :param trace_id: trace id of the message in benchmark mode (default: the random prefix of msg)
+        :return: onion message
+        """
+        pool = self._onion_pool
+        if pool is None or sealed or DEBUG_MODE or self._host_pb_key is None or len(self._relays) == 0:
+            return self.onion_msg(host, port, msg, path[0], sealed, trace_id, path=path[1:])
+        lengths = Client._layer_lengths(host, port, path, self._host_pb_key.key_size // 8, self.layer_format)
+        # a change of the path (a relay taken for down), or of the key of a relay, invalidates the shells
+        key = (tuple(path), tuple(relay.get_public_key() for relay in path), self.layer_format, tuple(lengths))
+        shell = pool.take(key, lambda: self._build_shell(path, lengths))
+        if shell is None:
+            return self.onion_msg(host, port, msg, path[0], sealed, trace_id, path=path[1:])
+        # only the inner layer is encrypted with a public key on the send path
+        inner_layer = encrypt(self._host_pb_key, msg)
+        return self._fill_shell(shell, host, port, inner_layer, path, trace_id or msg[:PSEUDONYM_LEN])
 
-    def _encrypt_layer(self, pb_key: rsa.RSAPublicKey, layer: bytes) -> bytes:
+    @staticmethod
+    def _layer_lengths(host: str, port: int, path: List[Relay], inner_len: int,
+                       layer_format: str = LAYER_AEAD) -> List[int]:
+        """
+        :param host: ip address of the host server: last destination in the chain
+        :param port: port number of the host server
+        :param path: relays of the onion
+        :param inner_len: size of the inner layer (the core message encrypted with the host public key)
+        :param layer_format: format of the onion layers (LAYER_AEAD or LAYER_FERNET)
+        :return: size of the plain layer of every relay of the path (the head relay first), before its encryption
+        """
+        overhead = PSEUDONYM_LEN + len(POST) + len(DEST) + len(PORT) + len(END)
+        lengths = [overhead + inner_len + max(len(host), DEST_WIDTH) + max(len(str(port)), PORT_WIDTH)]
+        for relay, next_relay in zip(reversed(path[:-1]), reversed(path[1:])):
+            # the layer of next_relay, encrypted with its public key, inside the layer of relay
+            cipher_len = lengths[-1] + AEAD_TAG_LEN if layer_format == LAYER_AEAD else symm_cipher_len(lengths[-1])
+            encrypted = next_relay.get_public_key().key_size // 8 + cipher_len
+            lengths.append(overhead + encrypted + max(len(next_relay.get_ip_address()), DEST_WIDTH)
+                           + max(len(str(next_relay.get_port())), PORT_WIDTH))
+        return lengths[::-1]
+
+    def _build_shell(self, path: List[Relay], lengths: List[int]) -> List[Tuple[bytes, bytes, bytes]]:
+        """
+        precompute the public key encryptions of an onion through path (called by the refill thread of the onion pool)
+        :param path: relays of the onion
+        :param lengths: size of the plain layer of every relay, as returned by _layer_lengths
+        :return: shell of the onion: encrypted header, aead key and nonce of the layer of every relay (the head relay
+        first). a fernet layer has no key nor nonce: its header holds the symmetric key of the client
+        """
+        shell = []
+        for relay, length in zip(path, lengths):
+            if self.layer_format != LAYER_AEAD:
+                header = FERNET_HEADER.pack(self._key_sym, symm_cipher_len(length))
+                shell.append((encrypt(relay.get_public_key(), header), None, None))
+                continue
+            key = generate_aead_key()
+            nonce = token_bytes(AEAD_NONCE_LEN)
+            header = encrypt(relay.get_public_key(), LAYER_HEADER.pack(AEAD_LAYER, key, nonce, length + AEAD_TAG_LEN))
+            shell.append((header, key, nonce))
+        return shell
+
+    def _fill_shell(self, shell: List[Tuple[bytes, bytes, bytes]], host: str, port: int, inner_layer: bytes,
+                    path: List[Relay], trace_id: bytes) -> bytes:
+        """
+        fill in a precomputed shell: encrypt every layer, from the inner one, with the key already encrypted in its
+        header. the result is the onion onion_msg would build
+        :param shell: shell of the onion, as returned by _build_shell
+        :param host: ip address of the host server: last destination in the chain
+        :param port: port number of the host server
+        :param inner_layer: core message encrypted with the host public key
+        :param path: relays of the onion
+        :param trace_id: trace id of the message in benchmark mode
+        :return: onion message
+        """
+        layer = inner_layer
+        dest, dest_port = host.encode(), str(port).encode()
+        for relay, (header, key, nonce) in zip(reversed(path), reversed(shell)):
+            cur_layer = Node.format_message(layer, dest, dest_port)
+            # in benchmark mode, link the random prefix of the layer (seen by the relay) to the trace id
+            if TRACER.enabled:
+                TRACER.link(trace_id, str(relay), cur_layer[:PSEUDONYM_LEN])
+            if key is None:
+                layer = header + encrypt_symm(self._key_sym, cur_layer)
+            else:
+                layer = header + encrypt_aead(key, nonce, cur_layer, header)
+            dest, dest_port = relay.get_ip_address().encode(), str(relay.get_port()).encode()
+        return layer
+
+    def _path(self) -> List[Relay]:
+        """
+        :return: relays the next message goes through: the relays of the chain not taken for down (the whole chain, if
+        all of them are)
+        """
+        chain = Client.chain(self._head_relay)
+        path = [relay for relay in chain if self.health.is_available(relay.address, relay.port)]
+        return path if path else chain
+
+    @staticmethod
+    def chain(relay: Relay) -> List[Relay]:
+        """
+        :param relay: a relay of a chain
+        :return: the relays of the chain from relay
+        """
+        chain = []
+        while relay is not None:
+            chain.append(relay)
+            relay = relay.next
+        return chain
+
+    def _fail_over(self, path: List[Relay], status: str) -> bool:
+        """
+        :param path: relays a message was sent through
+        :param status: status of the sending to the head relay of the path
+        :return: true if the message should be sent again through another path: the head relay was detected down, and
+        another relay is available
+        """
+        if status != SEND_FAILED or self.health.is_available(path[0].address, path[0].port):
+            return False
+        if self._path()[0] is path[0]:
+            return False
+        METRICS.inc(repr(self), 'failovers')
+        return True
+
+    def circuit_sent(self, circuit: Circuit, status: str) -> None:
+        """
+        update the circuit set up by a sent message
+        :param circuit: circuit set up by the message (None if it sets up no circuit)
+        :param status: status of the sending
+        :return:
+        """
+        if circuit is None:
+            return
+        if status == SEND_OK:
+            circuit.established = True
+            METRICS.inc(repr(self), 'circuits_created')
+            return
+        # the setup was lost: set up a new circuit with the next message
+        with self._circuit_lock:
+            for cover, (current, _) in list(self._circuits.items()):
+                if current is circuit:
+                    del self._circuits[cover]
+
+    def _seal_batch(self, pseudonym: bytes, msgs: List[bytes]) -> bytes:
+        """
+        encrypt a batch of messages for the host (hybrid encryption): the batch is encrypted with a fresh aead key,
+        and only a short header holding this key is encrypted with the host public key
+        :param pseudonym: random prefix of the core message
+        :param msgs: messages of the batch
+        :return: core message: encrypted header (CORE_MSG_SIZE bytes) followed by the encrypted batch
+        """
+        payload = Node.pack_batch(msgs)
+        key = generate_aead_key()
+        nonce = token_bytes(AEAD_NONCE_LEN)
+        # in debug mode, the plain header is padded to the size of an encrypted one
+        if DEBUG_MODE or self._host_pb_key is None:
+            header = pseudonym + HYBRID_HEADER.pack(HYBRID, key, nonce, len(payload))
+            return header.ljust(CORE_MSG_SIZE, b'\0') + payload
+        # the pseudonym is authenticated with the batch
+        cipher_payload = encrypt_aead(key, nonce, payload, pseudonym)
+        header = pseudonym + HYBRID_HEADER.pack(HYBRID, key, nonce, len(cipher_payload))
+        return encrypt(self._host_pb_key, header) + cipher_payload
+
+    def _encrypt_layer(self, pb_key: rsa.RSAPublicKey, layer: bytes, hop: Tuple[bytes, bytes] = None) -> bytes:
         """
         encrypt the given layer according to the onion routing protocol
         :param pb_key: public key of the network component (relay, or server) to peel the created layer
         :param layer: message to wrap
+        :param hop: circuit id and key of the relay, if the layer sets up a circuit
         :return: encrypted layer
         """
         # in debug mode, just concatenate with the plain message
         if DEBUG_MODE or pb_key is None:
             return layer
-        # encrypt the client's symmetric key with the given public key and concatenate with the
+        # circuit setup layer: an aead layer encrypted with the key of the circuit, its header holding the circuit id
+        if hop is not None:
+            circuit_id, key = hop
+            nonce = token_bytes(AEAD_NONCE_LEN)
+            header = encrypt(pb_key, CIRCUIT_HEADER.pack(CIRCUIT_LAYER, key, nonce, len(layer) + AEAD_TAG_LEN,
+                                                         circuit_id))
+            return header + encrypt_aead(key, nonce, layer, header)
+        # encrypt a fresh aead key (with its nonce and the ciphertext length) with the given public key, and
+        # concatenate with the message encrypted with this key. the encrypted header is authenticated with the message
+        if self.layer_format == LAYER_AEAD:
+            key = generate_aead_key()
+            nonce = token_bytes(AEAD_NONCE_LEN)
+            header = encrypt(pb_key, LAYER_HEADER.pack(AEAD_LAYER, key, nonce, len(layer) + AEAD_TAG_LEN))
+            return header + encrypt_aead(key, nonce, layer, header)
+        # encrypt the client's symmetric key (with the token length) with the given public key and concatenate with the
         # message, encrypted with this symmetric key.
-        else:
-            return encrypt(pb_key, self._key_sym) + encrypt_symm(self._key_sym, layer)
+        token = encrypt_symm(self._key_sym, layer)
+        return encrypt(pb_key, FERNET_HEADER.pack(self._key_sym, len(token))) + token
@@ -0,0 +1,238 @@
+# python imports
+import json
+import os
+import sys
+import threading
+from typing import List
+
+# project imports
+from NetworkNode.mixpool import POLICY_THRESHOLD, POLICY_TIMED, POLICIES, MixingPolicy, make_policy
+from NetworkNode.precompute import ONION_POOL_DEPTH
+
+# default seconds without incoming connections before a node disconnects
+SOCKET_TIMEOUT = 60
+# default tries of a sender before it gives up on a message
+MAX_TRIES = 10
+# default seconds a sender waits to connect, send a message and get its reply
+SEND_TIMEOUT = 5
+# pool size limit of each mixnode/relay
+POOL_SIZE = 64
+# default high-water mark of the pool of a relay: over it, new packets get a busy reply
+POOL_HIGH_WATER = 16 * POOL_SIZE
+# default seconds between two checks of a watched configuration file
+RELOAD_INTERVAL = 1
+# key of the per-node sections of a configuration file, by ip address of the node
+NODES_KEY = 'nodes'
+
+
+def check_high_water(high_water: int, policy: MixingPolicy, pool_size: int = None) -> None:
+    """
+    raise a ValueError if a relay rejecting packets over high_water would never gather enough of them to flush
+    :param high_water: high-water mark of the relay (None: never reject)
+    :param policy: mixing policy of the relay
+    :param pool_size: pool size of the policy (default: its current one)
+    :return:
+    """
+    threshold = policy.flush_threshold(pool_size)
+    if high_water is not None and threshold is not None and high_water < threshold:
+        raise ValueError(f'the high-water mark ({high_water}) must be at least the flush threshold of the mixing '
+                         f'policy {policy} ({threshold} packets)')
+
+
+class NodeConfig:
+    """
+    tuning of a single node. a relay reads its pool size, mixing policy, flush interval and high-water mark from it, a
+    client the depth of its onion pool, and every node its timeout and the tries and timeout of its sends.
+    the sizes of the messages (MSG_MAX_SIZE, CORE_MSG_SIZE) and DEBUG_MODE are not part of it: every node of the mixnet
+    must agree on them, so they stay constants of NetworkNode/node.py
+    """
+    # parameters of a running relay which can be changed without restarting it
+    RELOADABLE = ('pool_size', 'flush_interval', 'high_water')
+    # every parameter, for the configuration files
+    FIELDS = ('pool_size', 'mix_policy', 'flush_interval', 'high_water', 'timeout', 'max_tries', 'send_timeout',
+              'onion_pool')
+    # types of the parameters, checked as the values of a configuration file may be of any json type
+    TYPES = {'pool_size': int, 'mix_policy': str, 'flush_interval': (int, float), 'high_water': int,
+             'timeout': (int, float), 'max_tries': int, 'send_timeout': (int, float), 'onion_pool': int}
+    # parameters which may be None
+    OPTIONAL = ('flush_interval', 'high_water')
+
+    def __init__(self, pool_size: int = POOL_SIZE, mix_policy: str = POLICY_THRESHOLD, flush_interval: float = None,
+                 high_water: int = POOL_HIGH_WATER, timeout: float = SOCKET_TIMEOUT, max_tries: int = MAX_TRIES,
+                 send_timeout: float = SEND_TIMEOUT, onion_pool: int = ONION_POOL_DEPTH) -> None:
+        """
+        init a node configuration instance
+        :param pool_size: number of packets gathered in the pool of a relay before a batch is sent
+        :param mix_policy: name of the mixing policy of a relay
+        :param flush_interval: flush interval of the timed policy, flush deadline of the threshold policy
+        :param high_water: packets inside the pool of a relay over which new packets are rejected (None: never reject)
+        :param timeout: seconds without incoming connections before the node disconnects
+        :param max_tries: tries of a send before the node gives up on the message
+        :param send_timeout: seconds a send waits to connect, send the message and get its reply
+        :param onion_pool: onion shells a client precomputes in idle time (0: the onions are built on the send path)
+        """
+        self.pool_size = pool_size
+        self.mix_policy = mix_policy
+        self.flush_interval = flush_interval
+        self.high_water = high_water
+        self.timeout = timeout
+        self.max_tries = max_tries
+        self.send_timeout = send_timeout
+        self.onion_pool = onion_pool
+        self.validate()
+
+    def __repr__(self) -> str:
+        return f'NodeConfig({", ".join(f"{name}={value}" for name, value in self.as_dict().items())})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, NodeConfig) and self.as_dict() == other.as_dict()
+
+    def validate(self) -> None:
+        """
+        raise a ValueError if a parameter is out of its range, or is not of its type
+        :return:
+        """
+        for name, types in NodeConfig.TYPES.items():
+            value = getattr(self, name)
+            if value is None and name in NodeConfig.OPTIONAL:
+                continue
+            # a json boolean is an int in python
+            if isinstance(value, bool) or not isinstance(value, types):
+                kind = {int: 'an integer', str: 'a string'}.get(types, 'a number')
+                raise ValueError(f'{name} must be {kind}, not {value!r}')
+        if self.pool_size <= 0:
+            raise ValueError('the pool size must be positive')
+        if self.mix_policy not in POLICIES:
+            raise ValueError(f'unknown mixing policy {self.mix_policy}')
+        if self.flush_interval is not None and self.flush_interval <= 0:
+            raise ValueError('the flush interval must be positive')
+        if self.mix_policy == POLICY_TIMED and self.flush_interval is None:
+            raise ValueError('the timed mixing policy needs a flush interval (--flush-interval)')
+        if self.high_water is not None and self.high_water <= 0:
+            raise ValueError('the high-water mark must be positive')
+        if self.timeout <= 0 or self.send_timeout <= 0:
+            raise ValueError('the timeouts must be positive')
+        if self.max_tries <= 0:
+            raise ValueError('the number of tries must be positive')
+        if self.onion_pool < 0:
+            raise ValueError('the depth of the onion pool must not be negative')
+        check_high_water(self.high_water, self.make_policy())
+
+    def as_dict(self) -> dict:
+        """
+        :return: parameters of the configuration
+        """
+        return {name: getattr(self, name) for name in NodeConfig.FIELDS}
+
+    def replace(self, **changes):
+        """
+        :param changes: new values of some parameters
+        :return: copy of the configuration with the given changes
+        """
+        unknown = set(changes) - set(NodeConfig.FIELDS)
+        if unknown:
+            raise ValueError(f'unknown configuration parameters: {", ".join(sorted(unknown))}')
+        return NodeConfig(**{**self.as_dict(), **changes})
+
+    def make_policy(self) -> MixingPolicy:
+        """
+        :return: new mixing policy of the configuration
+        """
+        return make_policy(self.mix_policy, self.pool_size, self.flush_interval)
+
+    @staticmethod
+    def from_file(path: str, address: str = None, base=None):
+        """
+        load the configuration of a node from a json file: the top-level parameters apply to every node, and the
+        section of the node under "nodes" (by ip address) overrides them, e.g.
+        {"pool_size": 32, "flush_interval": 0.5, "nodes": {"127.1.0.2": {"pool_size": 8}}}
+        :param path: path of the json file
+        :param address: ip address of the node (None: the top-level parameters only)
+        :param base: configuration the file parameters apply to (default: the default configuration)
+        :return: configuration of the node
+        """
+        with open(path) as file:
+            params = json.load(file)
+        if not isinstance(params, dict):
+            raise ValueError(f'{path}: a configuration file holds a json object')
+        nodes = params.pop(NODES_KEY, {})
+        if not isinstance(nodes, dict) or not all(isinstance(section, dict) for section in nodes.values()):
+            raise ValueError(f'{path}: "{NODES_KEY}" holds a json object per node ip address')
+        if address is not None:
+            params.update(nodes.get(address, {}))
+        return (base if base is not None else NodeConfig()).replace(**params)
+
+
+class ConfigWatcher:
+    """
+    hot reload of a configuration file: the file is checked every interval, and once it changed, its reloadable
+    parameters (NodeConfig.RELOADABLE) are applied to the running relays. a change of any other parameter needs a
+    restart of the relays: it is reported, and ignored
+    """
+
+    def __init__(self, path: str, relays: List, base: NodeConfig = None, interval: float = RELOAD_INTERVAL) -> None:
+        """
+        init a config watcher instance
+        :param path: path of the json configuration file
+        :param relays: running relays configured by the file
+        :param base: configuration the file parameters apply to (default: the default configuration)
+        :param interval: seconds between two checks of the file
+        """
+        self.path = path
+        self._relays = relays
+        self._base = base
+        self._interval = interval
+        self._mtime = self._modified()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'ConfigWatcher-{path}', daemon=True)
+
+    def start(self) -> None:
+        """
+        start watching the file in a background thread
+        :return:
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stop watching the file
+        :return:
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def reload(self) -> None:
+        """
+        load the file again, and reconfigure the relays
+        :return:
+        """
+        for relay in self._relays:
+            try:
+                config = NodeConfig.from_file(self.path, relay.address, self._base)
+            # a file being written, or a wrong value, keeps the current configuration
+            except (OSError, ValueError) as e:
+                print(f'{self.path}: configuration not reloaded: {e}', file=sys.stderr)
+                return
+            try:
+                ignored = relay.reconfigure(config)
+            except ValueError as e:
+                print(f'{relay}: configuration not reloaded: {e}', file=sys.stderr)
+                continue
+            if ignored:
+                print(f'{relay}: {", ".join(ignored)} changed, applied after a restart only', file=sys.stderr)
+
+    def _modified(self) -> float:
+        """
+        :return: modification time of the file (0 if it is missing)
+        """
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return 0.
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            mtime = self._modified()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
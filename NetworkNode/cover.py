@@ -0,0 +1,94 @@
+# python imports
+import random
+import threading
+import time
+from typing import Union
+
+# project imports
+from NetworkNode.node import CORE_MSG_SIZE, COVER_PORT, SEND_OK, LAYER_AEAD
+from NetworkNode.client import Client
+from NetworkNode.relay import Relay, Packet, COVER_DEST
+from NetworkNode.entropy import random_bytes
+
+# default mean rate (dummy onions per second) of the cover traffic of a node
+COVER_RATE = 1.
+
+
+class CoverTraffic:
+    """
+    cover traffic of a node: dummy onions injected at the times of a poisson process.
+    a dummy onion is sized like a real one and is peeled by every relay like a real one, so it fills the pools
+    (which then flush at low load) without being distinguishable from a ride. the last relay recognizes its
+    destination (COVER_HOST) and drops it before it reaches the server. in circuit mode, the dummy messages are the
+    frames of a cover circuit, like the rides.
+        - a client sends its dummy onions through its whole relays chain
+        - a relay injects its dummy onions directly into its own pool, as onions for the rest of the chain
+    """
+
+    def __init__(self, node: Union[Client, Relay], rate: float = COVER_RATE, circuit_mode: bool = False,
+                 layer_format: str = LAYER_AEAD) -> None:
+        """
+        init a cover traffic instance
+        :param node: client or relay injecting the cover traffic
+        :param rate: mean dummy onions per second
+        :param circuit_mode: a relay sends its dummy messages as circuit frames (a client follows its own mode)
+        :param layer_format: format of the onion layers of a relay's dummy onions, the format of the clients (a client
+        follows its own format)
+        """
+        self._node = node
+        self.rate = rate
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'Cover-{node}', daemon=True)
+        # a relay builds the onions of the rest of the chain as a client would
+        self._builder = None
+        if isinstance(node, Relay):
+            self._builder = Client(node.address, layer_format=layer_format, circuit_mode=circuit_mode)
+            self._builder.set_relays_chain([node])
+
+    def __str__(self) -> str:
+        return f'Cover-{self._node}'
+
+    def start(self) -> None:
+        """
+        start injecting cover traffic (no-op if the rate is not positive)
+        :return:
+        """
+        if self.rate > 0:
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stop injecting cover traffic
+        :return:
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        """
+        inject dummy onions until stopped, or until the relay disconnects
+        :return:
+        """
+        while not self._stop.wait(random.expovariate(self.rate)):
+            if self._builder is None:
+                self._node.send_cover()
+                continue
+            if not self._node.is_connected():
+                break
+            self._node.add_cover(self._relay_packet())
+
+    def _relay_packet(self) -> Packet:
+        """
+        :return: dummy packet for the pool of the relay: an onion (or a circuit frame) for the next relays, or a packet
+        to COVER_DEST if the relay is the last one of the chain
+        """
+        relay = self._node
+        if relay.next is None:
+            # random bytes sized like a core message encrypted with the host public key
+            return Packet(random_bytes(CORE_MSG_SIZE), COVER_DEST, COVER_PORT, time.monotonic())
+        msg, circuit = self._builder.cover_message(Client.chain(relay.next))
+        # the setup onion of a cover circuit is sent once it is in the pool: the next frames may overtake it, and are
+        # then kept by the next relay until the setup arrives
+        self._builder.circuit_sent(circuit, SEND_OK)
+        return Packet(msg, relay.next.address, relay.next.port, time.monotonic())
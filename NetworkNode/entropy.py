@@ -0,0 +1,73 @@
+# python imports
+import os
+import threading
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+# bytes generated at once, by every thread
+ENTROPY_POOL_SIZE = 64 * 1024
+# size in bytes of the key and of the nonce seeding every refill (AES-256 in counter mode)
+SEED_KEY_LEN = 32
+SEED_NONCE_LEN = 16
+
+
+class EntropyPool(threading.local):
+    """
+    per-thread buffer of random bytes, refilled in bulk: a draw is a slice of the buffer instead of a syscall.
+    a refill is the AES-CTR keystream of a fresh key and nonce drawn from the os CSPRNG: a few bytes from the os per
+    refill, and the bulk generated with AES-NI, several times faster than the os generator.
+    every byte is handed out once; a refill allocates a new buffer, so the slices handed out before stay valid (and
+    unchanged) until they are released.
+    """
+
+    def __init__(self, size: int = ENTROPY_POOL_SIZE) -> None:
+        """
+        init an entropy pool (the buffer of every thread is filled on its first draw)
+        :param size: bytes drawn from the os at once
+        """
+        self.size = size
+        self._view = memoryview(b'')
+        self._offset = 0
+
+    def take(self, n: int) -> memoryview:
+        """
+        :param n: number of random bytes
+        :return: view of n fresh random bytes
+        """
+        if n < 0:
+            raise ValueError('negative number of bytes')
+        if n > self.size:
+            return memoryview(self._draw(n))
+        if self._offset + n > len(self._view):
+            self._view = memoryview(self._draw(self.size))
+            self._offset = 0
+        view = self._view[self._offset:self._offset + n]
+        self._offset += n
+        return view
+
+    def _draw(self, n: int) -> bytes:
+        seed = os.urandom(SEED_KEY_LEN + SEED_NONCE_LEN)
+        encryptor = Cipher(algorithms.AES(seed[:SEED_KEY_LEN]), modes.CTR(seed[SEED_KEY_LEN:]),
+                           backend=default_backend()).encryptor()
+        return encryptor.update(bytes(n)) + encryptor.finalize()
+
+
+# shared by all the nodes of the process (every thread has its own buffers)
+RANDOM_POOL = EntropyPool()
+PADDING_POOL = EntropyPool()
+
+
+def random_bytes(n: int) -> bytes:
+    """
+    :param n: number of random bytes
+    :return: n random bytes (e.g. a pseudonym)
+    """
+    return RANDOM_POOL.take(n).tobytes()
+
+
+def padding_bytes(n: int) -> memoryview:
+    """
+    :param n: number of padding bytes
+    :return: view of n random padding bytes
+    """
+    return PADDING_POOL.take(n)
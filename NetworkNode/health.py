@@ -0,0 +1,172 @@
+# python imports
+import threading
+import time
+from typing import Dict, Tuple
+
+# project imports
+from NetworkNode.metrics import METRICS
+
+# states of the circuit breaker of a destination: closed (healthy, sends go through), open (down, sends fail fast),
+# half-open (a single send probes whether the destination recovered)
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+# consecutive failed connections after which a destination is taken for down
+FAILURE_THRESHOLD = 3
+# seconds a destination is taken for down, before a send probes it again
+OPEN_TIMEOUT = 2.
+# default name of a health tracker in the metrics
+HEALTH_NODE = 'Health'
+
+
+class _Breaker:
+    """
+    circuit breaker of a single destination
+    """
+
+    def __init__(self) -> None:
+        self.state = BREAKER_CLOSED
+        # consecutive failed connections, and the time of the first of them
+        self.failures = 0
+        self.failing_since = None
+        # time the breaker opened (the destination was detected down), and the time of its last failed probe
+        self.opened_at = None
+        self.retry_at = None
+
+
+class HealthTracker:
+    """
+    passive liveness tracking of the destinations of a sending node (a client): every connection of the node to a
+    destination is reported as a success or a failure. FAILURE_THRESHOLD consecutive failures open the circuit breaker
+    of the destination: the next sends of the node to it fail fast, and the node routes its onions around it.
+    open_timeout seconds later, a single send is let through to probe the destination, closing the breaker if it
+    succeeds (a busy reply is a success: the destination is alive).
+    the nodes report nothing over the wire: no heartbeat keeps an idle relay from timing out
+    """
+
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, open_timeout: float = OPEN_TIMEOUT,
+                 name: str = HEALTH_NODE) -> None:
+        """
+        init a health tracker instance
+        :param threshold: consecutive failed connections opening the breaker of a destination
+        :param open_timeout: seconds the breaker stays open before a probe
+        :param name: name of the tracker in the metrics (the name of its node)
+        """
+        self.threshold = threshold
+        self.open_timeout = open_timeout
+        self.name = name
+        self._breakers: Dict[Tuple[str, int], _Breaker] = {}
+        self._lock = threading.Lock()
+
+    def state(self, host: str, port: int) -> str:
+        """
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return: state of the breaker of host::port
+        """
+        breaker = self._breakers.get((host, port))
+        return breaker.state if breaker is not None else BREAKER_CLOSED
+
+    def is_available(self, host: str, port: int) -> bool:
+        """
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return: true if a send to host::port would go through: its breaker is closed, or due for a probe
+        """
+        breaker = self._breakers.get((host, port))
+        if breaker is None or breaker.state == BREAKER_CLOSED:
+            return True
+        return breaker.state == BREAKER_OPEN and time.monotonic() >= breaker.retry_at
+
+    def allow(self, host: str, port: int) -> bool:
+        """
+        ask to send to host::port: an open breaker due for a probe turns half-open, and lets this send through only
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return: true if the send should be tried, false if it should fail fast
+        """
+        with self._lock:
+            breaker = self._breakers.get((host, port))
+            if breaker is None or breaker.state == BREAKER_CLOSED:
+                return True
+            if breaker.state == BREAKER_OPEN and time.monotonic() >= breaker.retry_at:
+                breaker.state = BREAKER_HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, host: str, port: int) -> None:
+        """
+        report a connection to host::port which went through
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return:
+        """
+        breaker = self._breakers.get((host, port))
+        if breaker is None or (breaker.state == BREAKER_CLOSED and breaker.failures == 0):
+            return
+        with self._lock:
+            if breaker.state != BREAKER_CLOSED:
+                # time from the detection of the failure to the recovery
+                METRICS.observe(f'{host}:{port}', 'recovery_time', time.monotonic() - breaker.opened_at)
+                METRICS.inc(f'{host}:{port}', 'breaker_closed')
+            breaker.state = BREAKER_CLOSED
+            breaker.failures = 0
+            breaker.failing_since = breaker.opened_at = breaker.retry_at = None
+            self._set_down_gauge()
+
+    def record_failure(self, host: str, port: int) -> bool:
+        """
+        report a failed connection to host::port
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return: true if the breaker of host::port is now open (the sender should stop retrying)
+        """
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers.get((host, port))
+            if breaker is None:
+                breaker = self._breakers[(host, port)] = _Breaker()
+            # a failed probe keeps the breaker open for another timeout
+            if breaker.state != BREAKER_CLOSED:
+                breaker.state = BREAKER_OPEN
+                breaker.retry_at = now + self.open_timeout
+                return True
+            if breaker.failures == 0:
+                breaker.failing_since = now
+            breaker.failures += 1
+            if breaker.failures < self.threshold:
+                return False
+            breaker.state = BREAKER_OPEN
+            breaker.opened_at = now
+            breaker.retry_at = now + self.open_timeout
+            # time from the first failed connection to the detection of the failure
+            METRICS.observe(f'{host}:{port}', 'detection_time', now - breaker.failing_since)
+            METRICS.inc(f'{host}:{port}', 'breaker_opened')
+            self._set_down_gauge()
+            return True
+
+    def down(self) -> Dict[str, str]:
+        """
+        :return: state of the breaker of every destination taken for down (open or half-open)
+        """
+        with self._lock:
+            return {f'{host}:{port}': breaker.state for (host, port), breaker in self._breakers.items()
+                    if breaker.state != BREAKER_CLOSED}
+
+    def reset(self) -> None:
+        """
+        forget the state of every destination
+        :return:
+        """
+        with self._lock:
+            self._breakers = {}
+            self._set_down_gauge()
+
+    def _set_down_gauge(self) -> None:
+        """
+        report the number of destinations taken for down (called with the lock held)
+        :return:
+        """
+        METRICS.set_gauge(self.name, 'destinations_down',
+                          sum(breaker.state != BREAKER_CLOSED for breaker in self._breakers.values()))
+
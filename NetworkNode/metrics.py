@@ -0,0 +1,394 @@
+# python imports
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Sequence
+
+# upper bounds (in seconds) of the latency histograms buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# sliding window (in seconds) over which rates of meters are computed
+RATE_WINDOW = 10
+# default interval (in seconds) between two json dumps of the metrics
+DUMP_INTERVAL = 5
+# default address of the metrics http endpoint
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+# percentiles reported for each histogram
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    exact q-th percentile (nearest rank) of the given values
+    :param values: sorted values
+    :param q: percentile in range [0, 100]
+    :return: the percentile (0 if there are no values)
+    """
+    if len(values) == 0:
+        return 0.
+    rank = max(int(round(q / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Histogram:
+    """
+    fixed-buckets histogram of observed values (e.g. latencies)
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        init a histogram instance
+        :param buckets: sorted upper bounds of the buckets. values above the last bound go to an overflow bucket
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float) -> None:
+        """
+        add an observation to the histogram
+        :param value: observed value
+        :return:
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """
+        estimate the q-th percentile of the observations: the upper bound of the bucket it falls in
+        :param q: percentile in range [0, 100]
+        :return: estimated percentile (0 if there are no observations)
+        """
+        if self.count == 0:
+            return 0.
+        rank = q / 100 * self.count
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= rank and n > 0:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        """
+        :return: dictionary summary of the histogram
+        """
+        summary = {'count': self.count,
+                   'sum': self.sum,
+                   'mean': self.sum / self.count if self.count else 0.,
+                   'max': self.max}
+        for q in PERCENTILES:
+            summary[f'p{q}'] = self.percentile(q)
+        summary['buckets'] = {str(b): n for b, n in zip(self.buckets + ('inf',), self.counts)}
+        return summary
+
+
+class Meter:
+    """
+    counts events and computes their rate over a sliding window
+    """
+
+    def __init__(self, window: int = RATE_WINDOW) -> None:
+        """
+        init a meter instance
+        :param window: length of the sliding window in seconds
+        """
+        self.count = 0
+        self._window = window
+        # (second, events in this second) pairs, oldest first
+        self._slots = deque()
+
+    def mark(self, n: int = 1, now: float = None) -> None:
+        """
+        mark the occurrence of n events
+        :param n: number of events
+        :param now: time of the events (default: current time)
+        :return:
+        """
+        sec = int(time.time() if now is None else now)
+        self.count += n
+        if self._slots and self._slots[-1][0] == sec:
+            self._slots[-1][1] += n
+        else:
+            self._slots.append([sec, n])
+        while self._slots[0][0] <= sec - self._window:
+            self._slots.popleft()
+
+    def rate(self, now: float = None) -> float:
+        """
+        :param now: time to compute the rate at (default: current time)
+        :return: events per second over the last window
+        """
+        sec = int(time.time() if now is None else now)
+        return sum(n for s, n in self._slots if s > sec - self._window) / self._window
+
+
+class _Timer:
+    """
+    context manager that observes the time spent inside its block in a histogram
+    """
+
+    def __init__(self, metrics, node: str, name: str) -> None:
+        self._metrics = metrics
+        self._node = node
+        self._name = name
+        self._start = 0.
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._metrics.observe(self._node, self._name, time.perf_counter() - self._start)
+
+
+class Metrics:
+    """
+    thread-safe registry of the counters, gauges, histograms and meters reported by the network nodes.
+    every metric is grouped under the name of the node reporting it (e.g. Relay-127.1.0.2)
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._gauges: Dict[Tuple[str, str], float] = {}
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._meters: Dict[Tuple[str, str], Meter] = {}
+        self._start = time.time()
+
+    def inc(self, node: str, name: str, value: int = 1) -> None:
+        """
+        increment a counter
+        :param node: name of the reporting node
+        :param name: name of the counter
+        :param value: amount to add
+        :return:
+        """
+        key = (node, name)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, node: str, name: str, value: float) -> None:
+        """
+        set the current value of a gauge
+        :param node: name of the reporting node
+        :param name: name of the gauge
+        :param value: current value
+        :return:
+        """
+        with self._lock:
+            self._gauges[(node, name)] = value
+
+    def observe(self, node: str, name: str, value: float) -> None:
+        """
+        add an observation to a histogram
+        :param node: name of the reporting node
+        :param name: name of the histogram
+        :param value: observed value
+        :return:
+        """
+        key = (node, name)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def mark(self, node: str, name: str, n: int = 1) -> None:
+        """
+        mark events on a rate meter
+        :param node: name of the reporting node
+        :param name: name of the meter
+        :param n: number of events
+        :return:
+        """
+        key = (node, name)
+        with self._lock:
+            meter = self._meters.get(key)
+            if meter is None:
+                meter = self._meters[key] = Meter()
+            meter.mark(n)
+
+    def timer(self, node: str, name: str) -> _Timer:
+        """
+        :param node: name of the reporting node
+        :param name: name of the latency histogram
+        :return: context manager observing the duration of its block in the histogram
+        """
+        return _Timer(self, node, name)
+
+    def reset(self) -> None:
+        """
+        drop all the reported metrics
+        :return:
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._meters.clear()
+            self._start = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        :return: json-serializable snapshot of all metrics, grouped by node
+        """
+        now = time.time()
+        nodes = {}
+
+        def group(node: str, kind: str) -> dict:
+            return nodes.setdefault(node, {'counters': {}, 'gauges': {}, 'histograms': {}, 'meters': {}})[kind]
+
+        with self._lock:
+            for (node, name), value in self._counters.items():
+                group(node, 'counters')[name] = value
+            for (node, name), value in self._gauges.items():
+                group(node, 'gauges')[name] = value
+            for (node, name), hist in self._histograms.items():
+                group(node, 'histograms')[name] = hist.to_dict()
+            for (node, name), meter in self._meters.items():
+                group(node, 'meters')[name] = {'count': meter.count, 'rate': meter.rate(now)}
+        return {'time': now, 'uptime': now - self._start, 'nodes': nodes}
+
+    def to_text(self) -> str:
+        """
+        :return: plain text rendering of the metrics snapshot, one metric per line
+        """
+        lines = []
+        for node, groups in sorted(self.snapshot()['nodes'].items()):
+            for name, value in sorted(groups['counters'].items()):
+                lines.append(f'{name}{{node="{node}"}} {value}')
+            for name, value in sorted(groups['gauges'].items()):
+                lines.append(f'{name}{{node="{node}"}} {value}')
+            for name, meter in sorted(groups['meters'].items()):
+                lines.append(f'{name}_total{{node="{node}"}} {meter["count"]}')
+                lines.append(f'{name}_rate{{node="{node}"}} {meter["rate"]:.3f}')
+            for name, hist in sorted(groups['histograms'].items()):
+                lines.append(f'{name}_count{{node="{node}"}} {hist["count"]}')
+                lines.append(f'{name}_mean{{node="{node}"}} {hist["mean"]:.6f}')
+                for q in PERCENTILES:
+                    lines.append(f'{name}_p{q}{{node="{node}"}} {hist[f"p{q}"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+# metrics registry shared by all the nodes of the process
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    http handler serving the metrics: /metrics as plain text and /metrics.json as json
+    """
+    metrics = METRICS
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics.json':
+            body = json.dumps(self.metrics.snapshot(), indent=4).encode()
+            content_type = 'application/json'
+        elif self.path in ('/', '/metrics'):
+            body = self.metrics.to_text().encode()
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        # keep the console of the nodes clean
+        pass
+
+
+class MetricsServer:
+    """
+    local http endpoint exposing the metrics of the process
+    """
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT, metrics: Metrics = METRICS) -> None:
+        """
+        init a metrics server instance
+        :param host: ip address to listen on
+        :param port: port number to listen on
+        :param metrics: metrics registry to expose
+        """
+        handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=str(self), daemon=True)
+
+    def __str__(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'MetricsServer-{host}:{port}'
+
+    def start(self) -> None:
+        """
+        start serving the metrics in a background thread
+        :return:
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stop serving the metrics
+        :return:
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class MetricsDumper:
+    """
+    periodically dumps the metrics of the process as json into a file
+    """
+
+    def __init__(self, filename: str, interval: float = DUMP_INTERVAL, metrics: Metrics = METRICS) -> None:
+        """
+        init a metrics dumper instance
+        :param filename: path of the json file to (over)write
+        :param interval: seconds between two dumps
+        :param metrics: metrics registry to dump
+        """
+        self.filename = filename
+        self._interval = interval
+        self._metrics = metrics
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'MetricsDumper-{filename}', daemon=True)
+
+    def start(self) -> None:
+        """
+        start dumping the metrics in a background thread
+        :return:
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stop the dumper and write a final dump
+        :return:
+        """
+        self._stop.set()
+        self._thread.join()
+        self.dump()
+
+    def dump(self) -> None:
+        """
+        write the current metrics snapshot into the file
+        :return:
+        """
+        with open(self.filename, 'w') as file:
+            json.dump(self._metrics.snapshot(), file, indent=4)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self.dump()
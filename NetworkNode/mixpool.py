@@ -0,0 +1,246 @@
+# python imports
+from secrets import randbelow
+from typing import List, Optional
+
+# default number of preallocated slots of a pool
+POOL_SLOTS = 64
+# names of the mixing policies
+POLICY_THRESHOLD = 'threshold'
+POLICY_TIMED = 'timed'
+POLICY_POOL = 'pool'
+# ticks per flush interval: resolution of the timed flushes
+TICKS_PER_INTERVAL = 4
+
+
+class MixPool:
+    """
+    array-backed pool of packets. packets are stored in preallocated slots: adding a packet is O(1), and taking a
+    random packet is O(1) (the taken slot is filled with the last packet), so flushing a batch is O(batch), without
+    hashing the packets. identical packets are kept apart. the arrival time of the oldest packet is kept up to date on
+    every add, and recomputed only once the oldest packet is taken.
+    """
+
+    def __init__(self, slots: int = POOL_SLOTS, capacity: int = None) -> None:
+        """
+        init a mix pool instance
+        :param slots: number of preallocated slots (the pool grows beyond them if it is not bounded)
+        :param capacity: maximal number of packets inside the pool (default: unbounded)
+        """
+        self.capacity = capacity
+        self._slots = [None] * max(slots if capacity is None else min(slots, capacity), 1)
+        self._size = 0
+        # arrival time of the oldest packet (None if the pool is empty), stale once the oldest packet was taken
+        self._oldest = None
+        self._oldest_stale = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, packet) -> bool:
+        """
+        add a packet to the pool
+        :param packet: packet to add
+        :return: false if the pool is full (the packet was not added), true otherwise
+        """
+        if self.capacity is not None and self._size >= self.capacity:
+            return False
+        if self._size == len(self._slots):
+            grow = len(self._slots) if self.capacity is None else min(len(self._slots), self.capacity - self._size)
+            self._slots.extend([None] * grow)
+        self._slots[self._size] = packet
+        self._size += 1
+        if not self._oldest_stale and (self._oldest is None or packet.arrival < self._oldest):
+            self._oldest = packet.arrival
+        return True
+
+    def take_random(self, n: int) -> list:
+        """
+        take n packets chosen uniformly at random out of the pool. the packets are returned in a random order
+        :param n: number of packets to take (at most the size of the pool)
+        :return: taken packets
+        """
+        slots = self._slots
+        batch = []
+        for _ in range(min(n, self._size)):
+            idx = randbelow(self._size)
+            self._size -= 1
+            batch.append(slots[idx])
+            if slots[idx].arrival == self._oldest:
+                self._oldest_stale = True
+            # swap-remove: the last packet fills the taken slot
+            slots[idx] = slots[self._size]
+            slots[self._size] = None
+        if self._size == 0:
+            self._oldest, self._oldest_stale = None, False
+        return batch
+
+    def occupancy(self) -> float:
+        """
+        :return: fraction of the capacity (or of the allocated slots, for an unbounded pool) in use
+        """
+        return self._size / (self.capacity if self.capacity is not None else len(self._slots))
+
+    def oldest_arrival(self) -> Optional[float]:
+        """
+        :return: arrival time of the oldest packet of the pool (None if it is empty)
+        """
+        if self._oldest_stale:
+            self._oldest = min(packet.arrival for packet in self._slots[:self._size])
+            self._oldest_stale = False
+        return self._oldest
+
+
+class MixingPolicy:
+    """
+    base class of the mixing policies: decides when a relay flushes its pool, and how many packets it flushes
+    """
+    # seconds between two checks of the policy while no packet arrives (None: checked only on arrivals)
+    tick = None
+
+    def flush_size(self, pool: MixPool, now: float) -> int:
+        """
+        :param pool: pool of the relay
+        :param now: current monotonic time
+        :return: number of packets to flush now (0 to keep them all)
+        """
+        raise NotImplementedError
+
+    def flush_threshold(self, pool_size: int = None) -> Optional[int]:
+        """
+        :param pool_size: pool size of the policy (default: its current one)
+        :return: packets the pool gathers before the policy flushes it (None if it flushes on time alone). a pool
+        bounded below it never flushes
+        """
+        raise NotImplementedError
+
+    def reconfigure(self, pool_size: int, interval: float = None) -> None:
+        """
+        change the parameters of the policy in place (the packets inside the pool are kept)
+        :param pool_size: new pool size
+        :param interval: new flush interval of the timed policy, flush deadline of the threshold policy
+        :return:
+        """
+        raise NotImplementedError
+
+
+class ThresholdPolicy(MixingPolicy):
+    """
+    threshold mix: flush pool_size packets once pool_size packets are gathered. with a deadline, the pool is also
+    flushed once its oldest packet waited for deadline seconds, which bounds the latency at low load
+    """
+
+    def __init__(self, pool_size: int, deadline: float = None) -> None:
+        """
+        :param pool_size: number of packets gathered before a flush
+        :param deadline: maximal seconds a packet waits in the pool (default: no deadline)
+        """
+        self.pool_size = pool_size
+        self.deadline = deadline
+        self.tick = None if deadline is None else deadline / TICKS_PER_INTERVAL
+
+    def __str__(self) -> str:
+        return f'{POLICY_THRESHOLD}({self.pool_size}, deadline {self.deadline})'
+
+    def flush_size(self, pool: MixPool, now: float) -> int:
+        if len(pool) >= self.pool_size:
+            return self.pool_size
+        if self.deadline is not None and len(pool) > 0 and now - pool.oldest_arrival() >= self.deadline:
+            return len(pool)
+        return 0
+
+    def flush_threshold(self, pool_size: int = None) -> Optional[int]:
+        return self.pool_size if pool_size is None else pool_size
+
+    def reconfigure(self, pool_size: int, interval: float = None) -> None:
+        self.pool_size = pool_size
+        self.deadline = interval
+        self.tick = None if interval is None else interval / TICKS_PER_INTERVAL
+
+
+class TimedPolicy(MixingPolicy):
+    """
+    timed mix: flush the whole pool every interval seconds
+    """
+
+    def __init__(self, interval: float) -> None:
+        """
+        :param interval: seconds between two flushes
+        """
+        self.interval = interval
+        self.tick = interval / TICKS_PER_INTERVAL
+        self._last_flush = None
+
+    def __str__(self) -> str:
+        return f'{POLICY_TIMED}({self.interval})'
+
+    def flush_size(self, pool: MixPool, now: float) -> int:
+        if self._last_flush is None:
+            self._last_flush = now
+        if now - self._last_flush < self.interval:
+            return 0
+        self._last_flush = now
+        return len(pool)
+
+    def flush_threshold(self, pool_size: int = None) -> Optional[int]:
+        return None
+
+    def reconfigure(self, pool_size: int, interval: float = None) -> None:
+        # the timed policy flushes the whole pool: only its interval matters (None keeps it)
+        if interval is not None:
+            self.interval = interval
+            self.tick = interval / TICKS_PER_INTERVAL
+
+
+class PoolPolicy(MixingPolicy):
+    """
+    threshold pool mix: once pool_size + keep packets are gathered, flush pool_size packets chosen at random. the kept
+    packets are mixed with the next rounds, so a packet may leave after any number of rounds
+    """
+
+    def __init__(self, pool_size: int, keep: int = None) -> None:
+        """
+        :param pool_size: number of packets flushed at once
+        :param keep: number of packets kept inside the pool after a flush (default: half of pool_size)
+        """
+        self.pool_size = pool_size
+        self.keep = pool_size // 2 if keep is None else keep
+        # a default number of kept packets follows the pool size
+        self._default_keep = keep is None
+
+    def __str__(self) -> str:
+        return f'{POLICY_POOL}({self.pool_size}, keep {self.keep})'
+
+    def flush_size(self, pool: MixPool, now: float) -> int:
+        return self.pool_size if len(pool) >= self.pool_size + self.keep else 0
+
+    def flush_threshold(self, pool_size: int = None) -> Optional[int]:
+        if pool_size is None:
+            return self.pool_size + self.keep
+        return pool_size + (pool_size // 2 if self._default_keep else self.keep)
+
+    def reconfigure(self, pool_size: int, interval: float = None) -> None:
+        self.pool_size = pool_size
+        if self._default_keep:
+            self.keep = pool_size // 2
+
+
+def make_policy(name: str, pool_size: int, interval: float = None) -> MixingPolicy:
+    """
+    :param name: name of the mixing policy (threshold, timed or pool)
+    :param pool_size: pool size of the threshold and pool policies
+    :param interval: flush interval of the timed policy, flush deadline of the threshold policy
+    :return: new mixing policy
+    """
+    if name == POLICY_THRESHOLD:
+        return ThresholdPolicy(pool_size, interval)
+    if name == POLICY_TIMED:
+        if interval is None:
+            raise ValueError('the timed policy needs a flush interval')
+        return TimedPolicy(interval)
+    if name == POLICY_POOL:
+        return PoolPolicy(pool_size)
+    raise ValueError(f'unknown mixing policy {name}')
+
+
+# names of the mixing policies, for the command line
+POLICIES = [POLICY_THRESHOLD, POLICY_TIMED, POLICY_POOL]
@@ -1,24 +1,77 @@
 import sys
 import time
+import random
 import socket
-from secrets import token_bytes
-from typing import Tuple, Any
+import struct
+from typing import Tuple, Any, List, Union
 
 from NetworkNode.utils import *
+from NetworkNode.metrics import METRICS
+from NetworkNode.entropy import random_bytes, padding_bytes
+from NetworkNode.transport import ROUTES
+from NetworkNode.health import HealthTracker
+from NetworkNode.config import NodeConfig, SOCKET_TIMEOUT, MAX_TRIES, SEND_TIMEOUT
 
-SOCKET_TIMEOUT = 60
 MSG_MAX_SIZE = 8192
 CORE_MSG_SIZE = 256
 PSEUDONYM_LEN = 8
 TTL = 1000  # time to live
 SYM_KEY_LEN = 256
 SLEEP_SEC = 1
-MAX_TRIES = 10
+# exponential backoff of a sender between two tries: base delay and maximal delay (in seconds)
+BACKOFF_BASE = 0.01
+BACKOFF_MAX = 1.
+
+# replies of a receiver to every message: accepted, or rejected because the receiver is over its high-water mark.
+# a receiver closing the connection without a reply accepted the message
+ACK = b'\x06'
+BUSY = b'\x15'
+# results of Node.send
+SEND_OK = 'ok'
+SEND_BUSY = 'busy'
+SEND_FAILED = 'failed'
+
+# destination of cover traffic: the last relay of the chain drops packets sent to it
+COVER_HOST = '0.0.0.0'
+COVER_PORT = 0
+# widths the destination address and port of every layer are padded to (a dotted ipv4 address, a port number): the
+# size of a layer does not depend on its destination, so a cover message is sized like a real one at every hop
+DEST_WIDTH = len('255.255.255.255')
+PORT_WIDTH = len('65535')
 
 POST = b'POST'
 DEST = b'DEST'
 PORT = b'PORT'
 END = b'END'
+# marker of a hybrid core message, following its pseudonym: a batch of messages encrypted with an aead key, the key
+# being encrypted with the host public key
+HYBRID = b'HYBR'
+# header of a hybrid core message (encrypted with the host public key): marker, aead key, nonce, payload length
+HYBRID_HEADER = struct.Struct(f'>{len(HYBRID)}s{AEAD_KEY_LEN}s{AEAD_NONCE_LEN}sI')
+# length prefix of every message inside a batch
+BATCH_ENTRY_LEN = struct.Struct('>H')
+# marker of a batch frame: several padded messages to the same host sent over a single connection, following a header
+# of the marker and the number of messages
+BATCH_FRAME = b'BTCH'
+BATCH_FRAME_HEADER = struct.Struct(f'>{len(BATCH_FRAME)}sH')
+# maximal number of messages inside a batch frame
+BATCH_FRAME_MAX = 128
+# bytes read at once from a connection, while receiving a batch frame
+RECV_CHUNK_SIZE = 64 * 1024
+
+# formats of the onion layers: a fernet token (aes-cbc + hmac, base64) whose key and length are encrypted with the
+# public key of the relay, or a binary aead ciphertext (aes-gcm) whose key, nonce and length are encrypted with the
+# public key of the relay (fixed overhead of SYM_KEY_LEN + AEAD_TAG_LEN bytes per layer)
+LAYER_FERNET = 'fernet'
+LAYER_AEAD = 'aead'
+LAYER_FORMATS = [LAYER_AEAD, LAYER_FERNET]
+# marker of an aead layer, heading its encrypted header
+AEAD_LAYER = b'AEAD'
+# header of an aead layer (encrypted with the public key of the relay): marker, aead key, nonce, ciphertext length
+LAYER_HEADER = struct.Struct(f'>{len(AEAD_LAYER)}s{AEAD_KEY_LEN}s{AEAD_NONCE_LEN}sI')
+# header of a fernet layer (encrypted with the public key of the relay): symmetric key, token length. the padding
+# following the layer is then never decoded as a part of the token
+FERNET_HEADER = struct.Struct(f'>{SYMM_KEY_LEN}sI')
 
 # MSG_FORMAT = f'{{r}}{POST}{{m}}{DEST}{{d}}{PORT}{{p}}'
 # MSG_FORMAT = '{r}POST{m}DEST{d}PORT{p}'
@@ -33,13 +86,16 @@ class Node:
     represents a general node inside the network
     """
 
-    def __init__(self, address: str, keys: Tuple[str, str] = ('node_pr_key', 'node_pb_key')) -> None:
+    def __init__(self, address: str, keys: Tuple[str, str] = ('node_pr_key', 'node_pb_key'),
+                 config: NodeConfig = None) -> None:
         """
         init a network node
         :param address: ip address of node
         :param keys: private and public keys of the node
+        :param config: tuning of the node (default: the default configuration)
         """
         self.address = address
+        self.config = config if config is not None else NodeConfig()
         # init keys
         pr_key, pb_key = load_key_pair(keys)
         # private key of client
@@ -72,39 +128,119 @@ class Node:
         pass
 
     @staticmethod
-    def send(host: str, port: int, msg: bytes) -> None:
+    def send(host: str, port: int, msg: Union[bytes, List], max_tries: int = MAX_TRIES,
+             timeout: float = SEND_TIMEOUT, health: HealthTracker = None) -> str:
         """
-        send given message to host::port
+        send given message to host::port. a failed try, or a busy reply of the host, is retried after an exponential
+        backoff: a sender to an overloaded host slows down, instead of hammering it. with a health tracker, a host
+        taken for down (its circuit breaker is open) fails fast, without any try
         :param host: ip address of host
         :param port: port number of host
-        :param msg: message to be sent
-        :return:
+        :param msg: message to be sent, or frame (list of buffers, e.g. from wrap_frame) sent as a single message
+        :param max_tries: tries before giving up on the message
+        :param timeout: seconds to wait to connect, send the message and get its reply
+        :param health: circuit breakers of the sender (None: no breaker, every message is tried max_tries times)
+        :return: SEND_OK if the host accepted the message, SEND_BUSY if it kept rejecting it, SEND_FAILED otherwise
         """
-        # open TCP connection socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        for i in range(MAX_TRIES):
+        # the hosts of the parsed onion layers are bytes
+        if isinstance(host, bytes):
+            host = host.decode()
+        # the transport reaching the host: TCP, or a unix socket / in-process channel for a co-located host
+        transport = ROUTES.get(host, port)
+        if health is not None and not health.allow(host, port):
+            METRICS.inc(f'{host}:{port}', 'send_fail_fast')
+            return SEND_FAILED
+        status = SEND_FAILED
+        for i in range(max_tries):
+            if i > 0:
+                time.sleep(Node.backoff(i - 1))
             try:
-                # connect to host::port
-                s.connect((host, port))
-                # send message, make sure all bytes was sent successfully
-                s.sendall(msg)
-                # close socket
-                s.close()
-                return
+                # open a connection to host::port
+                with transport.connect(host, port, timeout) as s:
+                    # send message, make sure all bytes was sent successfully
+                    if isinstance(msg, list):
+                        Node._sendall_frame(s, msg)
+                    else:
+                        s.sendall(msg)
+                    s.shutdown(socket.SHUT_WR)
+                    reply = s.recv(len(BUSY))
             except (OSError, TimeoutError, ConnectionError):
+                # count every failed attempt against the destination, and stop retrying once it is taken for down
+                METRICS.inc(f'{host}:{port}', 'connect_errors')
+                status = SEND_FAILED
+                if health is not None and health.record_failure(host, port):
+                    break
                 continue
-        print('failed to send message', file=sys.stderr)
+            if health is not None:
+                health.record_success(host, port)
+            if reply != BUSY:
+                return SEND_OK
+            METRICS.inc(f'{host}:{port}', 'busy_replies')
+            status = SEND_BUSY
+        if status == SEND_BUSY:
+            METRICS.inc(f'{host}:{port}', 'send_rejected')
+            print('message rejected: host is busy', file=sys.stderr)
+        else:
+            METRICS.inc(f'{host}:{port}', 'send_failures')
+            print('failed to send message', file=sys.stderr)
+        return status
+
+    @staticmethod
+    def _sendall_frame(s: socket.socket, frame: List) -> None:
+        """
+        send all the buffers of a frame with scatter-gather writes, without joining them into a new message
+        :param s: connected socket
+        :param frame: buffers of the frame
+        :return:
+        """
+        if not hasattr(s, 'sendmsg'):
+            s.sendall(b''.join(frame))
+            return
+        views = [memoryview(buffer) for buffer in frame]
+        while views:
+            sent = s.sendmsg(views)
+            # drop the buffers sent entirely, and the sent part of the first buffer left
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if sent > 0:
+                views[0] = views[0][sent:]
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """
+        :param attempt: number of the failed try (from 0)
+        :return: seconds to wait before the next try: exponential in the tries, capped, and jittered so that the
+        senders rejected together do not retry together
+        """
+        return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1)
+
+    @staticmethod
+    def reply(sock_conn: socket.socket, accepted: bool) -> None:
+        """
+        reply to the sender of a received message
+        :param sock_conn: connection of the message
+        :param accepted: true if the message was accepted, false if the receiver is busy
+        :return:
+        """
+        try:
+            sock_conn.sendall(ACK if accepted else BUSY)
+        # the sender may have given up already
+        except OSError:
+            pass
 
     @staticmethod
     def format_message(msg: bytes, dest: bytes, port: bytes) -> bytes:
         """
-        format the given message according to the onion routing protocol
+        format the given message according to the onion routing protocol. the destination is padded with spaces to
+        DEST_WIDTH and PORT_WIDTH
         :param msg: data/payload
         :param dest: ip address of destination
         :param port: port number of destination
         :return: formatted message
         """
-        return token_bytes(PSEUDONYM_LEN) + POST + msg + DEST + dest + PORT + port + END
+        return b''.join((random_bytes(PSEUDONYM_LEN), POST, msg, DEST, dest.rjust(DEST_WIDTH), PORT,
+                         port.rjust(PORT_WIDTH), END))
 
     @staticmethod
     def wrap_message(msg: bytes) -> bytes:
@@ -114,7 +250,118 @@ class Node:
         :param msg: message to wrap with random bytes
         :return: wrapped message
         """
-        return msg + token_bytes(MSG_MAX_SIZE - len(msg))
+        return msg + padding_bytes(MSG_MAX_SIZE - len(msg))
+
+    @staticmethod
+    def wrap_frame(msg: bytes) -> List:
+        """
+        wrap the given message with random bytes, as wrap_message, without copying it: the padding is a view into the
+        padding pool of the thread. to be sent with send
+        :param msg: message to wrap with random bytes
+        :return: frame: the message, followed by its padding
+        """
+        return [msg, padding_bytes(MSG_MAX_SIZE - len(msg))]
+
+    @staticmethod
+    def wrap_batch_frame(msgs: List[bytes]) -> List:
+        """
+        wrap the given messages to the same host into a single batch frame, every message being wrapped with random
+        bytes as wrap_frame (without copying it). the messages keep their order inside the frame
+        :param msgs: messages to wrap (at most BATCH_FRAME_MAX)
+        :return: frame: the header of the batch frame, followed by every message and its padding
+        """
+        frame = [BATCH_FRAME_HEADER.pack(BATCH_FRAME, len(msgs))]
+        for msg in msgs:
+            frame.extend(Node.wrap_frame(msg))
+        return frame
+
+    @staticmethod
+    def unwrap_batch_frame(data: bytes) -> List[bytes]:
+        """
+        split received data into its messages
+        :param data: received data: a batch frame, or a single message
+        :return: wrapped messages of the batch frame, in their order (the data itself if it is a single message)
+        """
+        if not Node._is_batch_frame(data):
+            return [data]
+        (_, count) = BATCH_FRAME_HEADER.unpack_from(data)
+        return [data[idx:idx + MSG_MAX_SIZE]
+                for idx in range(BATCH_FRAME_HEADER.size, BATCH_FRAME_HEADER.size + count * MSG_MAX_SIZE, MSG_MAX_SIZE)]
+
+    @staticmethod
+    def _is_batch_frame(data: bytes) -> bool:
+        """
+        :param data: received data
+        :return: true if the data is a whole batch frame. a single message is at most MSG_MAX_SIZE bytes long, so it is
+        never taken for one, even if it starts with the marker
+        """
+        if len(data) <= MSG_MAX_SIZE or data[:len(BATCH_FRAME)] != BATCH_FRAME:
+            return False
+        (_, count) = BATCH_FRAME_HEADER.unpack_from(data)
+        return len(data) == BATCH_FRAME_HEADER.size + count * MSG_MAX_SIZE
+
+    @staticmethod
+    def recv_message(sock_conn: socket.socket) -> bytes:
+        """
+        read a message, or a whole batch frame, from a connection: until its size, or until the sender shut down its
+        writes
+        :param sock_conn: accepted connection
+        :return: received data
+        """
+        data = sock_conn.recv(MSG_MAX_SIZE)
+        # a padded message, in a single read
+        if len(data) == MSG_MAX_SIZE and data[:len(BATCH_FRAME)] != BATCH_FRAME:
+            return data
+        chunks = [data]
+        received = len(data)
+        size = Node._recv_size(data)
+        while received < size:
+            chunk = sock_conn.recv(min(size - received, RECV_CHUNK_SIZE))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            # the header of a batch frame may take several reads
+            if len(chunks[0]) < BATCH_FRAME_HEADER.size:
+                chunks = [b''.join(chunks)]
+                size = Node._recv_size(chunks[0])
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    @staticmethod
+    def _recv_size(data: bytes) -> int:
+        """
+        :param data: bytes received so far from a connection
+        :return: bytes to receive: the size of the batch frame once its header is received, MSG_MAX_SIZE otherwise
+        """
+        if len(data) < BATCH_FRAME_HEADER.size or data[:len(BATCH_FRAME)] != BATCH_FRAME:
+            return MSG_MAX_SIZE
+        (_, count) = BATCH_FRAME_HEADER.unpack_from(data)
+        return max(BATCH_FRAME_HEADER.size + count * MSG_MAX_SIZE, MSG_MAX_SIZE)
+
+    @staticmethod
+    def pack_batch(msgs: List[bytes]) -> bytes:
+        """
+        concatenate messages into a batch payload, every message being prefixed with its length
+        :param msgs: messages of the batch
+        :return: batch payload
+        """
+        return b''.join(BATCH_ENTRY_LEN.pack(len(msg)) + msg for msg in msgs)
+
+    @staticmethod
+    def unpack_batch(payload: bytes) -> List[bytes]:
+        """
+        split a batch payload into its messages
+        :param payload: batch payload, as returned by pack_batch
+        :return: messages of the batch
+        """
+        msgs = []
+        idx = 0
+        while idx < len(payload):
+            (length,) = BATCH_ENTRY_LEN.unpack_from(payload, idx)
+            idx += BATCH_ENTRY_LEN.size
+            msgs.append(payload[idx:idx + length])
+            idx += length
+        return msgs
 
     @staticmethod
     def unwrap_message(msg: bytes) -> bytes:
@@ -0,0 +1,125 @@
+# python imports
+import threading
+from collections import deque
+from typing import Any, Callable, Optional
+
+# project imports
+from NetworkNode.metrics import METRICS
+
+# default number of onion shells a client keeps ready (0: no precomputation, the onions are built on the send path)
+ONION_POOL_DEPTH = 0
+# seconds a full onion pool waits for a shell to be taken, before its refill thread exits (the next take restarts it)
+POOL_IDLE_TIMEOUT = 5.
+
+
+class OnionPool:
+    """
+    onion shells precomputed in idle time: the public key encryptions of the layers of an onion, for a given path and
+    given layer sizes. a refill thread keeps up to depth shells ready. a sender takes a shell, and only fills it in:
+    it encrypts the innermost payload, and every layer with the symmetric key already encrypted in its header.
+    every shell is built for a key (the relays of the path, their public keys and the sizes of the layers): taking a
+    shell for another key drops the shells of the previous key, and the pool is refilled for the new one
+    """
+
+    def __init__(self, depth: int = ONION_POOL_DEPTH, name: str = 'OnionPool',
+                 idle_timeout: float = POOL_IDLE_TIMEOUT) -> None:
+        """
+        init an onion pool instance
+        :param depth: number of shells kept ready
+        :param name: name of the pool in the metrics (the name of its client)
+        :param idle_timeout: seconds a full pool waits for a shell to be taken, before its refill thread exits
+        """
+        if depth <= 0:
+            raise ValueError('the depth of an onion pool must be positive')
+        self.depth = depth
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self._shells = deque()
+        # key of the shells, and the function building a shell for it
+        self._key = None
+        self._build = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._shells)
+
+    def take(self, key: Any, build: Callable[[], Any]) -> Optional[Any]:
+        """
+        take a shell built for the given key. a miss wakes up the refill thread: the next takes find the pool filled
+        :param key: key of the shell (comparable): relays of the path, their public keys and sizes of the layers
+        :param build: function building a new shell for the key (called by the refill thread)
+        :return: shell for the key, or None if the pool holds none
+        """
+        with self._cond:
+            if self._stopped:
+                return None
+            if key != self._key:
+                if self._shells:
+                    METRICS.inc(self.name, 'onion_pool_invalidated')
+                self._shells.clear()
+                self._key, self._build = key, build
+            shell = self._shells.popleft() if self._shells else None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refill, name=f'{self.name}-onion-pool', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        METRICS.inc(self.name, 'onion_pool_hits' if shell is not None else 'onion_pool_misses')
+        return shell
+
+    def invalidate(self) -> None:
+        """
+        drop every shell (e.g. the relays chain changed). the pool is refilled once a shell is taken again
+        :return:
+        """
+        with self._cond:
+            if self._shells:
+                METRICS.inc(self.name, 'onion_pool_invalidated')
+            self._shells.clear()
+            self._key = self._build = None
+
+    def stop(self) -> None:
+        """
+        drop every shell, and stop the refill thread
+        :return:
+        """
+        with self._cond:
+            self._stopped = True
+            self._shells.clear()
+            thread = self._thread
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def _refill(self) -> None:
+        """
+        build shells for the current key until the pool is full, and again every time a shell is taken. exits once the
+        pool was left full for idle_timeout seconds
+        :return:
+        """
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(self._needs_refill, self.idle_timeout) or self._stopped:
+                    # a take from now on starts a new refill thread
+                    self._thread = None
+                    return
+                key, build = self._key, self._build
+            # the public key encryptions run outside the lock: the senders keep taking shells meanwhile
+            try:
+                shell = build()
+            except Exception:
+                with self._cond:
+                    self._thread = None
+                raise
+            with self._cond:
+                # the shell of a previous key is useless
+                if key == self._key and len(self._shells) < self.depth:
+                    self._shells.append(shell)
+
+    def _needs_refill(self) -> bool:
+        """
+        :return: true if the refill thread should wake up: the pool was stopped, or it misses shells for its key
+        (called with the lock held)
+        """
+        return self._stopped or (self._build is not None and len(self._shells) < self.depth)
@@ -0,0 +1,219 @@
+# python imports
+import cProfile
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+# directory the profiles are written into
+PROFILES_PATH = os.path.abspath('profiles')
+# default length (in seconds) of a cProfile capture window
+CAPTURE_WINDOW = 10
+# default interval (in seconds) between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# maximal depth of a sampled stack
+MAX_STACK_DEPTH = 64
+
+
+class _Section:
+    """
+    context manager labelling the current thread as running a hot section, for the sampling profiler
+    """
+
+    def __init__(self, sections: list, name: str) -> None:
+        self._sections = sections
+        self._name = name
+
+    def __enter__(self):
+        self._sections.append(self._name)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._sections.pop()
+
+
+class Profiler:
+    """
+    on-demand profiler of the nodes threads, that can be switched on at runtime (by a signal or a flag):
+        - capture mode: every node thread runs under cProfile for a window, and writes a pstats file
+        - sampling mode: a background thread samples the stacks of all the nodes threads, and writes collapsed stacks
+          (one file per node, ready for flame graphs)
+    output files are tagged with the name of the node thread (e.g. Relay-127.1.0.2).
+    when both modes are off, the nodes pay a single attribute check per loop iteration.
+    """
+
+    def __init__(self) -> None:
+        # true while a capture was requested or is running
+        self.capturing = False
+        # true while the sampler is running
+        self.sampling = False
+        self._lock = threading.Lock()
+        # end of the requested capture window (monotonic time), and node to capture (None for all nodes)
+        self._capture_until = 0.
+        self._capture_node = None
+        # running captures, by thread ident: (profile, node)
+        self._captures = {}
+        # stack of hot sections labels, by thread ident
+        self._sections = defaultdict(list)
+        # sampled collapsed stacks counts, by node
+        self._samples = defaultdict(Counter)
+        self._sampler = None
+
+    def request_capture(self, window: float = CAPTURE_WINDOW, node: str = None) -> None:
+        """
+        request a cProfile capture of the nodes threads
+        :param window: length of the capture in seconds
+        :param node: name of the node to capture (default: all nodes)
+        :return:
+        """
+        with self._lock:
+            self._capture_until = time.monotonic() + window
+            self._capture_node = node
+            self.capturing = True
+        print(f'profiler: capturing {node or "all nodes"} for {window} seconds', file=sys.stderr)
+
+    def checkpoint(self, node: str) -> None:
+        """
+        called by a node thread at every iteration of its loop: starts or stops the capture of the thread
+        :param node: name of the node
+        :return:
+        """
+        if not self.capturing:
+            return
+        ident = threading.get_ident()
+        now = time.monotonic()
+        with self._lock:
+            capture = self._captures.get(ident)
+            wanted = now < self._capture_until and self._capture_node in (None, node)
+            if capture is None and wanted:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # another profiler is already active in this interpreter
+                    return
+                self._captures[ident] = (profile, node)
+                return
+        if capture is not None and not wanted:
+            self.finish()
+
+    def finish(self) -> None:
+        """
+        stop the capture of the calling thread (if any) and write its pstats file
+        :return:
+        """
+        with self._lock:
+            capture = self._captures.pop(threading.get_ident(), None)
+            if not self._captures and time.monotonic() >= self._capture_until:
+                self.capturing = False
+        if capture is None:
+            return
+        profile, node = capture
+        profile.disable()
+        filename = self._filename(node, 'pstats')
+        profile.dump_stats(filename)
+        print(f'profiler: wrote {filename}', file=sys.stderr)
+
+    def section(self, name: str):
+        """
+        :param name: label of a hot section (e.g. _decrypt_layer)
+        :return: context manager labelling its block for the sampling profiler
+        """
+        if not self.sampling:
+            return nullcontext()
+        return _Section(self._sections[threading.get_ident()], name)
+
+    def start_sampling(self, interval: float = SAMPLE_INTERVAL) -> None:
+        """
+        start sampling the stacks of all the threads
+        :param interval: seconds between two samples
+        :return:
+        """
+        with self._lock:
+            if self.sampling:
+                return
+            self.sampling = True
+            self._samples.clear()
+            self._sampler = threading.Thread(target=self._sample, args=(interval,), name='Profiler-sampler',
+                                             daemon=True)
+            self._sampler.start()
+        print(f'profiler: sampling every {interval} seconds', file=sys.stderr)
+
+    def stop_sampling(self) -> None:
+        """
+        stop sampling, and write the collapsed stacks of every node
+        :return:
+        """
+        with self._lock:
+            if not self.sampling:
+                return
+            self.sampling = False
+            sampler = self._sampler
+        sampler.join()
+        for node, stacks in self._samples.items():
+            filename = self._filename(node, 'collapsed')
+            with open(filename, 'w') as file:
+                for stack, count in stacks.most_common():
+                    file.write(f'{stack} {count}\n')
+            print(f'profiler: wrote {filename}', file=sys.stderr)
+
+    def toggle_sampling(self) -> None:
+        """
+        start sampling if the sampler is off, stop it otherwise
+        :return:
+        """
+        if self.sampling:
+            self.stop_sampling()
+        else:
+            self.start_sampling()
+
+    def install_signal_handlers(self, window: float = CAPTURE_WINDOW) -> None:
+        """
+        SIGUSR1 requests a cProfile capture of all the nodes, SIGUSR2 toggles the sampling profiler.
+        must be called from the main thread
+        :param window: length of the captures in seconds
+        :return:
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.request_capture(window))
+        # writing the samples joins the sampler: do it outside of the signal handler
+        signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=self.toggle_sampling).start())
+
+    def _sample(self, interval: float) -> None:
+        """
+        sampler loop: add the current stack of every node thread to the collapsed stacks counts
+        :param interval: seconds between two samples
+        :return:
+        """
+        me = threading.get_ident()
+        while self.sampling:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident not in names:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                    frame = frame.f_back
+                labels = [f'[{label}]' for label in self._sections.get(ident, ())]
+                self._samples[names[ident]][';'.join(labels + stack[::-1])] += 1
+            time.sleep(interval)
+
+    @staticmethod
+    def _filename(node: str, extension: str) -> str:
+        """
+        :param node: name of the profiled node
+        :param extension: extension of the output file
+        :return: path of a new output file tagged with the node name
+        """
+        os.makedirs(PROFILES_PATH, exist_ok=True)
+        return f'{PROFILES_PATH}/{node}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.{extension}'
+
+
+# profiler shared by all the nodes of the process
+PROFILER = Profiler()
@@ -1,19 +1,35 @@
 # builtin modules
 from __future__ import annotations
 import socket
+import threading
+import time
 from collections import namedtuple
-import random
-from typing import List, Tuple
+from typing import List, Tuple, Optional
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
 
 # project modules
-from NetworkNode.server import Server
-from NetworkNode.node import Node, MSG_MAX_SIZE, POST, DEST, PORT, DEBUG_MODE, SYM_KEY_LEN
+from NetworkNode.server import Server, LISTEN_BACKLOG
+from NetworkNode.node import Node, MSG_MAX_SIZE, POST, DEST, PORT, DEBUG_MODE, SYM_KEY_LEN, PSEUDONYM_LEN, \
+    SOCKET_TIMEOUT, COVER_HOST, SEND_OK, AEAD_LAYER, LAYER_HEADER, FERNET_HEADER, BATCH_FRAME_MAX
 from NetworkNode.utils import *
+from NetworkNode.metrics import METRICS
+from NetworkNode.profiling import PROFILER
+from NetworkNode.replay import ReplayFilter
+from NetworkNode.transport import TRANSPORT_TCP
+from NetworkNode.anonymity import FLUSH_OBSERVER
+from NetworkNode.mixpool import MixPool, MixingPolicy, ThresholdPolicy
+from NetworkNode.config import NodeConfig, POOL_SIZE, POOL_HIGH_WATER, check_high_water
+from NetworkNode.circuit import CircuitTable, CircuitHop, CIRCUIT_ID_LEN, CIRCUIT_LAYER, CIRCUIT_HEADER, \
+    CIRCUIT_CAPACITY, CIRCUIT_TTL, open_frame, is_frame
+from NetworkNode.tracing import TRACER, STAGE_RECEIVED, STAGE_DECRYPTED, STAGE_POOLED, STAGE_FLUSHED, \
+    STAGE_FORWARDED
 
-# pool size limit of each mixnode/relay
-POOL_SIZE = 64
-# represents a packet inside the mixnet
-Packet = namedtuple('Packet', ['msg', 'dest', 'port'])
+# destination of cover packets, as parsed from a layer
+COVER_DEST = COVER_HOST.encode()
+# represents a packet inside the mixnet. arrival is the (monotonic) time the packet entered the pool,
+# trace is the random prefix of the peeled layer (kept only in benchmark tracing mode)
+Packet = namedtuple('Packet', ['msg', 'dest', 'port', 'arrival', 'trace'], defaults=(0., b''))
 
 
 class Relay(Server):
@@ -21,20 +37,60 @@ class Relay(Server):
     represents a relay/MixNode insdie the mixnet
     """
 
-    def __init__(self, address: str, port: int, keys: Tuple[str, str] = ('relay_pr_key', 'relay_pb_key')) -> None:
+    def __init__(self, address: str, port: int, keys: Tuple[str, str] = ('relay_pr_key', 'relay_pb_key'),
+                 pool_size: int = POOL_SIZE, timeout: float = SOCKET_TIMEOUT, replay_detection: bool = True,
+                 policy: MixingPolicy = None, pool_capacity: int = None, high_water: int = POOL_HIGH_WATER,
+                 backlog: int = LISTEN_BACKLOG, circuit_capacity: int = CIRCUIT_CAPACITY,
+                 circuit_ttl: float = CIRCUIT_TTL, transport: str = TRANSPORT_TCP, config: NodeConfig = None) -> None:
         """
         init a relay/mixnode
         :param address: ip address of the relay/mixnode
         :param port: port number of the relay
         :param keys: private and public keys of the realy
+        :param pool_size: number of packets gathered in the pool before a batch is sent
+        :param timeout: seconds without incoming connections before the relay disconnects
+        :param replay_detection: reject the packets already received (with a default ReplayFilter)
+        :param policy: mixing policy deciding when the pool is flushed (default: threshold policy of pool_size)
+        :param pool_capacity: maximal number of packets inside the pool, packets arriving to a full pool are dropped
+        (default: unbounded)
+        :param high_water: packets inside the pool over which new packets are rejected with a busy reply, so that the
+        upstream senders back off (None: never reject)
+        :param backlog: number of connections waiting to be accepted, over which new connections are refused
+        :param circuit_capacity: maximal number of circuits set up at the relay
+        :param circuit_ttl: seconds a circuit is remembered after its setup
+        :param transport: name of the transport the relay listens on (tcp, unix or inproc)
+        :param config: tuning of the relay: its pool size, timeout and high-water mark override the arguments, and its
+        mixing policy is used unless policy is given. reconfigure changes it while the relay runs
         """
-        super().__init__(address, port, keys)
+        if config is not None:
+            pool_size, timeout, high_water = config.pool_size, config.timeout, config.high_water
+            if policy is None:
+                policy = config.make_policy()
+        else:
+            config = NodeConfig(pool_size=pool_size, timeout=timeout, high_water=high_water)
+        if policy is None:
+            policy = ThresholdPolicy(pool_size)
+        check_high_water(high_water, policy)
+        super().__init__(address, port, keys, timeout, backlog=backlog, high_water=high_water, transport=transport,
+                         config=config)
+        # pool size limit of the relay
+        self.pool_size = pool_size
+        self.policy = policy
+        # a policy flushing without arrivals is checked at every tick of the socket
+        if self.policy.tick is not None:
+            self._socket.settimeout(min(self.policy.tick, timeout))
         # next relay in the chain
         self.next = None
         # previous relay in the chain
         self.prev = None
         # messages pool
-        self._msgpool = set()
+        self._msgpool = MixPool(pool_size, pool_capacity)
+        # guards the messages pool: cover traffic is injected from another thread
+        self._pool_lock = threading.Lock()
+        # digests of the received packets, to reject replayed packets
+        self.replay_filter = ReplayFilter() if replay_detection else None
+        # circuits set up by the clients through the relay
+        self.circuits = CircuitTable(circuit_capacity, circuit_ttl)
 
     def __str__(self) -> str:
         return f'Relay-{self.address}'
@@ -87,38 +143,105 @@ class Relay(Server):
         :param kwargs:
         :return:
         """
+        last_arrival = time.monotonic()
         while True:
             # try to receive data from the socket until bytes are received or until timeout
             try:
                 sock_conn, addr = self._socket.accept()
-            # if reached timeout close the socket
-            except (OSError, socket.timeout):
+            # a tick of the mixing policy, before the timeout
+            except socket.timeout:
+                if time.monotonic() - last_arrival < self._timeout:
+                    self._send_batch()
+                    continue
+                self.close_socket()
+                PROFILER.finish()
+                break
+            # if reached timeout (or the socket was closed) close the socket
+            except OSError:
                 self.close_socket()
+                PROFILER.finish()
                 break
+            last_arrival = time.monotonic()
+            PROFILER.checkpoint(str(self))
             # print(f"{self.address}: Connected by {addr}")
-            data = sock_conn.recv(MSG_MAX_SIZE)
-            # assert len(data) == MSG_MAX_SIZE, f'size is {len(data)}'
-            msg_plain = self._decrypt_layer(data)
-            # print(f'{self}: got message: {msg_plain}')
-            # print(f'{self}: got message.')
+            # a single packet, or a batch frame holding every packet of a flush of the previous relay
+            frame = Node.unwrap_batch_frame(Node.recv_message(sock_conn))
+            received = time.monotonic()
+            METRICS.inc(str(self), 'packets_in', len(frame))
+            # admission control: over the high-water mark, reject the packets before decrypting them (and before
+            # remembering them, so that the retried packets are not taken for replays)
+            if self.high_water is not None and len(self._msgpool) >= self.high_water:
+                Node.reply(sock_conn, False)
+                METRICS.inc(str(self), 'busy_rejected', len(frame))
+                sock_conn.close()
+                continue
+            Node.reply(sock_conn, True)
             sock_conn.close()
-            # parse message and send to destination
-            packet = self._parse_msg(msg_plain)
-            self._msgpool.add(packet)
-            self._send_batch()
+            for data in frame:
+                # reject a replayed packet before decrypting it: the encrypted symmetric key heading every layer is
+                # randomized, so it identifies the layer
+                if self.replay_filter is not None and self.replay_filter.check_and_add(data[:SYM_KEY_LEN]):
+                    METRICS.inc(str(self), 'replays_rejected')
+                    continue
+                # assert len(data) == MSG_MAX_SIZE, f'size is {len(data)}'
+                # peel the layer (or open the circuit frame), parse it and add it to the pool
+                with METRICS.timer(str(self), 'decrypt_latency'), PROFILER.section('_decrypt_layer'):
+                    packets = self._peel(data)
+                decrypted = time.monotonic()
+                for packet in packets:
+                    self._add_to_pool(packet)
+                    if TRACER.enabled:
+                        TRACER.record(packet.trace, str(self), STAGE_RECEIVED, received)
+                        TRACER.record(packet.trace, str(self), STAGE_DECRYPTED, decrypted)
+                        TRACER.record(packet.trace, str(self), STAGE_POOLED, packet.arrival)
+            METRICS.set_gauge(str(self), 'pool_occupancy', len(self._msgpool))
+            with PROFILER.section('_send_batch'):
+                self._send_batch()
             # if time.time() - self._spawn >= self._ttl:
             #     pass
 
-    def send(self, host: str, port: int, msg: bytes) -> None:
+    def add_cover(self, packet: Packet) -> None:
+        """
+        inject a cover packet into the messages pool
+        :param packet: cover packet: a dummy onion for the next relays, or a packet to COVER_DEST
+        :return:
+        """
+        self._add_to_pool(packet)
+        METRICS.inc(str(self), 'cover_injected')
+        self._send_batch()
+
+    def send(self, host: str, port: int, msg: [bytes, list]) -> str:
         """
         send a message to host::port
         :param host: address of host
         :param port: port number of host
-        :param msg: message to be sent
-        :return:
+        :param msg: message (or frame) to be sent
+        :return: status of the sending (SEND_OK, SEND_BUSY or SEND_FAILED)
         """
         # print(f'{self}: sending...', end='')
-        super().send(host, port, msg)
+        return super().send(host, port, msg, self.config.max_tries, self.config.send_timeout)
+
+    def reconfigure(self, config: NodeConfig) -> List[str]:
+        """
+        apply a new configuration to the running relay: its reloadable parameters (pool size, flush interval and
+        high-water mark) take effect at once, the packets inside the pool are kept
+        :param config: new configuration of the relay
+        :return: names of the changed parameters which are not reloadable (applied after a restart only)
+        """
+        # the configuration is refused, and the current one kept, if the relay would never flush its pool
+        check_high_water(config.high_water, self.policy, config.pool_size)
+        ignored = [name for name, value in config.as_dict().items()
+                   if name not in NodeConfig.RELOADABLE and value != getattr(self.config, name)]
+        with self._pool_lock:
+            if config.pool_size != self.pool_size or config.flush_interval != self.config.flush_interval:
+                self.policy.reconfigure(config.pool_size, config.flush_interval)
+                self.pool_size = config.pool_size
+            self.high_water = config.high_water
+            self.config = self.config.replace(**{name: getattr(config, name) for name in NodeConfig.RELOADABLE})
+        # a policy flushing without arrivals is checked at every tick of the socket
+        self._socket.settimeout(min(self.policy.tick, self._timeout) if self.policy.tick is not None else self._timeout)
+        METRICS.inc(str(self), 'reconfigured')
+        return ignored
 
     def _parse_msg(self, msg: bytes) -> Packet:
         """
@@ -135,32 +258,141 @@ class Relay(Server):
         dest_idx = msg.rfind(DEST)
         next_layer = msg[start_idx + len(POST):dest_idx]
         port_idx = msg.rfind(PORT)
-        dest = msg[dest_idx + len(DEST):port_idx]
+        dest = msg[dest_idx + len(DEST):port_idx].lstrip()
         # end_idx = msg.rfind(END)
         port = msg[port_idx + len(PORT):]
-        return Packet(next_layer, dest, int(port))
+        # in benchmark tracing mode keep the random prefix of the layer to identify the packet
+        trace = msg[:PSEUDONYM_LEN] if TRACER.enabled else b''
+        return Packet(next_layer, dest, int(port), time.monotonic(), trace)
+
+    def _peel(self, data: bytes) -> List[Packet]:
+        """
+        peel a received packet: open the frame of a known circuit with the circuit key alone, or decrypt and parse an
+        onion layer (setting up its circuit, if it is a circuit setup layer)
+        :param data: received packet
+        :return: packets for the pool: none if the packet could not be peeled, several if the setup of a circuit
+        releases the frames which arrived before it
+        """
+        circuit = None if DEBUG_MODE else self.circuits.get(data[:CIRCUIT_ID_LEN])
+        if circuit is not None:
+            packet = self._open_circuit_frame(data, circuit)
+            return [] if packet is None else [packet]
+        try:
+            msg_plain, setup = self._peel_layer(data)
+            with METRICS.timer(str(self), 'parse_latency'):
+                packet = self._parse_msg(msg_plain)
+        except (ValueError, InvalidTag, InvalidToken):
+            # possibly a frame of a circuit whose setup is still mixed in the pool of a previous relay. only a
+            # well-formed frame is kept, so that junk packets do not fill the frames kept by the circuits table
+            if not is_frame(data):
+                METRICS.inc(str(self), 'packets_malformed')
+                return []
+            self.circuits.defer(data[:CIRCUIT_ID_LEN], data)
+            METRICS.inc(str(self), 'frames_deferred')
+            return []
+        if setup is None:
+            return [packet]
+        circuit_id, key = setup
+        frames = self.circuits.add(circuit_id, key, packet.dest, packet.port)
+        METRICS.inc(str(self), 'circuits_created')
+        circuit = self.circuits.get(circuit_id)
+        packets = [packet]
+        for frame in frames:
+            frame_packet = self._open_circuit_frame(frame, circuit)
+            if frame_packet is not None:
+                packets.append(frame_packet)
+        return packets
+
+    def _open_circuit_frame(self, frame: bytes, circuit: CircuitHop) -> Optional[Packet]:
+        """
+        open the frame of a circuit with the circuit key
+        :param frame: received frame
+        :param circuit: circuit of the frame
+        :return: packet of the frame for the next hop (None if the frame is not authentic)
+        """
+        try:
+            nonce, next_frame = open_frame(frame, circuit)
+        except (ValueError, InvalidTag):
+            METRICS.inc(str(self), 'packets_malformed')
+            return None
+        METRICS.inc(str(self), 'circuit_frames')
+        # in benchmark tracing mode, the nonce of the frame identifies it
+        trace = nonce[:PSEUDONYM_LEN] if TRACER.enabled else b''
+        return Packet(next_frame, circuit.dest, circuit.port, time.monotonic(), trace)
+
+    def _add_to_pool(self, packet: Packet) -> None:
+        """
+        add a packet to the messages pool (a packet arriving to a full pool is dropped)
+        :param packet: packet to add
+        :return:
+        """
+        with self._pool_lock:
+            added = self._msgpool.add(packet)
+        if not added:
+            METRICS.inc(str(self), 'pool_dropped')
 
     def _send_batch(self) -> None:
         """
-        start sending POOL_SIZE messages
+        send a batch of messages, if the mixing policy decides to flush the pool
         :return:
         """
-        # check if message pool reached the pool limit
-        if len(self._msgpool) >= POOL_SIZE:
-            # get the next batch and update the message pool of relay
-            limit = min(POOL_SIZE, len(self._msgpool))
-            # sample limit packets from message pool and send them
-            batch = random.sample(self._msgpool, limit)
-            # update message pool: remove sent packets
-            self._msgpool.difference_update(batch)
-            # shuffle the messages
-            batch = list(batch)
-            random.shuffle(batch)
-            # send packets in chosen batch
-            for packet in batch:
-                # add random bytes to message: all sent messages in the mixnet should have the same size
-                wrapped_msg = Node.wrap_message(packet.msg)
-                self.send(packet.dest, packet.port, wrapped_msg)
+        flushed = time.monotonic()
+        with self._pool_lock:
+            limit = self.policy.flush_size(self._msgpool, flushed)
+            if limit <= 0:
+                return
+            pool_size = len(self._msgpool)
+            # take limit random packets out of the pool: they come out in a random order
+            batch = self._msgpool.take_random(limit)
+            # in an instrumented benchmark run, report the composition of the flush
+            if FLUSH_OBSERVER.enabled:
+                FLUSH_OBSERVER.record_flush(str(self), flushed, pool_size, [packet.arrival for packet in batch])
+            METRICS.set_gauge(str(self), 'pool_occupancy', len(self._msgpool))
+        # group the packets of the batch by next hop, keeping their random order
+        hops = {}
+        for packet in batch:
+            # time the packet waited inside the pool
+            METRICS.observe(str(self), 'pool_time', flushed - packet.arrival)
+            # cover packets are dropped by the last relay: they only served to fill the pools
+            if packet.dest == COVER_DEST:
+                METRICS.inc(str(self), 'cover_dropped')
+                continue
+            if TRACER.enabled:
+                TRACER.record(packet.trace, str(self), STAGE_FLUSHED, flushed)
+            hops.setdefault((packet.dest, packet.port), []).append(packet)
+        # send the packets of every next hop over a single connection
+        sent = 0
+        for (dest, port), packets in hops.items():
+            for idx in range(0, len(packets), BATCH_FRAME_MAX):
+                sent += self._send_frame(dest, port, packets[idx:idx + BATCH_FRAME_MAX])
+        METRICS.inc(str(self), 'packets_out', sent)
+
+    def _send_frame(self, dest: bytes, port: int, packets: List[Packet]) -> int:
+        """
+        send packets to their next hop over a single connection: a single packet as is, several packets inside a batch
+        frame, in their order
+        :param dest: ip address of the next hop
+        :param port: port number of the next hop
+        :param packets: packets to the next hop (at most BATCH_FRAME_MAX)
+        :return: number of packets sent
+        """
+        # add random bytes to every message: all sent messages in the mixnet should have the same size.
+        # the padding is sent from the padding pool, without copying the messages
+        if len(packets) == 1:
+            frame = Node.wrap_frame(packets[0].msg)
+        else:
+            frame = Node.wrap_batch_frame([packet.msg for packet in packets])
+            METRICS.inc(str(self), 'batch_frames')
+        # a busy next hop slows down the flush: the pool then fills up, and this relay rejects its own senders
+        with METRICS.timer(str(self), 'send_latency'):
+            status = self.send(dest, port, frame)
+        if status != SEND_OK:
+            METRICS.inc(str(self), 'packets_lost', len(packets))
+            return 0
+        if TRACER.enabled:
+            for packet in packets:
+                TRACER.record(packet.trace, str(self), STAGE_FORWARDED)
+        return len(packets)
 
     def _decrypt_layer(self, layer: bytes) -> bytes:
         """
@@ -168,14 +400,35 @@ class Relay(Server):
         :param layer: layer to decrypt
         :return: decrypted layer
         """
+        return self._peel_layer(layer)[0]
+
+    def _peel_layer(self, layer: bytes) -> Tuple[bytes, Optional[Tuple[bytes, bytes]]]:
+        """
+        decrypt the given onion layer, as _decrypt_layer
+        :param layer: layer to decrypt
+        :return: decrypted layer, and the circuit id and key of the relay if the layer sets up a circuit (None
+        otherwise)
+        """
         # if in debug mode just cut the symmetric key part and discard it
         if DEBUG_MODE:
-            return layer
+            return layer, None
         # otherwise, extract the encrypted symmetric key part, and the cipher message part and:
         #   1. decrypt the symmetric key the relay's private key
         #   2. decrypt the cipher message with the symmetric key
         else:
             enc_key = layer[:SYM_KEY_LEN]
-            enc_layer = layer[SYM_KEY_LEN:]
             plain_key = decrypt(self._pr_key, enc_key)
-            return decrypt_symm(plain_key, enc_layer)
+            # aead layer: the header holds the key, the nonce and the length of the ciphertext following it
+            if len(plain_key) == LAYER_HEADER.size and plain_key[:len(AEAD_LAYER)] == AEAD_LAYER:
+                _, key, nonce, length = LAYER_HEADER.unpack(plain_key)
+                return decrypt_aead(key, nonce, layer[SYM_KEY_LEN:SYM_KEY_LEN + length], enc_key), None
+            # circuit setup layer: an aead layer, whose key becomes the key of the circuit at the relay
+            if len(plain_key) == CIRCUIT_HEADER.size and plain_key[:len(CIRCUIT_LAYER)] == CIRCUIT_LAYER:
+                _, key, nonce, length, circuit_id = CIRCUIT_HEADER.unpack(plain_key)
+                plain = decrypt_aead(key, nonce, layer[SYM_KEY_LEN:SYM_KEY_LEN + length], enc_key)
+                return plain, (circuit_id, key)
+            # fernet layer: the header holds the symmetric key and the length of the token following it
+            if len(plain_key) != FERNET_HEADER.size:
+                raise ValueError('unknown layer header')
+            key, length = FERNET_HEADER.unpack(plain_key)
+            return decrypt_symm(key, layer[SYM_KEY_LEN:SYM_KEY_LEN + length]), None
@@ -0,0 +1,108 @@
+# python imports
+import math
+import threading
+from hashlib import blake2b
+
+# default number of packets remembered by each generation of the replay filter
+REPLAY_CAPACITY = 100000
+# default false positive rate of the replay filter (a fresh packet rejected as a replay)
+REPLAY_FP_RATE = 1e-6
+# default memory cap (in bytes) of the replay filter, both generations included
+REPLAY_MAX_BYTES = 4 * 1024 * 1024
+# size in bytes of the digests of the packets
+DIGEST_SIZE = 16
+
+
+class _BloomFilter:
+    """
+    bloom filter of packets digests
+    """
+
+    def __init__(self, n_bits: int, n_hashes: int) -> None:
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.count = 0
+        self._bits = bytearray((n_bits + 7) // 8)
+
+    def _indexes(self, digest: bytes):
+        # double hashing: the k indexes are derived from two 64 bits halves of the digest
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self._bits
+        return all(bits[idx >> 3] & (1 << (idx & 7)) for idx in self._indexes(digest))
+
+    def add(self, digest: bytes) -> None:
+        bits = self._bits
+        for idx in self._indexes(digest):
+            bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class ReplayFilter:
+    """
+    memory-bounded replay detection: remembers the digests of the last seen packets inside two generations of bloom
+    filters. when the current generation is full, it becomes the old one and the previous old one is dropped, so the
+    filter always remembers (at least) the last capacity packets, and never uses more than max_bytes.
+    a packet is never reported as fresh if it was seen among the last capacity packets; a fresh packet is reported as a
+    replay with probability (about) fp_rate.
+    """
+
+    def __init__(self, capacity: int = REPLAY_CAPACITY, fp_rate: float = REPLAY_FP_RATE,
+                 max_bytes: int = REPLAY_MAX_BYTES) -> None:
+        """
+        init a replay filter instance
+        :param capacity: packets remembered by each generation
+        :param fp_rate: false positive rate of each generation
+        :param max_bytes: memory cap of the filter: the capacity is lowered to fit it
+        """
+        if capacity <= 0 or not 0 < fp_rate < 1:
+            raise ValueError('capacity must be positive and fp_rate between 0 and 1')
+        # optimal bits per packet and number of hashes of a bloom filter with the given false positive rate
+        bits_per_packet = -math.log(fp_rate) / math.log(2) ** 2
+        self.capacity = min(capacity, int(max_bytes * 8 / 2 / bits_per_packet))
+        if self.capacity <= 0:
+            raise ValueError(f'max_bytes={max_bytes} is too small for the false positive rate {fp_rate}')
+        self.fp_rate = fp_rate
+        self._n_bits = max(int(self.capacity * bits_per_packet), 8)
+        self._n_hashes = max(round(bits_per_packet * math.log(2)), 1)
+        self._lock = threading.Lock()
+        self._current = _BloomFilter(self._n_bits, self._n_hashes)
+        self._old = _BloomFilter(self._n_bits, self._n_hashes)
+
+    def __str__(self) -> str:
+        return f'ReplayFilter-{self.capacity}'
+
+    @staticmethod
+    def digest(data: bytes) -> bytes:
+        """
+        :param data: packet, or the part of the packet identifying it
+        :return: digest of the data
+        """
+        return blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+    def check_and_add(self, data: bytes) -> bool:
+        """
+        check whether the packet was already seen, and remember it
+        :param data: packet, or the part of the packet identifying it
+        :return: true if the packet is a replay
+        """
+        digest = ReplayFilter.digest(data)
+        with self._lock:
+            if digest in self._current or digest in self._old:
+                return True
+            if self._current.count >= self.capacity:
+                self._old, self._current = self._current, _BloomFilter(self._n_bits, self._n_hashes)
+            self._current.add(digest)
+            return False
+
+    def nbytes(self) -> int:
+        """
+        :return: memory used by the bits of the filter
+        """
+        return self._current.nbytes() + self._old.nbytes()
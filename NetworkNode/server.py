@@ -1,12 +1,25 @@
 # python imports
 import socket
+import struct
 import time
 from collections import deque
-from typing import Tuple
+from typing import Tuple, List
+from cryptography.exceptions import InvalidTag
 
 # project imports
-from NetworkNode.node import Node, SOCKET_TIMEOUT, POST, MSG_MAX_SIZE, DEBUG_MODE, CORE_MSG_SIZE, SLEEP_SEC
+from NetworkNode.node import Node, SOCKET_TIMEOUT, POST, MSG_MAX_SIZE, DEBUG_MODE, CORE_MSG_SIZE, SLEEP_SEC, \
+    PSEUDONYM_LEN, HYBRID, HYBRID_HEADER
 from NetworkNode.utils import *
+from NetworkNode.metrics import METRICS
+from NetworkNode.profiling import PROFILER
+from NetworkNode.tracing import TRACER, STAGE_RECEIVED, STAGE_DECRYPTED, STAGE_PARSED
+from NetworkNode.transport import TRANSPORTS, TRANSPORT_TCP, ROUTES
+from NetworkNode.config import NodeConfig
+
+# default length of the queue of the connections waiting to be accepted
+LISTEN_BACKLOG = 128
+# default high-water mark of the buffer of the server: over it, new messages get a busy reply
+BUFFER_HIGH_WATER = 65536
 
 
 class Server(Node):
@@ -14,20 +27,38 @@ class Server(Node):
     represents a server in the network
     """
 
-    def __init__(self, address: str, port: int, keys: Tuple[str, str] = ('server_pr_key', 'server_pb_key')) -> None:
+    def __init__(self, address: str, port: int, keys: Tuple[str, str] = ('server_pr_key', 'server_pb_key'),
+                 timeout: float = SOCKET_TIMEOUT, reuse_port: bool = False, backlog: int = LISTEN_BACKLOG,
+                 high_water: int = BUFFER_HIGH_WATER, transport: str = TRANSPORT_TCP, config: NodeConfig = None) -> None:
         """
         init a server instance
         :param address: ip address of the server
         :param port: port number of the server
         :param keys: private and public keys filenames of the server
+        :param timeout: seconds without incoming connections before the server disconnects
+        :param reuse_port: let other sockets (e.g. of worker processes) listen on the same address and port.
+        the kernel then balances the incoming connections between them
+        :param backlog: number of connections waiting to be accepted, over which new connections are refused
+        :param high_water: buffered messages over which new messages are rejected with a busy reply (None: unbounded)
+        :param transport: name of the transport the server listens on (tcp, unix or inproc). the senders of the process
+        reach a unix or inproc server through this transport, and the other destinations through TCP
+        :param config: tuning of the server (its timeout overrides timeout)
         """
-        super().__init__(address, keys)
-        self.port = port
-        # setup socket
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.bind((address, port))
-        self._socket.settimeout(SOCKET_TIMEOUT)  # setup timeout for the socket
-        self._socket.listen()  # setup as a listening socket
+        if config is not None:
+            timeout = config.timeout
+        else:
+            config = NodeConfig(timeout=timeout)
+        super().__init__(address, keys, config)
+        if transport not in TRANSPORTS:
+            raise ValueError(f'unknown transport {transport}')
+        self.transport = transport
+        # setup listening socket, and the actual port, if it was picked (port 0)
+        self._socket, self.port = TRANSPORTS[transport].listen(address, port, backlog, reuse_port)
+        self._timeout = timeout
+        self._socket.settimeout(timeout)  # setup timeout for the socket
+        if transport != TRANSPORT_TCP:
+            ROUTES.set(address, self.port, transport)
+        self.high_water = high_water
         self._socket_closed = False  # flag to indicate if the socket has been closed
 
     def __str__(self) -> str:
@@ -54,15 +85,42 @@ class Server(Node):
                 sock_conn, addr = self._socket.accept()
             except (OSError, socket.timeout):
                 self.close_socket()
+                PROFILER.finish()
                 break
+            PROFILER.checkpoint(str(self))
             # print(f"{self.address}: Connected by {addr}")
-            data = sock_conn.recv(MSG_MAX_SIZE)
-            # print(f'{self}: got data: {data}')
-            msg_plain = self._decrypt_msg(data)
-            msg_parsed = self._parse_msg(msg_plain)
-            buffer.append(msg_parsed)
-            # print(f'{self}: got message: {msg_parsed}')
+            # a single message, or a batch frame holding every message of a flush of the last relay
+            frame = Node.unwrap_batch_frame(Node.recv_message(sock_conn))
+            received = time.monotonic()
+            # admission control: over the high-water mark, reject the messages before decrypting them
+            if self.high_water is not None and len(buffer) >= self.high_water:
+                Node.reply(sock_conn, False)
+                METRICS.inc(str(self), 'busy_rejected', len(frame))
+                sock_conn.close()
+                continue
+            Node.reply(sock_conn, True)
             sock_conn.close()
+            for data in frame:
+                # print(f'{self}: got data: {data}')
+                # a malformed message is dropped alone: the other messages of the frame were already accepted
+                try:
+                    with METRICS.timer(str(self), 'decrypt_latency'), PROFILER.section('_decrypt_msg'):
+                        msg_plain = self._decrypt_msg(data)
+                    decrypted = time.monotonic()
+                    with METRICS.timer(str(self), 'parse_latency'):
+                        msgs_parsed = self._parse_msgs(msg_plain)
+                except (ValueError, InvalidTag, struct.error):
+                    METRICS.inc(str(self), 'packets_malformed')
+                    continue
+                buffer.extend(msgs_parsed)
+                # in benchmark mode, the random prefix of the core message is the trace id of the message
+                if TRACER.enabled:
+                    TRACER.record(msg_plain[:PSEUDONYM_LEN], str(self), STAGE_RECEIVED, received)
+                    TRACER.record(msg_plain[:PSEUDONYM_LEN], str(self), STAGE_DECRYPTED, decrypted)
+                    TRACER.record(msg_plain[:PSEUDONYM_LEN], str(self), STAGE_PARSED)
+                METRICS.mark(str(self), 'ingest', len(msgs_parsed))
+            METRICS.set_gauge(str(self), 'buffer_depth', len(buffer))
+            # print(f'{self}: got message: {msg_parsed}')
             # if time.time() - self._spawn >= self._ttl:
             #     self.close_socket()
             #     break
@@ -75,6 +133,8 @@ class Server(Node):
         if not self._socket_closed:
             self._socket_closed = True
             self._socket.close()
+            if self.transport != TRANSPORT_TCP:
+                ROUTES.remove(self.address, self.port)
             print(f'{self}: disconnecting\n')
             time.sleep(SLEEP_SEC)
 
@@ -84,6 +144,16 @@ class Server(Node):
         """
         return not self._socket_closed
 
+    def _parse_msgs(self, msg: bytes) -> List[bytes]:
+        """
+        parses the given core message, holding a single message or a batch of messages (hybrid core message)
+        :param msg: decrypted core message
+        :return: parsed messages
+        """
+        if msg[PSEUDONYM_LEN:PSEUDONYM_LEN + len(HYBRID)] == HYBRID:
+            return [self._parse_msg(entry) for entry in Node.unpack_batch(msg[PSEUDONYM_LEN + len(HYBRID):])]
+        return [self._parse_msg(msg)]
+
     def _parse_msg(self, msg: bytes) -> bytes:
         """
         parses the given message. unwrap the given message: remove added random bytes
@@ -100,10 +170,19 @@ class Server(Node):
         """
         decrypt the given message
         :param msg: message to decrypt
-        :return: decrypted message
+        :return: decrypted message. a hybrid core message is returned as its pseudonym, HYBRID and the decrypted batch
         """
         unwrapped_msg = msg[:CORE_MSG_SIZE]
         if DEBUG_MODE:
-            return unwrapped_msg
+            header = unwrapped_msg
         else:
-            return decrypt(self._pr_key, unwrapped_msg)
+            header = decrypt(self._pr_key, unwrapped_msg)
+        if header[PSEUDONYM_LEN:PSEUDONYM_LEN + len(HYBRID)] != HYBRID:
+            return header
+        # hybrid core message: the header holds the key of the batch following it
+        pseudonym = header[:PSEUDONYM_LEN]
+        _, key, nonce, length = HYBRID_HEADER.unpack_from(header, PSEUDONYM_LEN)
+        payload = msg[CORE_MSG_SIZE:CORE_MSG_SIZE + length]
+        if not DEBUG_MODE:
+            payload = decrypt_aead(key, nonce, payload, pseudonym)
+        return pseudonym + HYBRID + payload
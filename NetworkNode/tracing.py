@@ -0,0 +1,182 @@
+# python imports
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple, Iterable
+
+# project imports
+from NetworkNode.metrics import percentile
+
+# stages recorded along the path of a message
+STAGE_CLIENT_START = 'client_start'
+STAGE_ONION_BUILT = 'onion_built'
+STAGE_CLIENT_SENT = 'client_sent'
+STAGE_RECEIVED = 'received'
+STAGE_DECRYPTED = 'decrypted'
+STAGE_POOLED = 'pooled'
+STAGE_FLUSHED = 'flushed'
+STAGE_FORWARDED = 'forwarded'
+STAGE_PARSED = 'parsed'
+
+# kinds of records inside the trace log
+RECORD_STAGE = 's'
+RECORD_LINK = 'l'
+# number of records buffered in memory before writing them to the log
+FLUSH_EVERY = 1024
+# percentiles reported by the breakdown
+TRACE_PERCENTILES = (50, 90, 99)
+
+
+class Tracer:
+    """
+    benchmark mode tracer. when enabled, every node appends (trace key, node, stage, monotonic timestamp) records
+    to a local log. nothing is added to the sent packets: records are keyed on the random pseudonym that already
+    prefixes every onion layer and the core message. the client, which creates all of these pseudonyms,
+    links the layers pseudonyms to the core message pseudonym (the trace id).
+    when disabled (the default), the tracer records nothing.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.filename = None
+        self._lock = threading.Lock()
+        self._lines = []
+
+    def enable(self, filename: str) -> None:
+        """
+        start recording into the given log file (records are appended)
+        :param filename: path of the trace log
+        :return:
+        """
+        self.filename = filename
+        self.enabled = True
+
+    def disable(self) -> None:
+        """
+        stop recording, and write the buffered records into the log
+        :return:
+        """
+        self.enabled = False
+        self.flush()
+
+    def record(self, key: bytes, node: str, stage: str, timestamp: float = None) -> None:
+        """
+        record that the message with the given key reached a stage
+        :param key: pseudonym of the layer (or core message) seen by the node
+        :param node: name of the recording node
+        :param stage: name of the stage
+        :param timestamp: monotonic time of the stage (default: now)
+        :return:
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._append(f'{RECORD_STAGE}\t{key.hex()}\t{node}\t{stage}\t{timestamp:.9f}\n')
+
+    def link(self, trace_id: bytes, node: str, key: bytes) -> None:
+        """
+        record that the layer of node with the given pseudonym belongs to the message trace_id
+        :param trace_id: pseudonym of the core message
+        :param node: name of the node peeling the layer
+        :param key: pseudonym of the layer
+        :return:
+        """
+        self._append(f'{RECORD_LINK}\t{trace_id.hex()}\t{node}\t{key.hex()}\n')
+
+    def flush(self) -> None:
+        """
+        write the buffered records into the log
+        :return:
+        """
+        with self._lock:
+            lines, self._lines = self._lines, []
+            if lines and self.filename is not None:
+                with open(self.filename, 'a') as file:
+                    file.writelines(lines)
+
+    def _append(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            full = len(self._lines) >= FLUSH_EVERY
+        if full:
+            self.flush()
+
+
+# tracer shared by all the nodes of the process
+TRACER = Tracer()
+
+
+def load_trace(filenames: Iterable[str]) -> Tuple[Dict[str, list], Dict[str, str]]:
+    """
+    load trace logs
+    :param filenames: paths of trace logs (e.g. one per process)
+    :return: stage records by key, and a mapping from layers keys to their trace id
+    """
+    records = defaultdict(list)
+    links = {}
+    for filename in filenames:
+        with open(filename, 'r') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == RECORD_STAGE:
+                    key, node, stage, timestamp = fields[1:]
+                    records[key].append((float(timestamp), node, stage))
+                elif fields[0] == RECORD_LINK:
+                    trace_id, node, key = fields[1:]
+                    links[key] = trace_id
+    return records, links
+
+
+def stitch_traces(filenames: Iterable[str]) -> Dict[str, List[Tuple[float, str, str]]]:
+    """
+    stitch the records of all nodes into per-message hop timelines
+    :param filenames: paths of trace logs
+    :return: (timestamp, node, stage) timeline of every message, ordered by time, by trace id
+    """
+    records, links = load_trace(filenames)
+    timelines = defaultdict(list)
+    for key, events in records.items():
+        # layers keys are translated to the trace id of their message, core messages keys are the trace id
+        timelines[links.get(key, key)].extend(events)
+    for events in timelines.values():
+        events.sort()
+    return dict(timelines)
+
+
+def stage_breakdown(timelines: Dict[str, list]) -> Dict[str, List[float]]:
+    """
+    split every timeline into the segments between consecutive stages
+    :param timelines: per-message timelines, as returned by stitch_traces
+    :return: sorted durations of each segment (named 'node:stage -> node:stage'), and of the whole path
+    ('end_to_end')
+    """
+    segments = defaultdict(list)
+    for events in timelines.values():
+        if len(events) < 2:
+            continue
+        for (t0, node0, stage0), (t1, node1, stage1) in zip(events, events[1:]):
+            segments[f'{_role(node0)}:{stage0} -> {_role(node1)}:{stage1}'].append(t1 - t0)
+        segments['end_to_end'].append(events[-1][0] - events[0][0])
+    for durations in segments.values():
+        durations.sort()
+    return dict(segments)
+
+
+def _role(node: str) -> str:
+    """
+    :param node: name of a node
+    :return: name of the node in the breakdown: clients are grouped together, relays and servers are kept apart
+    """
+    return 'Client' if node.startswith('Client-') else node
+
+
+def breakdown_summary(segments: Dict[str, List[float]]) -> Dict[str, dict]:
+    """
+    :param segments: durations of each segment, as returned by stage_breakdown
+    :return: count, mean and percentiles of each segment
+    """
+    summary = {}
+    for name, durations in segments.items():
+        summary[name] = {'count': len(durations), 'mean': sum(durations) / len(durations)}
+        for q in TRACE_PERCENTILES:
+            summary[name][f'p{q}'] = percentile(durations, q)
+    return summary
@@ -0,0 +1,364 @@
+# python imports
+import errno
+import itertools
+import os
+import queue
+import socket
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# names of the transports
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_UNIX = 'unix'
+TRANSPORT_INPROC = 'inproc'
+# directory of the unix domain sockets, one socket file for every address and port
+UNIX_SOCKET_DIR = os.path.join(tempfile.gettempdir(), 'mixnet-sockets')
+# first port number given to the unix and in-process listeners binding port 0
+EPHEMERAL_PORT = 49152
+
+
+class Transport:
+    """
+    base class of the transports carrying the messages between the nodes: a listener accepts connections, and every
+    connection carries a single message and its reply. connections and listeners behave as sockets (accept, recv,
+    sendall, sendmsg, shutdown, settimeout, close), so the nodes use the same code over every transport
+    """
+    name = None
+
+    def listen(self, address: str, port: int, backlog: int, reuse_port: bool = False) -> Tuple[object, int]:
+        """
+        listen on address::port
+        :param address: ip address of the listener (a name of the listener, for the non-ip transports)
+        :param port: port number of the listener (0: pick a free one)
+        :param backlog: number of connections waiting to be accepted, over which new connections are refused
+        :param reuse_port: let other listeners share the address and port
+        :return: listener, and its actual port number
+        """
+        raise NotImplementedError
+
+    def connect(self, host: str, port: int, timeout: float) -> object:
+        """
+        :param host: ip address of the listener
+        :param port: port number of the listener
+        :param timeout: seconds to wait for the connection, and for every operation on it
+        :return: connection to the listener
+        """
+        raise NotImplementedError
+
+
+class TcpTransport(Transport):
+    """
+    TCP sockets: the only transport between hosts
+    """
+    name = TRANSPORT_TCP
+
+    def listen(self, address: str, port: int, backlog: int, reuse_port: bool = False) -> Tuple[socket.socket, int]:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if reuse_port:
+                if not hasattr(socket, 'SO_REUSEPORT'):
+                    raise OSError('SO_REUSEPORT is not supported on this platform')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((address, port))
+            sock.listen(backlog)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.getsockname()[1]
+
+    def connect(self, host: str, port: int, timeout: float) -> socket.socket:
+        return socket.create_connection((host, port), timeout=timeout)
+
+
+class _UnixListener:
+    """
+    listening unix domain socket, removing its socket file when closed
+    """
+
+    def __init__(self, sock: socket.socket, path: str) -> None:
+        self._socket = sock
+        self._path = path
+
+    def accept(self) -> Tuple[socket.socket, str]:
+        return self._socket.accept()
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._socket.settimeout(timeout)
+
+    def close(self) -> None:
+        self._socket.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+
+class UnixTransport(Transport):
+    """
+    unix domain sockets: the nodes of a host exchange their messages without the TCP stack (no handshake, no
+    loopback routing). address::port names a socket file inside UNIX_SOCKET_DIR
+    """
+    name = TRANSPORT_UNIX
+
+    def __init__(self, directory: str = UNIX_SOCKET_DIR) -> None:
+        """
+        :param directory: directory of the socket files
+        """
+        self.directory = directory
+        self._ports = itertools.count(EPHEMERAL_PORT)
+        self._lock = threading.Lock()
+
+    def path(self, address: str, port: int) -> str:
+        """
+        :param address: ip address of the listener
+        :param port: port number of the listener
+        :return: path of the socket file of address::port
+        """
+        return os.path.join(self.directory, f'{address}-{port}.sock')
+
+    def listen(self, address: str, port: int, backlog: int, reuse_port: bool = False) -> Tuple[_UnixListener, int]:
+        if reuse_port:
+            raise OSError('reuse_port is only supported by the tcp transport')
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            if port == 0:
+                port = next(port for port in self._ports if not os.path.exists(self.path(address, port)))
+            path = self.path(address, port)
+            # the socket file of a listener which did not close is removed, the one of a live listener is kept
+            if os.path.exists(path):
+                try:
+                    self.connect(address, port, timeout=1).close()
+                except OSError:
+                    os.unlink(path)
+                else:
+                    raise OSError(errno.EADDRINUSE, f'{path} is in use')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.bind(path)
+                sock.listen(backlog)
+            except OSError:
+                sock.close()
+                raise
+        return _UnixListener(sock, path), port
+
+    def connect(self, host: str, port: int, timeout: float) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.path(host, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class _InprocConnection:
+    """
+    end of an in-process connection: the bytes sent by one end are appended to the incoming bytes of the other end,
+    under the lock shared by both ends
+    """
+
+    def __init__(self, cond: threading.Condition, timeout: Optional[float]) -> None:
+        self._cond = cond
+        self._timeout = timeout
+        self._incoming = bytearray()
+        # the other end shut down its writes (or closed the connection)
+        self._eof = False
+        self._closed = False
+        self.peer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._timeout = timeout
+
+    def sendall(self, data) -> None:
+        self.sendmsg([data])
+
+    def sendmsg(self, buffers: List) -> int:
+        # the buffers are copied once, straight into the incoming bytes of the other end
+        with self._cond:
+            if self._closed or self.peer._closed:
+                raise BrokenPipeError(errno.EPIPE, 'connection closed')
+            size = len(self.peer._incoming)
+            for buffer in buffers:
+                self.peer._incoming += buffer
+            self._cond.notify_all()
+            return len(self.peer._incoming) - size
+
+    def shutdown(self, how: int) -> None:
+        with self._cond:
+            self.peer._eof = True
+            self._cond.notify_all()
+
+    def recv(self, n: int) -> bytes:
+        """
+        :param n: maximal number of bytes to receive
+        :return: the next n bytes, or less once the other end shut down its writes (b'' at the end)
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._incoming) >= n or self._eof or self._closed, self._timeout):
+                raise socket.timeout('timed out')
+            data = bytes(self._incoming[:n])
+            del self._incoming[:n]
+            return data
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self.peer._eof = True
+            self._cond.notify_all()
+
+
+class _InprocListener:
+    """
+    in-process listener: a bounded queue of the connections waiting to be accepted
+    """
+
+    def __init__(self, transport, key: Tuple[str, int], backlog: int) -> None:
+        self._transport = transport
+        self._key = key
+        self._pending = queue.Queue(maxsize=max(backlog, 1))
+        self._timeout = None
+        self._closed = False
+
+    def accept(self) -> Tuple[_InprocConnection, Tuple[str, int]]:
+        if self._closed:
+            raise OSError(errno.EBADF, 'listener closed')
+        try:
+            conn = self._pending.get(timeout=self._timeout)
+        except queue.Empty:
+            raise socket.timeout('timed out')
+        if conn is None:
+            raise OSError(errno.EBADF, 'listener closed')
+        conn.settimeout(self._timeout)
+        return conn, self._key
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self._timeout = timeout
+
+    def offer(self, conn: _InprocConnection) -> None:
+        """
+        queue a new connection
+        :param conn: listener end of the connection
+        :return:
+        """
+        if self._closed:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, 'listener closed')
+        try:
+            self._pending.put_nowait(conn)
+        except queue.Full:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, 'backlog is full')
+
+    def close(self) -> None:
+        self._transport.unbind(self._key)
+        self._closed = True
+        # wake up a thread blocked inside accept
+        try:
+            self._pending.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class InprocTransport(Transport):
+    """
+    in-process channels: the nodes of a process exchange their messages through memory, without any system call.
+    address::port names a listener of the process
+    """
+    name = TRANSPORT_INPROC
+
+    def __init__(self) -> None:
+        self._listeners: Dict[Tuple[str, int], _InprocListener] = {}
+        self._ports = itertools.count(EPHEMERAL_PORT)
+        self._lock = threading.Lock()
+
+    def listen(self, address: str, port: int, backlog: int,
+               reuse_port: bool = False) -> Tuple[_InprocListener, int]:
+        if reuse_port:
+            raise OSError('reuse_port is only supported by the tcp transport')
+        with self._lock:
+            if port == 0:
+                port = next(port for port in self._ports if (address, port) not in self._listeners)
+            if (address, port) in self._listeners:
+                raise OSError(errno.EADDRINUSE, f'{address}:{port} is in use')
+            listener = _InprocListener(self, (address, port), backlog)
+            self._listeners[(address, port)] = listener
+        return listener, port
+
+    def unbind(self, key: Tuple[str, int]) -> None:
+        """
+        forget a closed listener
+        :param key: address and port of the listener
+        :return:
+        """
+        with self._lock:
+            self._listeners.pop(key, None)
+
+    def connect(self, host: str, port: int, timeout: float) -> _InprocConnection:
+        listener = self._listeners.get((host, port))
+        if listener is None:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, f'nothing listens on {host}:{port}')
+        cond = threading.Condition(threading.Lock())
+        conn, peer = _InprocConnection(cond, timeout), _InprocConnection(cond, None)
+        conn.peer, peer.peer = peer, conn
+        listener.offer(peer)
+        return conn
+
+
+# transports by name, shared by all the nodes of the process
+TRANSPORTS = {TRANSPORT_TCP: TcpTransport(), TRANSPORT_UNIX: UnixTransport(), TRANSPORT_INPROC: InprocTransport()}
+
+
+class Routes:
+    """
+    topology configuration of the process: the transport reaching every address::port. the nodes listening on a unix
+    or in-process transport register themselves, so the co-located senders reach them without TCP; the other
+    destinations are reached with the default transport (TCP, unless configured otherwise)
+    """
+
+    def __init__(self, default: str = TRANSPORT_TCP) -> None:
+        """
+        :param default: name of the transport of the unknown destinations
+        """
+        self.default = default
+        self._routes: Dict[Tuple[str, int], str] = {}
+        self._lock = threading.Lock()
+
+    def set(self, host: str, port: int, transport: str) -> None:
+        """
+        reach host::port with the given transport
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :param transport: name of the transport
+        :return:
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError(f'unknown transport {transport}')
+        with self._lock:
+            self._routes[(host, port)] = transport
+
+    def remove(self, host: str, port: int) -> None:
+        """
+        forget the route to host::port
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return:
+        """
+        with self._lock:
+            self._routes.pop((host, port), None)
+
+    def get(self, host: str, port: int) -> Transport:
+        """
+        :param host: ip address of the destination
+        :param port: port number of the destination
+        :return: transport reaching host::port
+        """
+        return TRANSPORTS[self._routes.get((host, port), self.default)]
+
+
+ROUTES = Routes()
@@ -1,6 +1,7 @@
 from cryptography.exceptions import InvalidSignature
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
 import os
@@ -8,6 +9,13 @@ import pickle
 import json
 
 KEYS_PATH = os.path.abspath('keys')
+# sizes in bytes of the keys and nonces of the authenticated (aead) encryption
+AEAD_KEY_LEN = 32
+AEAD_NONCE_LEN = 12
+AEAD_TAG_LEN = 16
+# size in bytes of a symmetric (fernet) key, and of the fixed part of a fernet token: version, timestamp, iv and hmac
+SYMM_KEY_LEN = 44
+SYMM_TOKEN_OVERHEAD = 1 + 8 + 16 + 32
 JSON_PATH = os.path.abspath('json')
 
 
@@ -132,6 +140,24 @@ def decrypt_symm(key: bytes, message: bytes):
     return plain_txt
 
 
+def symm_cipher_len(length: int) -> int:
+    # aes-cbc with pkcs7 padding, then base64 of the whole token
+    return 4 * -(-(SYMM_TOKEN_OVERHEAD + 16 * (length // 16 + 1)) // 3)
+
+
+# ============================================ AUTHENTICATED_ENCRYPTION ============================================ #
+def generate_aead_key() -> bytes:
+    return AESGCM.generate_key(bit_length=AEAD_KEY_LEN * 8)
+
+
+def encrypt_aead(key: bytes, nonce: bytes, message: bytes, associated_data: bytes = None) -> bytes:
+    return AESGCM(key).encrypt(nonce, message, associated_data)
+
+
+def decrypt_aead(key: bytes, nonce: bytes, message: bytes, associated_data: bytes = None) -> bytes:
+    return AESGCM(key).decrypt(nonce, message, associated_data)
+
+
 # ============================================ FILE_FUNCTIONS ============================================ #
 
 
@@ -0,0 +1,133 @@
+# python imports
+import multiprocessing as mp
+import queue
+import threading
+from collections import deque
+from typing import Tuple
+
+# project imports
+from NetworkNode.server import Server
+from NetworkNode.node import SOCKET_TIMEOUT
+from NetworkNode.metrics import METRICS
+
+# start method of the worker processes: a fresh interpreter, nothing inherited from the threads of the parent
+START_METHOD = 'spawn'
+# seconds between two checks that the workers are still alive, while no message arrives
+FEED_POLL = 1
+
+
+class _QueueBuffer:
+    """
+    buffer of a worker server: the messages appended by Server.receive are put into the queue shared with the parent
+    """
+
+    def __init__(self, queue: mp.Queue) -> None:
+        self._queue = queue
+
+    def __len__(self) -> int:
+        try:
+            return self._queue.qsize()
+        # not implemented on every platform (e.g. macOS)
+        except NotImplementedError:
+            return 0
+
+    def append(self, msg: bytes) -> None:
+        self._queue.put([msg])
+
+    def extend(self, msgs: list) -> None:
+        self._queue.put(list(msgs))
+
+
+def _worker_main(address: str, port: int, keys: Tuple[str, str], timeout: float, msgs_queue: mp.Queue) -> None:
+    """
+    entry point of a worker process: accept, decrypt and parse messages until the timeout, then tell the parent
+    :param address: ip address of the server
+    :param port: port number of the server
+    :param keys: private and public keys filenames of the server
+    :param timeout: seconds without incoming connections before the worker disconnects
+    :param msgs_queue: queue of the parsed messages, shared with the parent
+    :return:
+    """
+    try:
+        server = Server(address, port, keys, timeout=timeout, reuse_port=True)
+        server.receive(_QueueBuffer(msgs_queue))
+    finally:
+        # end of the messages of this worker
+        msgs_queue.put(None)
+
+
+class ServerWorkers:
+    """
+    worker processes accepting, decrypting and parsing the messages sent to a server, on the same address and port
+    (SO_REUSEPORT): the kernel balances the incoming connections between the server and its workers, so the private
+    key decryptions run on several cores. the parsed messages of all the workers are fed into the buffer of the
+    server, from a single queue.
+    the metrics and the traces of the workers stay inside the worker processes.
+    """
+
+    def __init__(self, server: Server, n_workers: int, buffer: [deque, list],
+                 keys: Tuple[str, str] = ('server_pr_key', 'server_pb_key'), timeout: float = SOCKET_TIMEOUT) -> None:
+        """
+        init the worker processes of a server
+        :param server: server listening with reuse_port
+        :param n_workers: number of worker processes
+        :param buffer: buffer of the server, fed with the messages parsed by the workers
+        :param keys: private and public keys filenames of the server
+        :param timeout: seconds without incoming connections before a worker disconnects
+        """
+        self._server = server
+        self._buffer = buffer
+        context = mp.get_context(START_METHOD)
+        self._queue = context.Queue()
+        self._processes = [context.Process(target=_worker_main,
+                                           args=(server.address, server.get_port(), keys, timeout, self._queue),
+                                           name=f'{server}-worker-{i}', daemon=True)
+                           for i in range(n_workers)]
+        self._feeder = threading.Thread(target=self._feed, name=f'{server}-feeder')
+
+    def __str__(self) -> str:
+        return f'{self._server}-workers'
+
+    def start(self) -> None:
+        """
+        start the worker processes, and the thread feeding their messages into the buffer
+        :return:
+        """
+        for process in self._processes:
+            process.start()
+        self._feeder.start()
+
+    def join(self) -> None:
+        """
+        wait for all the workers to disconnect, and for their messages to be fed into the buffer
+        :return:
+        """
+        self._feeder.join()
+        for process in self._processes:
+            process.join()
+
+    def is_alive(self) -> bool:
+        """
+        :return: true while some workers may still feed messages
+        """
+        return self._feeder.is_alive()
+
+    def _feed(self) -> None:
+        """
+        move the messages parsed by the workers into the buffer, until every worker disconnected
+        :return:
+        """
+        running = len(self._processes)
+        while running > 0:
+            try:
+                msgs = self._queue.get(timeout=FEED_POLL)
+            except queue.Empty:
+                # a worker killed before telling its end
+                if not any(process.is_alive() for process in self._processes):
+                    break
+                continue
+            if msgs is None:
+                running -= 1
+                continue
+            self._buffer.extend(msgs)
+            METRICS.mark(str(self), 'ingest', len(msgs))
@@ -0,0 +1,313 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from mot_app import app_demo, MAX_N_CLIENTS, MAX_N_RELAYS_AEAD, MAX_N_MSGS
+from NetworkNode import TRACER, METRICS, POOL_SIZE, MSG_MAX_SIZE, DEBUG_MODE, FLUSH_OBSERVER, POLICIES, \
+    POLICY_THRESHOLD, POLICY_TIMED, NodeConfig
+from NetworkNode.metrics import percentile
+from NetworkNode.tracing import stitch_traces, STAGE_CLIENT_START, STAGE_PARSED
+
+# default sweep of the benchmark
+N_CLIENTS = [32, 128]
+N_RELAYS = [3]
+POOL_SIZES = [16, POOL_SIZE]
+SEND_RATES = [1.]  # messages per second of each client, 0 means as fast as possible
+MIX_POLICIES = [POLICY_THRESHOLD]
+N_MSGS = 8
+# fraction of the first delivered messages ignored when measuring the sustained throughput
+WARMUP_FRACTION = 0.2
+# seconds without traffic before the nodes of a run disconnect
+BENCH_TIMEOUT = 5
+# relative change of a metric, with respect to the baseline, that is reported as a regression
+REGRESSION_TOLERANCE = 0.1
+LATENCY_PERCENTILES = (50, 90, 99)
+# latency percentile of the anonymity-versus-latency frontier
+FRONTIER_LATENCY = 'p50'
+
+
+def environment_metadata() -> dict:
+    """
+    :return: description of the machine and the code the benchmark ran on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'commit': commit,
+            'msg_max_size': MSG_MAX_SIZE,
+            'debug_mode': DEBUG_MODE}
+
+
+def config_key(config: dict) -> str:
+    """
+    :param config: configuration of a benchmark run
+    :return: name identifying the configuration in results and baselines
+    """
+    key = f'clients={config["n_clients"]},relays={config["n_relays"]},pool={config["pool_size"]},' \
+          f'rate={config["send_rate"]}'
+    # the runs of the default policy keep the keys of the baselines recorded before the policies were swept
+    if config.get('mix_policy', POLICY_THRESHOLD) != POLICY_THRESHOLD or config.get('flush_interval') is not None:
+        key += f',policy={config["mix_policy"]}({config["flush_interval"]})'
+    return key
+
+
+def sustained_throughput(delivery_times: list, warmup_fraction: float = WARMUP_FRACTION) -> float:
+    """
+    compute the delivery rate after the warm-up
+    :param delivery_times: sorted times the server parsed the messages at
+    :param warmup_fraction: fraction of the first deliveries to ignore
+    :return: delivered messages per second (0 if there are not enough deliveries)
+    """
+    steady = delivery_times[int(len(delivery_times) * warmup_fraction):]
+    if len(steady) < 2 or steady[-1] == steady[0]:
+        return 0.
+    return (len(steady) - 1) / (steady[-1] - steady[0])
+
+
+def run_config(n_clients: int, n_relays: int, pool_size: int, send_rate: float,
+               n_msgs: int = N_MSGS, timeout: float = BENCH_TIMEOUT,
+               warmup_fraction: float = WARMUP_FRACTION, mix_policy: str = POLICY_THRESHOLD,
+               flush_interval: float = None, anonymity: bool = False) -> dict:
+    """
+    run the MoT app once and measure it with the benchmark tracing mode
+    :param n_clients: number of client applications
+    :param n_relays: number of relays in the chain
+    :param pool_size: pool size of every relay
+    :param send_rate: messages per second of each client (0 means as fast as possible)
+    :param n_msgs: messages sent by each client
+    :param timeout: seconds without traffic before the nodes disconnect
+    :param warmup_fraction: fraction of the first deliveries ignored by the throughput
+    :param mix_policy: mixing policy of the relays
+    :param flush_interval: flush interval of the timed policy, flush deadline of the threshold policy
+    :param anonymity: instrument the flushes of the relays, and measure the anonymity of the run
+    :return: results of the run
+    """
+    config = {'n_clients': n_clients, 'n_relays': n_relays, 'pool_size': pool_size, 'send_rate': send_rate,
+              'n_msgs': n_msgs, 'mix_policy': mix_policy, 'flush_interval': flush_interval}
+    fd, trace_file = tempfile.mkstemp(prefix='bench-', suffix='.trace')
+    os.close(fd)
+    METRICS.reset()
+    TRACER.enable(trace_file)
+    if anonymity:
+        FLUSH_OBSERVER.enable()
+    start = time.time()
+    app_demo(n_relays, n_clients, n_msgs, NodeConfig(pool_size, mix_policy, flush_interval, timeout=timeout),
+             send_interval=1 / send_rate if send_rate > 0 else 0)
+    wall_time = time.time() - start
+    TRACER.disable()
+    FLUSH_OBSERVER.disable()
+    timelines = stitch_traces([trace_file])
+    os.remove(trace_file)
+
+    # end-to-end latency of a message: from the start of its send by the client to its parsing by the server
+    latencies, delivery_times = [], []
+    for events in timelines.values():
+        sent = [t for t, node, stage in events if stage == STAGE_CLIENT_START]
+        parsed = [t for t, node, stage in events if stage == STAGE_PARSED and node.startswith('Server')]
+        if sent and parsed:
+            latencies.append(parsed[0] - sent[0])
+            delivery_times.append(parsed[0])
+    latencies.sort()
+    delivery_times.sort()
+    latency = {f'p{q}': percentile(latencies, q) for q in LATENCY_PERCENTILES}
+    latency['mean'] = sum(latencies) / len(latencies) if latencies else 0.
+    results = {'config': config,
+               'sent': n_clients * n_msgs,
+               'delivered': len(latencies),
+               'latency': latency,
+               'throughput': sustained_throughput(delivery_times, warmup_fraction),
+               'wall_time': wall_time,
+               'metrics': METRICS.snapshot()}
+    if anonymity:
+        results['anonymity'] = FLUSH_OBSERVER.summary()
+    return results
+
+
+def anonymity_frontier(runs: dict, latency: str = FRONTIER_LATENCY) -> list:
+    """
+    find the runs on the anonymity-versus-latency frontier: no other run has both a lower latency and a higher entropy.
+    runs which left messages inside the pools are left out: the latency of their stranded messages is unbounded
+    :param runs: results of the runs (measured with anonymity), by key
+    :param latency: latency percentile of the frontier
+    :return: keys of the frontier runs, by increasing latency
+    """
+    complete = {key: run for key, run in runs.items() if run['delivered'] >= run['sent']}
+    frontier, best = [], None
+    for key, run in sorted(complete.items(), key=lambda item: (item[1]['latency'][latency],
+                                                               -item[1]['anonymity']['entropy'])):
+        if best is None or run['anonymity']['entropy'] > best:
+            frontier.append(key)
+            best = run['anonymity']['entropy']
+    return frontier
+
+
+def plot_frontier(runs: dict, frontier: list, filename: str, latency: str = FRONTIER_LATENCY) -> None:
+    """
+    plot the entropy per flush against the latency of every run, and the frontier
+    :param runs: results of the runs (measured with anonymity), by key
+    :param frontier: keys of the frontier runs, by increasing latency
+    :param filename: image file of the plot
+    :param latency: latency percentile of the plot
+    :return:
+    """
+    plt = load_pyplot()
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for key, run in runs.items():
+        x, y = run['latency'][latency], run['anonymity']['entropy']
+        # runs which left messages inside the pools are crossed out
+        ax.scatter(x, y, color='tab:blue' if key in frontier else 'tab:gray',
+                   marker='o' if run['delivered'] >= run['sent'] else 'x')
+        config = run['config']
+        ax.annotate(f'{config["mix_policy"]} pool={config["pool_size"]}', (x, y), fontsize=7,
+                    textcoords='offset points', xytext=(4, 4))
+    ax.plot([runs[key]['latency'][latency] for key in frontier],
+            [runs[key]['anonymity']['entropy'] for key in frontier], color='tab:blue', label='frontier')
+    ax.set_xlabel(f'end-to-end latency {latency} (seconds)')
+    ax.set_ylabel('entropy per flush (bits)')
+    ax.set_title('anonymity versus latency')
+    ax.legend()
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
+
+def load_pyplot():
+    """
+    :return: the pyplot module of matplotlib (optional dependency, only needed to plot the frontier)
+    """
+    try:
+        import matplotlib
+    except ImportError:
+        raise ImportError('plotting the frontier needs matplotlib: pip install matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    """
+    compare benchmark results with a stored baseline
+    :param results: results of the current benchmark
+    :param baseline: results of a previous benchmark
+    :param tolerance: relative change that is reported as a regression
+    :return: descriptions of the regressions found
+    """
+    regressions = []
+    for key, run in results['runs'].items():
+        base = baseline['runs'].get(key)
+        if base is None:
+            continue
+        for q in LATENCY_PERCENTILES:
+            old, new = base['latency'][f'p{q}'], run['latency'][f'p{q}']
+            if old > 0 and new > old * (1 + tolerance):
+                regressions.append(f'{key}: p{q} latency {old:.4f}s -> {new:.4f}s')
+        old, new = base['throughput'], run['throughput']
+        if old > 0 and new < old * (1 - tolerance):
+            regressions.append(f'{key}: throughput {old:.2f} -> {new:.2f} msgs/second')
+        if run['delivered'] < base['delivered']:
+            regressions.append(f'{key}: delivered {base["delivered"]} -> {run["delivered"]} messages')
+    return regressions
+
+
+def init_parser() -> argparse.ArgumentParser:
+    """
+    init the argument parser of the benchmark
+    :return: argument parser
+    """
+    parser = argparse.ArgumentParser(description='benchmark the MoT app over a sweep of clients, relays, '
+                                                 'pool sizes and send rates')
+    parser.add_argument('--clients', nargs='+', type=int, default=N_CLIENTS, metavar='n',
+                        help=f'numbers of clients to sweep (default: {N_CLIENTS})')
+    parser.add_argument('--relays', nargs='+', type=int, default=N_RELAYS, metavar='n',
+                        help=f'numbers of relays to sweep (default: {N_RELAYS})')
+    parser.add_argument('--pool-sizes', nargs='+', type=int, default=POOL_SIZES, metavar='n',
+                        help=f'pool sizes to sweep (default: {POOL_SIZES})')
+    parser.add_argument('--send-rates', nargs='+', type=float, default=SEND_RATES, metavar='rate',
+                        help=f'messages per second of each client to sweep, 0 for no delay (default: {SEND_RATES})')
+    parser.add_argument('--policies', nargs='+', choices=POLICIES, default=MIX_POLICIES,
+                        help=f'mixing policies of the relays to sweep (default: {MIX_POLICIES})')
+    parser.add_argument('--flush-interval', type=float, metavar='seconds',
+                        help='flush interval of the timed policy (required by it), flush deadline of the threshold '
+                             'policy')
+    parser.add_argument('--anonymity', action='store_true',
+                        help='instrument the flushes of the relays, and report the anonymity set and the entropy per '
+                             'flush of every run, and the anonymity-versus-latency frontier of the sweep')
+    parser.add_argument('--plot', type=str, metavar='filename',
+                        help='plot the anonymity-versus-latency frontier into filename (implies --anonymity, needs '
+                             'matplotlib)')
+    parser.add_argument('--msgs', type=int, default=N_MSGS, metavar='n',
+                        help=f'messages sent by each client (default: {N_MSGS})')
+    parser.add_argument('--timeout', type=float, default=BENCH_TIMEOUT, metavar='seconds',
+                        help=f'seconds without traffic before the nodes disconnect (default: {BENCH_TIMEOUT})')
+    parser.add_argument('--warmup', type=float, default=WARMUP_FRACTION, metavar='fraction',
+                        help=f'fraction of the first deliveries ignored by the throughput (default: {WARMUP_FRACTION})')
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json', metavar='filename',
+                        help='json file to write the results into (default: benchmark.json)')
+    parser.add_argument('-b', '--baseline', type=str, metavar='filename',
+                        help='json results of a previous run to compare with. exits with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, metavar='fraction',
+                        help=f'relative change reported as a regression (default: {REGRESSION_TOLERANCE})')
+    return parser
+
+
+def main():
+    args = init_parser().parse_args()
+    if POLICY_TIMED in args.policies and args.flush_interval is None:
+        raise ValueError('the timed mixing policy needs a flush interval (--flush-interval)')
+    anonymity = args.anonymity or args.plot is not None
+    # fail before the sweep if the frontier cannot be plotted
+    if args.plot is not None:
+        load_pyplot()
+    results = {'environment': environment_metadata(), 'runs': {}}
+    sweep = itertools.product([min(n, MAX_N_CLIENTS) for n in args.clients],
+                              [min(n, MAX_N_RELAYS_AEAD) for n in args.relays],
+                              args.pool_sizes,
+                              args.send_rates,
+                              args.policies)
+    for n_clients, n_relays, pool_size, send_rate, mix_policy in sweep:
+        run = run_config(n_clients, n_relays, pool_size, send_rate, min(args.msgs, MAX_N_MSGS), args.timeout,
+                         args.warmup, mix_policy, args.flush_interval, anonymity)
+        key = config_key(run['config'])
+        results['runs'][key] = run
+        print(f'{key}: delivered {run["delivered"]}/{run["sent"]}, '
+              f'p50 {run["latency"]["p50"]:.4f}s, p99 {run["latency"]["p99"]:.4f}s, '
+              f'throughput {run["throughput"]:.2f} msgs/second' +
+              (f', entropy {run["anonymity"]["entropy"]:.2f} bits per flush '
+               f'(anonymity set {run["anonymity"]["anonymity_set"]:.1f})' if anonymity else ''))
+        # let the sockets of the run be released
+        time.sleep(2)
+    if anonymity:
+        results['frontier'] = anonymity_frontier(results['runs'])
+        print('anonymity-versus-latency frontier:')
+        for key in results['frontier']:
+            print(f'  {key}')
+        if args.plot is not None:
+            plot_frontier(results['runs'], results['frontier'], args.plot)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print('no regressions with respect to the baseline')
+
+
+if __name__ == '__main__':
+    main()
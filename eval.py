@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 from mot_app import app_demo, MAX_N_MSGS, MAX_N_CLIENTS
 from NetworkNode.utils import save_pickle, load_pickle
 from NetworkNode import POOL_SIZE
+from benchmark import run_config
 
 # N_CLIENT = [2 ** n for n in range(5, 13)]
 N_CLIENT = [32, 64, 128, 256, 512, 1024, 2048, 4096]
@@ -14,34 +15,29 @@ DEFAULT_N_CLIENTS = 16
 POOL_SIZES = [16, 32, 64, 128]
 
 
-def evaluate_performance_wrt_n_clients():
+def evaluate_performance_wrt_n_clients(pool_size: int = POOL_SIZE):
     throughput_arr = []
     latency_arr = []
     for n_clients in N_CLIENT:
-        # measure th starting time
-        start = time.time()
-        # run the app
-        app_demo(n_relays=N_RELAYS, n_clients=n_clients, n_msgs=DEFAULT_N_MSGS)
-        # measure the end time
-        end = time.time()
-        # add the average to the throughput array
-        throughput_arr.append((DEFAULT_N_MSGS * n_clients) / (end - start))
-        latency_arr.append((end - start) / (DEFAULT_N_MSGS * n_clients))
+        # run the app, and measure the sustained throughput and the median end-to-end latency of the messages
+        run = run_config(n_clients, N_RELAYS, pool_size, send_rate=1, n_msgs=DEFAULT_N_MSGS)
+        throughput_arr.append(run['throughput'])
+        latency_arr.append(run['latency']['p50'])
         time.sleep(2)
         # save_pickle(f'pkl/thr_n_clients_pool={POOL_SIZE}.pkl', throughput_arr)
     return throughput_arr, latency_arr
 
 
-def plot_throughput(eval_func: callable, save=False):
-    thr_arr, lat_arr = eval_func()
+def plot_throughput(eval_func: callable, pool_size: int = POOL_SIZE, save=False):
+    thr_arr, lat_arr = eval_func(pool_size)
     fig, axis = plt.subplots(1, 2)
 
-    axis[0].set_title(f'Throughput (pool size={POOL_SIZE})')
+    axis[0].set_title(f'Throughput (pool size={pool_size})')
     axis[0].set_xlabel('n_clients')
     axis[0].set_ylabel('msgs/second')
     axis[0].plot(N_CLIENT, thr_arr, marker='.', lw=1.5, color='orange')
 
-    axis[1].set_title(f'Latency (pool size={POOL_SIZE})')
+    axis[1].set_title(f'Latency p50 (pool size={pool_size})')
     axis[1].set_xlabel('n_clients')
     axis[1].set_ylabel('seconds')
     axis[1].plot(N_CLIENT, lat_arr, marker='.', lw=1.5, color='purple')
@@ -50,7 +46,7 @@ def plot_throughput(eval_func: callable, save=False):
 
     if save:
         i = 1
-        filename = f'{eval_func.__name__}-pool={POOL_SIZE}-{{i}}'
+        filename = f'{eval_func.__name__}-pool={pool_size}-{{i}}'
         while os.path.exists(f'./png/{filename.format(i=i)}.png') and i < 100:
             i += 1
         filename = filename.format(i=i)
@@ -60,4 +56,5 @@ def plot_throughput(eval_func: callable, save=False):
 
 
 if __name__ == '__main__':
-    plot_throughput(evaluate_performance_wrt_n_clients, save=True)
+    for pool_size in POOL_SIZES:
+        plot_throughput(evaluate_performance_wrt_n_clients, pool_size, save=True)
@@ -3,28 +3,39 @@ import threading
 import os
 
 from mot_app import app_demo, DEFAULT_PORT, DEFAULT_HOST, start_threads, join_threads, setup_client_app, MAX_N_CLIENTS, \
-    MAX_N_MSGS
+    MAX_N_MSGS, load_demo, setup_relays_cover, stop_relays_cover, setup_server_app, setup_config_watcher, \
+    stop_config_watcher
 from App import *
-from NetworkNode import Relay, SOCKET_TIMEOUT, POOL_SIZE
+from NetworkNode import Relay, POOL_SIZE, MetricsServer, MetricsDumper, TRACER, PROFILER, POLICIES, \
+    POLICY_THRESHOLD, POOL_HIGH_WATER, LAYER_AEAD, LAYER_FORMATS, ROUTES, TRANSPORTS, \
+    TRANSPORT_TCP, TRANSPORT_UNIX, TRANSPORT_INPROC, NodeConfig, ONION_POOL_DEPTH
 from NetworkNode.utils import load_key_pair
 
 KEYS_DIR = './keys'
 
 WAIT_TIME = 5
-MSG_POOL_SIZE = f'MixNet pool size: {POOL_SIZE}'
+MSG_POOL_SIZE = f'MixNet pool size:'
 MSG_SERVER_ADDRESS = f'server ip address:'
 MSG_SERVER_PORT = f'server port:'
+# arrival processes of the load mode
+ARRIVALS = {'constant': ConstantArrivals, 'poisson': PoissonArrivals, 'profile': ProfileArrivals}
+N_LOAD_CLIENTS = 128
+N_LOAD_RELAYS = 3
 
 
 
-def simple_relays_setup():
+def simple_relays_setup(config: NodeConfig = None, *, transport: str = TRANSPORT_TCP, config_file: str = None):
     """
     setup 3 relays and their corresponding threads
+    :param config: tuning of the relays (pool size, mixing policy, flush interval, high-water mark)
+    :param transport: name of the transport the relays listen on
+    :param config_file: json configuration file of the relays, overriding the given configuration
     :return: list of relays, list of relays threads
     """
-    relays = [Relay('127.1.0.1', DEFAULT_PORT),
-              Relay('127.1.0.2', DEFAULT_PORT),
-              Relay('127.1.0.3', DEFAULT_PORT)]
+    base = config if config is not None else NodeConfig()
+    relays = [Relay(address, DEFAULT_PORT, transport=transport,
+                    config=base if config_file is None else NodeConfig.from_file(config_file, address, base))
+              for address in ('127.1.0.1', '127.1.0.2', '127.1.0.3')]
     Relay.setup_relay_chain(relays)
     th_relays = []
     for relay in relays:
@@ -52,53 +63,205 @@ def init_parser() -> argparse.ArgumentParser:
                              'use -a to choose address for server. '
                              'use -p to choose port for server. '
                              'otherwise, default ip address and port will be set.')
+    parser.add_argument('-l', '--load', nargs=2, type=float, metavar=('rate', 'duration'),
+                        help='open-loop load mode: rides arrive at rate rides per second (peak rate for the profile '
+                             'arrivals) during duration seconds, sent by 128 virtual clients through the MixNet to a '
+                             'local server. use --arrivals to choose the arrival process')
+    parser.add_argument('--arrivals', choices=ARRIVALS, default='poisson',
+                        help='arrival process of the load mode: constant rate, poisson, or the recorded rush-hour '
+                             'profile replayed over the duration (default: poisson)')
+    parser.add_argument('--profile', type=float, metavar='seconds',
+                        help='capture every node thread with cProfile during the first seconds of the run. '
+                             'at any time, SIGUSR1 starts such a capture and SIGUSR2 toggles the sampling profiler. '
+                             'profiles are written into ./profiles, tagged with the node name')
+    parser.add_argument('--sample', action='store_true',
+                        help='run the low-overhead sampling profiler during the whole run, '
+                             'and write the collapsed stacks of every node into ./profiles')
+    parser.add_argument('--cover-rate', type=float, default=0, metavar='rate',
+                        help='cover traffic: every relay (and every client app) injects dummy messages at a mean rate '
+                             'of rate messages per second, so the pools keep flushing at low load. dummy messages are '
+                             'dropped by the last relay (default: 0, no cover traffic)')
+    parser.add_argument('--mix-policy', choices=POLICIES, default=POLICY_THRESHOLD,
+                        help='mixing policy of the relays: threshold (flush the pool once it holds the pool size), '
+                             'timed (flush the whole pool every flush interval) or pool (flush the pool size, and keep '
+                             'half of it for the next rounds) (default: threshold)')
+    parser.add_argument('--flush-interval', type=float, metavar='seconds',
+                        help='flush interval of the timed policy (required by it). with the threshold policy, a '
+                             'deadline: a pool is flushed once its oldest message waited for seconds')
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, metavar='n',
+                        help=f'pool size of the relays: messages gathered before a flush (default: {POOL_SIZE})')
+    parser.add_argument('--config', type=str, metavar='filename',
+                        help='json configuration file of the nodes: pool_size, mix_policy, flush_interval, high_water, '
+                             'timeout, max_tries and send_timeout, for every node and per node ip address under '
+                             '"nodes". its values override the flags. the file is watched: a change of pool_size, '
+                             'flush_interval or high_water is applied at once to the running relays')
+    parser.add_argument('--high-water', type=int, default=POOL_HIGH_WATER, metavar='n',
+                        help='admission control: a relay holding n messages in its pool rejects new messages with a '
+                             'busy reply, and its senders back off exponentially before retrying (default: '
+                             f'{POOL_HIGH_WATER})')
+    parser.add_argument('--layer-format', choices=LAYER_FORMATS, default=LAYER_AEAD,
+                        help='format of the onion layers sent by the clients: aead (binary aes-gcm, fixed overhead per '
+                             'layer, chains of up to 16 relays) or fernet (base64 aes-cbc + hmac, growing by a third '
+                             'per layer, chains of up to 4 relays). relays peel both formats (default: aead)')
+    parser.add_argument('--circuits', action='store_true',
+                        help='circuit mode: the first message of every client sets up a circuit through the relays '
+                             'chain, the next ones are sent as circuit frames, which the relays peel with symmetric '
+                             'keys only (no public key operation per message and per hop)')
+    parser.add_argument('--onion-pool', type=int, default=ONION_POOL_DEPTH, metavar='n',
+                        help='onion shells every client precomputes between its sends: the public key encryptions of '
+                             'the layers through the current path, so that a send only encrypts its core message and '
+                             'the symmetric layers. the shells are dropped once the path changes (default: '
+                             f'{ONION_POOL_DEPTH}, no precomputation)')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=TRANSPORT_TCP,
+                        help='transport of the messages to the relays and the server: tcp, unix domain sockets (nodes '
+                             'of a single host) or inproc, in-memory channels (nodes of a single process). in clients '
+                             'mode, the server is reached with tcp, unless both modes run with unix (default: tcp)')
+    parser.add_argument('--batch-window', type=float, default=0, metavar='seconds',
+                        help='every client app queues its rides during seconds, and sends them together inside a '
+                             'single onion, encrypted once for the server (default: 0, one ride per onion)')
+    parser.add_argument('--binary', action='store_true',
+                        help='client apps send their rides with the compact binary encoding: fixed-width fields, '
+                             'and stations as indexes into the versioned dictionary of App/cities.txt')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='the server app prints every received ride')
+    parser.add_argument('-w', '--workers', type=int, default=1, metavar='n',
+                        help='the server accepts and decrypts the messages in n processes listening on the same address '
+                             'and port (SO_REUSEPORT), feeding a single rides database (default: 1)')
+    parser.add_argument('--shards', type=int, default=1, metavar='n',
+                        help='sharded ingest: n server instances sharing the server key pair listen on consecutive '
+                             'ports from the server port, each one storing its rides into its own database; the '
+                             'databases are merged periodically into a single one. in clients mode, the rides are '
+                             'spread over the n ports (default: 1)')
+    parser.add_argument('--shard-by', choices=SHARD_STRATEGIES, default=SHARD_ROUND_ROBIN,
+                        help='strategy spreading the rides over the shards: round-robin, or a hash of the line number '
+                             'of the ride (default: round-robin)')
     parser.add_argument('-p', '--port', type=int, metavar='server_port',
                         help='port number of the MoT server')
     parser.add_argument('-a', '--address', type=str, metavar='server_address',
                         help='ip address of the MoT server')
+    parser.add_argument('-m', '--metrics-port', type=int, metavar='metrics_port',
+                        help='serve the metrics of the nodes over http on 127.0.0.1:metrics_port '
+                             '(/metrics as text, /metrics.json as json)')
+    parser.add_argument('--metrics-dump', type=str, metavar='filename',
+                        help='periodically dump the metrics of the nodes as json into filename')
+    parser.add_argument('--metrics-interval', type=float, default=5, metavar='seconds',
+                        help='seconds between two metrics dumps (default: 5)')
+    parser.add_argument('--trace', type=str, metavar='filename',
+                        help='benchmark tracing mode: every node appends (trace id, stage, timestamp) records '
+                             'to filename. use trace_report.py to stitch them into per-message timelines')
 
     return parser
 
 
-def demo_mode():
+def demo_mode(config: NodeConfig = None, *, cover_rate: float = 0, batch_window: float = 0, binary: bool = False,
+              verbose: bool = False, n_workers: int = 1, layer_format: str = LAYER_AEAD, circuit_mode: bool = False,
+              transport: str = TRANSPORT_TCP, n_shards: int = 1, shard_strategy: str = SHARD_ROUND_ROBIN,
+              config_file: str = None):
     """
     start demo mode of program
+    :param config: tuning of the nodes (pool size, mixing policy, flush interval and high-water mark of the relays,
+    onion pool of the clients)
+    :param cover_rate: mean dummy messages per second of every relay and client app
+    :param batch_window: seconds the rides of a client app are queued for, before being sent together
+    :param binary: client apps send the rides with the binary encoding
+    :param verbose: the server app prints every received ride
+    :param n_workers: number of processes of the server
+    :param layer_format: format of the onion layers of the clients
+    :param circuit_mode: the clients send their messages through circuits
+    :param transport: name of the transport of the relays and the server
+    :param n_shards: number of shards of the server
+    :param shard_strategy: strategy spreading the rides over the shards
+    :param config_file: json configuration file of the relays
     :return:
     """
     n_clients = 128
     n_relays = 3
     n_msgs = 3
     print(f'running demo mode...')
-    app_demo(n_relays, n_clients, n_msgs)
+    app_demo(n_relays, n_clients, n_msgs, config, cover_rate=cover_rate, batch_window=batch_window, binary=binary,
+             verbose=verbose, n_workers=n_workers, layer_format=layer_format, circuit_mode=circuit_mode,
+             transport=transport, n_shards=n_shards, shard_strategy=shard_strategy, config_file=config_file)
 
 
-def server_mode(server_ip_address: str, server_port: int):
+def load_mode(rate: float, duration: float, arrivals: str, config: NodeConfig = None, *, cover_rate: float = 0,
+              n_workers: int = 1, layer_format: str = LAYER_AEAD, circuit_mode: bool = False,
+              transport: str = TRANSPORT_TCP, n_shards: int = 1, shard_strategy: str = SHARD_ROUND_ROBIN,
+              config_file: str = None):
+    """
+    start open-loop load mode of the program
+    :param rate: rides per second (peak rate for the profile arrivals)
+    :param duration: seconds of generated load
+    :param arrivals: name of the arrival process
+    :param config: tuning of the nodes (pool size, mixing policy, flush interval and high-water mark of the relays,
+    onion pool of the virtual clients)
+    :param cover_rate: mean dummy messages per second of every relay
+    :param n_workers: number of processes of the server
+    :param layer_format: format of the onion layers of the virtual clients
+    :param circuit_mode: the virtual clients send their rides through circuits
+    :param transport: name of the transport of the relays and the server
+    :param n_shards: number of shards of the server
+    :param shard_strategy: strategy spreading the rides over the shards
+    :param config_file: json configuration file of the relays
+    :return:
+    """
+    print(f'running load mode...')
+    load_demo(N_LOAD_RELAYS, N_LOAD_CLIENTS, ARRIVALS[arrivals](rate), duration, config, cover_rate=cover_rate,
+              n_workers=n_workers, layer_format=layer_format, circuit_mode=circuit_mode, transport=transport,
+              n_shards=n_shards, shard_strategy=shard_strategy, config_file=config_file)
+
+
+def server_mode(server_ip_address: str, server_port: int, *, verbose: bool = False, n_workers: int = 1,
+                transport: str = TRANSPORT_TCP, n_shards: int = 1, config_file: str = None):
     """
     start server mode of the program
     :param server_ip_address: ip address of server
     :param server_port: port number of server
+    :param verbose: the server app prints every received ride
+    :param n_workers: number of processes of the server
+    :param transport: name of the transport the server listens on (tcp or unix)
+    :param n_shards: number of shards of the server, listening on consecutive ports from server_port
+    :param config_file: json configuration file of the nodes (the server reads its timeout from it)
     :return:
     """
-    server_app = ServerApp(server_ip_address, server_port, name='MotApp')
+    config = NodeConfig() if config_file is None else NodeConfig.from_file(config_file, server_ip_address)
+    server_app = setup_server_app(server_ip_address, server_port, timeout=config.timeout, verbose=verbose,
+                                  n_workers=n_workers, transport=transport, n_shards=n_shards)
     print('running server mode...'
           f'\n{MSG_SERVER_ADDRESS} {server_ip_address}'
           f'\n{MSG_SERVER_PORT} {server_port}'
-          f'\n{MSG_POOL_SIZE}'
-          f'\nsocket timeout: {SOCKET_TIMEOUT} seconds')
+          f'\nsocket timeout: {config.timeout} seconds'
+          f'\nserver processes: {n_workers}'
+          f'\nserver shards: {n_shards}'
+          f'\ntransport: {transport}')
     # start threads without any clients threads and relay threads
     start_threads(server_app, [], [])
     join_threads(server_app, [], [])
 
 
-def clients_mode(n_clients: int, n_msgs: int, server_address: str, server_port: int):
+def clients_mode(n_clients: int, n_msgs: int, server_address: str, server_port: int, config: NodeConfig = None, *,
+                 cover_rate: float = 0, batch_window: float = 0, binary: bool = False, layer_format: str = LAYER_AEAD,
+                 circuit_mode: bool = False, transport: str = TRANSPORT_TCP, n_shards: int = 1,
+                 shard_strategy: str = SHARD_ROUND_ROBIN, config_file: str = None):
     """
     start clients mode of the program
     :param n_clients: number of client applications to create
     :param n_msgs: number of messages each client-app should send
     :param server_address: ip address of server bound to client app
     :param server_port: port number of server bound to client app
+    :param config: tuning of the nodes (pool size, mixing policy, flush interval and high-water mark of the relays,
+    onion pool of the clients)
+    :param cover_rate: mean dummy messages per second of every relay and client app
+    :param batch_window: seconds the rides of a client app are queued for, before being sent together
+    :param binary: client apps send the rides with the binary encoding
+    :param layer_format: format of the onion layers of the clients
+    :param circuit_mode: the clients send their messages through circuits
+    :param transport: name of the transport of the relays (and of the server, if unix)
+    :param n_shards: number of shards of the server, listening on consecutive ports from server_port
+    :param shard_strategy: strategy spreading the rides over the shards
+    :param config_file: json configuration file of the relays
     :return:
     """
+    config = config if config is not None else NodeConfig()
     n_clients = min([n_clients, MAX_N_CLIENTS])
     n_msgs = min([n_msgs, MAX_N_MSGS])
     print(f'running clients mode...'
@@ -106,26 +269,53 @@ def clients_mode(n_clients: int, n_msgs: int, server_address: str, server_port:
           f'\neach client sends {n_msgs} message(s)'
           f'\n{MSG_SERVER_ADDRESS} {server_address}'
           f'\n{MSG_SERVER_PORT} {server_port}'
-          f'\n{MSG_POOL_SIZE}')
+          f'\nserver shards: {n_shards} ({shard_strategy})'
+          f'\n{MSG_POOL_SIZE} {config.pool_size}'
+          f'\nrelays configuration file: {config_file}')
 
     # print(f'waiting for {WAIT_TIME} seconds for user to set up server...', end='')
     # time.sleep(WAIT_TIME)
     # print('done')
 
     # setup relays and client apps
-    relays, th_relays = simple_relays_setup()
+    relays, th_relays = simple_relays_setup(config, transport=transport, config_file=config_file)
+    shards = ShardMap.consecutive(server_address, server_port, n_shards, shard_strategy)
+    # a server of the same host in unix server mode is reached through its unix socket
+    if transport == TRANSPORT_UNIX:
+        for address, port in shards.shards:
+            ROUTES.set(address, port, TRANSPORT_UNIX)
     # get server public key
     server_pbkey = load_key_pair(('server_pr_key', 'server_pb_key'))[1]
-    client_apps = setup_client_app(n_clients, relays, n_msgs, server_address, server_port, server_pbkey)
+    client_apps = setup_client_app(n_clients, relays, n_msgs, server_address, server_port, server_pbkey,
+                                   cover_rate=cover_rate, batch_window=batch_window, binary=binary,
+                                   layer_format=layer_format, circuit_mode=circuit_mode, shards=shards,
+                                   config=config)
     # start and join the threads
     start_threads(None, client_apps, th_relays)
+    covers = setup_relays_cover(relays, cover_rate, circuit_mode=circuit_mode, layer_format=layer_format)
+    watcher = setup_config_watcher(config_file, relays, config)
     join_threads(None, client_apps, th_relays)
+    stop_relays_cover(covers)
+    stop_config_watcher(watcher)
 
 
 def main():
     # init the argument parser and get arguments
     parser = init_parser()
     args = parser.parse_args()
+    if args.workers <= 0:
+        raise ValueError('the number of server workers must be positive')
+    if args.shards <= 0:
+        raise ValueError('the number of server shards must be positive')
+    # the tuning of the relays is checked once (with the configuration file, if any)
+    config = NodeConfig(args.pool_size, args.mix_policy, args.flush_interval, args.high_water,
+                        onion_pool=args.onion_pool)
+    if args.config is not None:
+        NodeConfig.from_file(args.config, base=config)
+    if args.workers > 1 and args.transport != TRANSPORT_TCP:
+        raise ValueError('the server worker processes need the tcp transport')
+    if args.server and args.transport == TRANSPORT_INPROC:
+        raise ValueError('the inproc transport only reaches the nodes of a single process: use tcp or unix')
     # setup server ip address and port information
     if args.address is not None:
         server_address = args.address
@@ -135,23 +325,63 @@ def main():
         server_port = args.port
     else:
         server_port = DEFAULT_PORT
+    # setup the metrics endpoint and the periodic metrics dump
+    metrics_server, metrics_dumper = None, None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(port=args.metrics_port)
+        metrics_server.start()
+    if args.metrics_dump is not None:
+        metrics_dumper = MetricsDumper(args.metrics_dump, args.metrics_interval)
+        metrics_dumper.start()
+    # setup the profiling hooks: signal triggered, or flag triggered from the start
+    PROFILER.install_signal_handlers()
+    if args.profile is not None:
+        PROFILER.request_capture(args.profile)
+    if args.sample:
+        PROFILER.start_sampling()
+    # enable benchmark tracing mode
+    if args.trace is not None:
+        TRACER.enable(args.trace)
 
     # run demo mode
     if args.demo_mode:
-        demo_mode()
+        demo_mode(config, cover_rate=args.cover_rate, batch_window=args.batch_window, binary=args.binary,
+                  verbose=args.verbose, n_workers=args.workers, layer_format=args.layer_format,
+                  circuit_mode=args.circuits, transport=args.transport, n_shards=args.shards,
+                  shard_strategy=args.shard_by, config_file=args.config)
+    # run open-loop load mode
+    elif args.load is not None:
+        rate, duration = args.load
+        if rate <= 0 or duration <= 0:
+            raise ValueError('rate and duration must be positive')
+        load_mode(rate, duration, args.arrivals, config, cover_rate=args.cover_rate, n_workers=args.workers,
+                  layer_format=args.layer_format, circuit_mode=args.circuits, transport=args.transport,
+                  n_shards=args.shards, shard_strategy=args.shard_by, config_file=args.config)
     # if clients flag given start program in clients mode
     elif args.clients is not None:
         n_clients, n_msgs = args.clients
         if n_clients <= 0 or n_msgs <= 0:
             raise ValueError('n_clients and n_msgs must be positive integers')
-        clients_mode(n_clients, n_msgs, server_address, server_port)
+        clients_mode(n_clients, n_msgs, server_address, server_port, config, cover_rate=args.cover_rate,
+                     batch_window=args.batch_window, binary=args.binary, layer_format=args.layer_format,
+                     circuit_mode=args.circuits, transport=args.transport, n_shards=args.shards,
+                     shard_strategy=args.shard_by, config_file=args.config)
     # in only the server flag was given, setup the server on the machine
     elif args.server:
-        server_mode(server_address, server_port)
+        server_mode(server_address, server_port, verbose=args.verbose, n_workers=args.workers,
+                    transport=args.transport, n_shards=args.shards, config_file=args.config)
     # if no flags were given, print help instructions
     else:
         parser.print_help()
 
+    if metrics_server is not None:
+        metrics_server.stop()
+    if metrics_dumper is not None:
+        metrics_dumper.stop()
+    if TRACER.enabled:
+        TRACER.disable()
+    PROFILER.stop_sampling()
+
 
 if __name__ == '__main__':
     # check that the program runs from root directory of the project
@@ -0,0 +1,274 @@
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+from secrets import token_bytes
+
+from NetworkNode import Node, Server, Client, Relay, POST, END, PSEUDONYM_LEN, MSG_MAX_SIZE, LAYER_FERNET, \
+    LISTEN_BACKLOG, TRANSPORTS, ROUTES, POOL_SIZE
+from NetworkNode.circuit import Circuit
+from NetworkNode.node import CORE_MSG_SIZE, SYM_KEY_LEN
+from NetworkNode.replay import ReplayFilter
+from NetworkNode.utils import encrypt, decrypt, encrypt_symm, decrypt_symm, load_key, encrypt_aead, decrypt_aead, \
+    generate_aead_key, AEAD_NONCE_LEN
+from App.message_app import MotMessage, decode_binary_messages, load_station_dictionary
+from App.server_app import DELIM
+
+BENCH_HOST = '127.0.0.1'
+RELAY_SUBNET = '127.3.0.{i}'
+CLIENT_ADDRESS = '127.3.1.1'
+# onion sizes benchmarked for Client.onion_msg
+ONION_LAYERS = range(1, 9)
+# minimal time (in seconds) a single measurement of a primitive should last
+MIN_TIME = 0.2
+# measurements of every primitive, the best one is reported
+REPEAT = 3
+# benchmarked ride, and size (in bytes) of the benchmarked symmetric layer
+RIDE = MotMessage(42, 'EGGED', 3, '07:35', 'JERUSALEM', 'TEL AVIV-YAFO')
+# benchmarked ride of the binary encoding (its stations are in the stations dictionary)
+BINARY_RIDE = MotMessage(42, 'EGGED', 3, '07:35', 'JERUSALEM', 'HULDA')
+LAYER_SIZE = 4096
+# rides inside the benchmarked hybrid batch
+BATCH_SIZE = 16
+
+
+def measure(func: callable, min_time: float = MIN_TIME, repeat: int = REPEAT) -> dict:
+    """
+    time a primitive and measure the memory it allocates
+    :param func: primitive to benchmark, called without arguments
+    :param min_time: minimal duration of a single measurement
+    :param repeat: number of measurements, the best one is reported
+    :return: operations per second, microseconds per operation, and bytes allocated per operation
+    """
+    # find the number of calls lasting at least min_time
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        n *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        best = min(best, time.perf_counter() - start)
+    # bytes allocated by a single call: peak of the traced memory during the call
+    tracemalloc.start()
+    allocated = 0
+    calls = min(n, 16)
+    for _ in range(calls):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        allocated += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {'ops_per_sec': n / best,
+            'us_per_op': best / n * 1e6,
+            'alloc_bytes_per_op': allocated / calls}
+
+
+def setup_chain(relays: list, n_layers: int) -> list:
+    """
+    chain the first n_layers relays
+    :param relays: available relays
+    :param n_layers: length of the chain
+    :return: the chained relays
+    """
+    for relay in relays:
+        relay.next, relay.prev = None, None
+    chain = relays[:n_layers]
+    Relay.setup_relay_chain(chain)
+    return chain
+
+
+def start_sink(transport: str) -> tuple:
+    """
+    listen on the given transport, and accept every message with an ack reply (from a daemon thread)
+    :param transport: name of the transport
+    :return: listener, and its port number
+    """
+    listener, port = TRANSPORTS[transport].listen(BENCH_HOST, 0, LISTEN_BACKLOG)
+    ROUTES.set(BENCH_HOST, port, transport)
+
+    def accept_loop() -> None:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            Node.recv_message(conn)
+            Node.reply(conn, True)
+            conn.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener, port
+
+
+def run_microbenchmarks(min_time: float = MIN_TIME, repeat: int = REPEAT) -> dict:
+    """
+    benchmark every hot primitive of the network on its own
+    :param min_time: minimal duration of a single measurement
+    :param repeat: number of measurements of each primitive
+    :return: measurements by primitive name
+    """
+    server = Server(BENCH_HOST, 0)
+    relays = [Relay(RELAY_SUBNET.format(i=i), 0) for i in range(1, max(ONION_LAYERS) + 1)]
+    client = Client(CLIENT_ADDRESS)
+    client.set_host_pb_key(server.get_public_key())
+    sym_key = load_key('client_key_sym')
+    core_msg = token_bytes(PSEUDONYM_LEN) + POST + RIDE.get_formatted_message() + END
+    layer = token_bytes(LAYER_SIZE)
+
+    results = {}
+
+    def bench(name: str, func: callable) -> None:
+        results[name] = measure(func, min_time, repeat)
+        print(f'{name:<36} {results[name]["ops_per_sec"]:>12.1f} ops/s {results[name]["us_per_op"]:>12.2f} us/op '
+              f'{results[name]["alloc_bytes_per_op"]:>12.0f} B/op')
+
+    # asymmetric and symmetric encryption
+    cipher_core = encrypt(server.get_public_key(), core_msg)
+    bench('encrypt', lambda: encrypt(server.get_public_key(), core_msg))
+    bench('decrypt', lambda: decrypt(server._pr_key, cipher_core))
+    cipher_layer = encrypt_symm(sym_key, layer)
+    bench(f'encrypt_symm[{LAYER_SIZE}B]', lambda: encrypt_symm(sym_key, layer))
+    bench(f'decrypt_symm[{LAYER_SIZE}B]', lambda: decrypt_symm(sym_key, cipher_layer))
+    aead_key, nonce = generate_aead_key(), token_bytes(AEAD_NONCE_LEN)
+    aead_layer = encrypt_aead(aead_key, nonce, layer)
+    bench(f'encrypt_aead[{LAYER_SIZE}B]', lambda: encrypt_aead(aead_key, nonce, layer))
+    bench(f'decrypt_aead[{LAYER_SIZE}B]', lambda: decrypt_aead(aead_key, nonce, aead_layer))
+
+    # onion creation by the client
+    for n_layers in ONION_LAYERS:
+        chain = setup_chain(relays, n_layers)
+        client.set_relays_chain(chain)
+        bench(f'Client.onion_msg[{n_layers} layers]',
+              lambda: client.onion_msg(server.get_ip_address(), server.get_port(), core_msg, chain[0]))
+
+    # the send path of a 3 layers onion from a precomputed shell: the core message and the symmetric layers only
+    chain = setup_chain(relays, 3)
+    client.set_relays_chain(chain)
+    shell = client._build_shell(chain, Client._layer_lengths(server.get_ip_address(), server.get_port(), chain,
+                                                             CORE_MSG_SIZE))
+    bench('Client._fill_shell[3 layers]',
+          lambda: client._fill_shell(shell, server.get_ip_address(), server.get_port(),
+                                     encrypt(server.get_public_key(), core_msg), chain, core_msg[:PSEUDONYM_LEN]))
+
+    # peeling of a layer by a relay (3 layers onion, as the default demo)
+    chain = setup_chain(relays, 3)
+    client.set_relays_chain(chain)
+    onion = Node.wrap_message(client.onion_msg(server.get_ip_address(), server.get_port(), core_msg, chain[0]))
+    plain_layer = chain[0]._decrypt_layer(onion)
+    bench('Relay._decrypt_layer', lambda: chain[0]._decrypt_layer(onion))
+    bench('Relay._parse_msg', lambda: chain[0]._parse_msg(plain_layer))
+    fernet_client = Client(CLIENT_ADDRESS, layer_format=LAYER_FERNET)
+    fernet_client.set_host_pb_key(server.get_public_key())
+    fernet_client.set_relays_chain(chain)
+    fernet_onion = Node.wrap_message(fernet_client.onion_msg(server.get_ip_address(), server.get_port(), core_msg,
+                                                             chain[0]))
+    bench(f'Relay._decrypt_layer[{LAYER_FERNET}]', lambda: chain[0]._decrypt_layer(fernet_onion))
+    # a circuit frame is peeled with the circuit key alone
+    circuit = Circuit(len(chain))
+    circuit_id, circuit_key = circuit.hops[0]
+    chain[0].circuits.add(circuit_id, circuit_key, chain[1].get_ip_address().encode(), chain[1].get_port())
+    frame = Node.wrap_message(circuit.frame(cipher_core))
+    bench('Relay._peel[circuit frame]', lambda: chain[0]._peel(frame))
+    replay_filter = ReplayFilter()
+    bench('ReplayFilter.check_and_add', lambda: replay_filter.check_and_add(token_bytes(SYM_KEY_LEN)))
+
+    # decryption of the core message by the server
+    wrapped_core = Node.wrap_message(cipher_core)
+    bench('Server._decrypt_msg', lambda: server._decrypt_msg(wrapped_core))
+
+    # hybrid encryption of a batch of rides for the server
+    batch = [POST + RIDE.get_formatted_message() + END] * BATCH_SIZE
+    pseudonym = token_bytes(PSEUDONYM_LEN)
+    bench(f'Client._seal_batch[{BATCH_SIZE} rides]', lambda: client._seal_batch(pseudonym, batch))
+    wrapped_batch = Node.wrap_message(client._seal_batch(pseudonym, batch))
+    bench(f'Server._decrypt_msg[{BATCH_SIZE} rides]', lambda: server._decrypt_msg(wrapped_batch))
+
+    # framing
+    wrapped = Node.wrap_message(plain_layer)
+    bench('Node.wrap_message', lambda: Node.wrap_message(plain_layer))
+    bench('Node.wrap_frame', lambda: Node.wrap_frame(plain_layer))
+    bench('Node.format_message', lambda: Node.format_message(plain_layer, BENCH_HOST.encode(), b'65432'))
+    bench('Node.unwrap_message', lambda: Node.unwrap_message(wrapped))
+    # a message and its reply over every transport, and a flush of a pool to a single next hop: a packet per
+    # connection, or a single batch frame
+    flush = [plain_layer] * POOL_SIZE
+    for transport in TRANSPORTS:
+        listener, port = start_sink(transport)
+        bench(f'Node.send[{transport}]', lambda: Node.send(BENCH_HOST, port, wrapped))
+        bench(f'Node.send[{transport}] x{POOL_SIZE}',
+              lambda: [Node.send(BENCH_HOST, port, Node.wrap_frame(msg)) for msg in flush])
+        bench(f'Node.send[{transport}] frame of {POOL_SIZE}',
+              lambda: Node.send(BENCH_HOST, port, Node.wrap_batch_frame(flush)))
+        listener.close()
+        ROUTES.remove(BENCH_HOST, port)
+    bench('MotMessage.get_formatted_message', RIDE.get_formatted_message)
+
+    # rides encodings, and their decoding by the server app
+    load_station_dictionary()
+    bench('MotMessage.get_binary_message', BINARY_RIDE.get_binary_message)
+    text_rides = [BINARY_RIDE.get_formatted_message()] * BATCH_SIZE
+    binary_rides = [BINARY_RIDE.get_binary_message()] * BATCH_SIZE
+    bench(f'decode text[{BATCH_SIZE} rides]', lambda: [ride.decode('utf-8').split(DELIM) for ride in text_rides])
+    bench(f'decode_binary_messages[{BATCH_SIZE} rides]', lambda: decode_binary_messages(binary_rides))
+
+    for node in relays + [server]:
+        node.close_socket()
+    return results
+
+
+def print_comparison(results: dict, baseline: dict) -> None:
+    """
+    print the speedup of every primitive with respect to a baseline
+    :param results: current measurements
+    :param baseline: previous measurements
+    :return:
+    """
+    print(f'\n{"primitive":<36} {"speedup":>10} {"alloc ratio":>12}')
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        alloc_ratio = res['alloc_bytes_per_op'] / base['alloc_bytes_per_op'] if base['alloc_bytes_per_op'] else 0.
+        print(f'{name:<36} {res["ops_per_sec"] / base["ops_per_sec"]:>9.2f}x {alloc_ratio:>11.2f}x')
+
+
+def init_parser() -> argparse.ArgumentParser:
+    """
+    init the argument parser of the microbenchmarks
+    :return: argument parser
+    """
+    parser = argparse.ArgumentParser(description='microbenchmarks of the crypto and framing primitives of the mixnet')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, metavar='seconds',
+                        help=f'minimal duration of a single measurement (default: {MIN_TIME})')
+    parser.add_argument('--repeat', type=int, default=REPEAT, metavar='n',
+                        help=f'measurements of each primitive, the best one is reported (default: {REPEAT})')
+    parser.add_argument('-o', '--output', type=str, metavar='filename',
+                        help='save the measurements as json into filename')
+    parser.add_argument('-b', '--baseline', type=str, metavar='filename',
+                        help='json measurements of a previous run to compare with')
+    return parser
+
+
+def main():
+    args = init_parser().parse_args()
+    print(f'msg size is: {MSG_MAX_SIZE}, core msg size is: {CORE_MSG_SIZE}\n')
+    results = run_microbenchmarks(args.min_time, args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            print_comparison(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from typing import List
 
 from NetworkNode import *
 from App import *
+from App.client_app import SEND_INTERVAL
 
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 65432
@@ -14,12 +15,19 @@ RELAY_SUBNET = '127.1.{b3}.{b4}'
 CLIENT_SUBNET = '127.2.{b3}.{b4}'
 
 MAX_N_CLIENTS = 20000
+# maximal chain length: the onion of a ride must fit into MSG_MAX_SIZE. fernet layers grow the onion by a third
+# at every hop, aead layers by a fixed overhead
 MAX_N_RELAYS = 4
+MAX_N_RELAYS_AEAD = 16
 MAX_N_MSGS = 128
 MAX_ADDRESS_LSB = 255
 N_MSGS_DEMO = 2
 
 
+def max_relays(layer_format: str = LAYER_AEAD):
+    return MAX_N_RELAYS_AEAD if layer_format == LAYER_AEAD else MAX_N_RELAYS
+
+
 def compute_ip_address(address: str, byte3: int, byte4: int):
     if byte3 <= MAX_ADDRESS_LSB:
         return address.format(b3=byte3, b4=byte4)
@@ -27,24 +35,39 @@ def compute_ip_address(address: str, byte3: int, byte4: int):
         return address.format(b3=MAX_ADDRESS_LSB, b4=byte4)
 
 
-def setup_server_app(address: str = None, port: int = None):
+def setup_server_app(address: str = None, port: int = None, timeout: float = SOCKET_TIMEOUT, verbose: bool = False,
+                     n_workers: int = 1, transport: str = TRANSPORT_TCP, n_shards: int = 1):
     if address is None:
         for byte3 in range(256):
             for byte4 in (1, 256):
                 try:
                     # setup server app
                     ip_address = compute_ip_address(SERVER_SUBNET, byte3, byte4)
-                    return ServerApp(ip_address, DEFAULT_PORT, name='MotApp')
+                    return setup_server_app(ip_address, DEFAULT_PORT, timeout=timeout, verbose=verbose,
+                                            n_workers=n_workers, transport=transport, n_shards=n_shards)
                 except OSError:
                     continue
         # otherwise, raise an exception if did not find an appropriate ip address for the server
         raise OSError('could not setup server')
+    elif n_shards > 1:
+        return ShardedServerApp(address, port, n_shards, name='MotApp', timeout=timeout, verbose=verbose,
+                                n_workers=n_workers, transport=transport)
     else:
-        return ServerApp(address, port, name='MotApp')
+        return ServerApp(address, port, name='MotApp', timeout=timeout, verbose=verbose, n_workers=n_workers,
+                         transport=transport)
+
 
+def server_shard_map(server_app, strategy: str = SHARD_ROUND_ROBIN):
+    if isinstance(server_app, ShardedServerApp):
+        return server_app.shard_map(strategy)
+    return ShardMap([(server_app.server.get_ip_address(), server_app.server.get_port())], strategy)
 
-def setup_relays(n_relays: int):
-    relays_amount = min([n_relays, MAX_N_RELAYS])
+
+def setup_relays(n_relays: int, config: NodeConfig = None, *, transport: str = TRANSPORT_TCP,
+                 config_file: str = None):
+    relays_amount = min([n_relays, MAX_N_RELAYS_AEAD])
+    # the parameters of the configuration file (global, and of every relay) override the given configuration
+    base = config if config is not None else NodeConfig()
     print(f'setting up {relays_amount} relays...', end='')
     relays = []  # list of relays instances
     th_relays = []  # list of relays threads
@@ -54,7 +77,8 @@ def setup_relays(n_relays: int):
                 # setup ip address for relay
                 ip_address = compute_ip_address(RELAY_SUBNET, byte3, byte4)
                 # setup relay
-                relay = Relay(ip_address, DEFAULT_PORT)
+                relay_config = base if config_file is None else NodeConfig.from_file(config_file, ip_address, base)
+                relay = Relay(ip_address, DEFAULT_PORT, config=relay_config, transport=transport)
                 relays.append(relay)
                 # setup relay thread
                 th_relays.append(threading.Thread(target=relay.receive, name=str(relay)))
@@ -69,7 +93,10 @@ def setup_relays(n_relays: int):
     raise OSError('could not setup relays chain')
 
 
-def setup_client_app(n_clients: int, relays: List[Relay], n_msgs: int, server_address, server_port, server_pbkey):
+def setup_client_app(n_clients: int, relays: List[Relay], n_msgs: int, server_address, server_port, server_pbkey, *,
+                     send_interval: float = SEND_INTERVAL, cover_rate: float = 0, batch_window: float = 0,
+                     binary: bool = False, layer_format: str = LAYER_AEAD, circuit_mode: bool = False,
+                     shards: ShardMap = None, config: NodeConfig = None):
     # take the minimal value between the maximal allowed number of clients, and the given number of clients
     clients_amount = min([n_clients, MAX_N_CLIENTS])
     print(f'setting {clients_amount} clientApps...', end='')
@@ -83,7 +110,15 @@ def setup_client_app(n_clients: int, relays: List[Relay], n_msgs: int, server_ad
                                  server_address,
                                  server_port,
                                  server_pbkey,
-                                 n_msgs)
+                                 n_msgs,
+                                 send_interval=send_interval,
+                                 cover_rate=cover_rate,
+                                 batch_window=batch_window,
+                                 binary=binary,
+                                 layer_format=layer_format,
+                                 circuit_mode=circuit_mode,
+                                 shards=shards,
+                                 config=config)
                 client_apps.append(capp)
                 # setup the relay chain if could create enough relays
                 if len(client_apps) == clients_amount:
@@ -95,6 +130,49 @@ def setup_client_app(n_clients: int, relays: List[Relay], n_msgs: int, server_ad
     raise OSError('could not setup clients')
 
 
+def setup_virtual_clients(n_clients: int, relays: List[Relay], server_pbkey, *, layer_format: str = LAYER_AEAD,
+                          circuit_mode: bool = False, config: NodeConfig = None):
+    # take the minimal value between the maximal allowed number of clients, and the given number of clients
+    clients_amount = min([n_clients, MAX_N_CLIENTS])
+    print(f'setting {clients_amount} virtual clients...', end='')
+    clients = []
+    for i in range(clients_amount):
+        client = Client(compute_ip_address(CLIENT_SUBNET, i // MAX_ADDRESS_LSB, i % MAX_ADDRESS_LSB + 1),
+                        layer_format=layer_format, circuit_mode=circuit_mode,
+                        config=config if config is not None else NodeConfig())
+        client.set_relays_chain(relays)
+        client.set_host_pb_key(server_pbkey)
+        clients.append(client)
+    print('done')
+    return clients
+
+
+def setup_relays_cover(relays: List[Relay], cover_rate: float, *, circuit_mode: bool = False,
+                       layer_format: str = LAYER_AEAD):
+    covers = [CoverTraffic(relay, cover_rate, circuit_mode, layer_format) for relay in relays]
+    for cover in covers:
+        cover.start()
+    return covers
+
+
+def stop_relays_cover(covers: List[CoverTraffic]):
+    for cover in covers:
+        cover.stop()
+
+
+def setup_config_watcher(config_file: str, relays: List[Relay], base: NodeConfig):
+    if config_file is None:
+        return None
+    watcher = ConfigWatcher(config_file, relays, base)
+    watcher.start()
+    return watcher
+
+
+def stop_config_watcher(watcher: ConfigWatcher):
+    if watcher is not None:
+        watcher.stop()
+
+
 def start_threads(server_app, client_apps, th_relays):
     if server_app is not None:
         server_app.start_app()
@@ -114,35 +192,117 @@ def join_threads(server_app, client_apps, th_relays):
         tr.join()
 
 
-def app_demo(n_relays, n_clients, n_msgs: int):
-    n_relays = min([n_relays, MAX_N_RELAYS])
+def app_demo(n_relays, n_clients, n_msgs: int, config: NodeConfig = None, *, send_interval: float = SEND_INTERVAL,
+             cover_rate: float = 0, batch_window: float = 0, binary: bool = False, verbose: bool = False,
+             n_workers: int = 1, layer_format: str = LAYER_AEAD, circuit_mode: bool = False,
+             transport: str = TRANSPORT_TCP, n_shards: int = 1, shard_strategy: str = SHARD_ROUND_ROBIN,
+             config_file: str = None):
+    # the tuning of every node: relays (pool, mixing policy), clients (onion pool, sends) and the server (timeout)
+    config = config if config is not None else NodeConfig()
+    n_relays = min([n_relays, max_relays(layer_format)])
     n_clients = min([n_clients, MAX_N_CLIENTS])
     n_msgs = min([n_msgs, MAX_N_MSGS])
     print(f'APP-DEMO information:'
           f'\n**************'
           f'\ndata is encrypted: {not DEBUG_MODE}'
-          f'\npool size: {POOL_SIZE}'
+          f'\npool size: {config.pool_size}'
+          f'\nmixing policy: {config.mix_policy} (flush interval: {config.flush_interval})'
+          f'\npool high-water mark: {config.high_water}'
+          f'\nonion layers: {layer_format}'
+          f'\ncircuits: {circuit_mode}'
+          f'\nprecomputed onions per client: {config.onion_pool}'
           f'\nrelays: {n_relays}'
           f'\nclients: {n_clients}'
           f'\neach client sends: {n_msgs} messages'
+          f'\ncover traffic: {cover_rate} dummy messages per second per node'
+          f'\nbatch window: {batch_window} seconds'
+          f'\nbinary rides encoding: {binary}'
+          f'\nserver processes: {n_workers}'
+          f'\nserver shards: {n_shards} ({shard_strategy})'
+          f'\ntransport: {transport}'
+          f'\nrelays configuration file: {config_file}'
           f'\nmsg size is: {MSG_MAX_SIZE}'
           f'\n**************\n')
 
     # setup relays infrastructure for the network
-    relays, thd_relays = setup_relays(n_relays)
+    relays, thd_relays = setup_relays(n_relays, config, transport=transport, config_file=config_file)
     # setup server app
-    server_app = setup_server_app()
+    server_app = setup_server_app(timeout=config.timeout, verbose=verbose, n_workers=n_workers, transport=transport,
+                                  n_shards=n_shards)
     # set up client applications
     clients_apps = setup_client_app(n_clients, relays, n_msgs,
                                     server_app.server.get_ip_address(),
                                     server_app.server.get_port(),
-                                    server_app.server.get_public_key())
-    # start all threads
+                                    server_app.server.get_public_key(),
+                                    send_interval=send_interval,
+                                    cover_rate=cover_rate,
+                                    batch_window=batch_window,
+                                    binary=binary,
+                                    layer_format=layer_format,
+                                    circuit_mode=circuit_mode,
+                                    shards=server_shard_map(server_app, shard_strategy),
+                                    config=config)
+    # start all threads, the cover traffic of the relays, and the hot reload of their configuration
     start_threads(server_app, clients_apps, thd_relays)
+    covers = setup_relays_cover(relays, cover_rate, circuit_mode=circuit_mode, layer_format=layer_format)
+    watcher = setup_config_watcher(config_file, relays, config)
     # join all entities
     join_threads(server_app, clients_apps, thd_relays)
-    server_app.server.close_socket()
+    stop_relays_cover(covers)
+    stop_config_watcher(watcher)
+    server_app.close_app()
     # print(clients_apps[0].get_rides_history())
+    return server_app
+
+
+def load_demo(n_relays: int, n_clients: int, arrivals: ArrivalProcess, duration: float, config: NodeConfig = None, *,
+              cover_rate: float = 0, n_workers: int = 1, layer_format: str = LAYER_AEAD, circuit_mode: bool = False,
+              transport: str = TRANSPORT_TCP, n_shards: int = 1, shard_strategy: str = SHARD_ROUND_ROBIN,
+              config_file: str = None):
+    # the tuning of every node: relays (pool, mixing policy), virtual clients (onion pool, sends) and the server
+    config = config if config is not None else NodeConfig()
+    n_relays = min([n_relays, max_relays(layer_format)])
+    print(f'LOAD-DEMO information:'
+          f'\n**************'
+          f'\ndata is encrypted: {not DEBUG_MODE}'
+          f'\npool size: {config.pool_size}'
+          f'\nmixing policy: {config.mix_policy} (flush interval: {config.flush_interval})'
+          f'\npool high-water mark: {config.high_water}'
+          f'\nonion layers: {layer_format}'
+          f'\ncircuits: {circuit_mode}'
+          f'\nprecomputed onions per client: {config.onion_pool}'
+          f'\nrelays: {n_relays}'
+          f'\nvirtual clients: {n_clients}'
+          f'\narrivals: {arrivals}'
+          f'\nduration: {duration} seconds'
+          f'\ncover traffic: {cover_rate} dummy messages per second per relay'
+          f'\nserver processes: {n_workers}'
+          f'\nserver shards: {n_shards} ({shard_strategy})'
+          f'\ntransport: {transport}'
+          f'\nrelays configuration file: {config_file}'
+          f'\n**************\n')
+
+    # setup relays infrastructure for the network, and the server app
+    relays, thd_relays = setup_relays(n_relays, config, transport=transport, config_file=config_file)
+    server_app = setup_server_app(timeout=config.timeout, n_workers=n_workers, transport=transport, n_shards=n_shards)
+    clients = setup_virtual_clients(n_clients, relays, server_app.server.get_public_key(), layer_format=layer_format,
+                                    circuit_mode=circuit_mode, config=config)
+    generator = LoadGenerator(clients, server_app.server.get_ip_address(), server_app.server.get_port(), arrivals,
+                              shards=server_shard_map(server_app, shard_strategy))
+    # start the relays and the server, generate the load, and join all entities
+    start_threads(server_app, [], thd_relays)
+    covers = setup_relays_cover(relays, cover_rate, circuit_mode=circuit_mode, layer_format=layer_format)
+    watcher = setup_config_watcher(config_file, relays, config)
+    report = generator.run(duration)
+    for client in clients:
+        client.stop_onion_pool()
+    join_threads(server_app, [], thd_relays)
+    stop_relays_cover(covers)
+    stop_config_watcher(watcher)
+    print('LOAD-DEMO report:')
+    for key, value in report.items():
+        print(f'{key}: {value}')
+    return report
 
 
 if __name__ == '__main__':
@@ -0,0 +1,556 @@
+import argparse
+import heapq
+import itertools
+import json
+import random
+import time
+from collections import namedtuple
+from typing import Optional
+
+from benchmark import environment_metadata, sustained_throughput, WARMUP_FRACTION, LATENCY_PERCENTILES
+from main import ARRIVALS
+from NetworkNode import MixPool, MixingPolicy, make_policy, POLICIES, POLICY_THRESHOLD, POOL_SIZE, POOL_HIGH_WATER, \
+    MSG_MAX_SIZE, CIRCUIT_TTL, LISTEN_BACKLOG, Node
+from NetworkNode.circuit import CIRCUIT_RENEW
+from NetworkNode.config import check_high_water
+from NetworkNode.metrics import percentile
+from NetworkNode.node import MAX_TRIES, BATCH_FRAME_MAX
+
+# default sweep of the simulator
+N_CLIENTS = [100000]
+N_RELAYS = [3]
+N_CHAINS = [1]
+POOL_SIZES = [POOL_SIZE]
+# default offered load (rides per second, peak rate for the profile arrivals) and simulated seconds
+SIM_RATE = 500.
+SIM_DURATION = 60.
+# default costs (seconds) of the simulated primitives, as measured by microbench.py on a single core:
+# peel (Relay._decrypt_layer + Relay._parse_msg) and circuit frame (Relay._peel[circuit frame]) at a relay,
+# Server._decrypt_msg, and Client.onion_msg per layer
+RELAY_PEEL_COST = 850e-6
+CIRCUIT_FRAME_COST = 40e-6
+SERVER_DECRYPT_COST = 980e-6
+ONION_LAYER_COST = 90e-6
+# default cost (seconds) of sending a message: connection, sendmsg and reply (send_latency of the relays in the demo)
+SEND_COST = 500e-6
+# default cost (seconds) of every further message of a batch frame (Node.send of a frame of POOL_SIZE messages)
+FRAME_MSG_COST = 25e-6
+# default one-way latency (seconds) and bandwidth (bits per second) of every link
+LINK_LATENCY = 500e-6
+LINK_BANDWIDTH = 1e9
+
+# a message inside the simulated mixnet: creation time, chain, index of its next hop, arrival into the pool of the
+# current relay (the mix pools and policies only read the arrival), and whether it travels as a circuit frame
+SimPacket = namedtuple('SimPacket', ['created', 'chain', 'hop', 'arrival', 'frame'])
+
+
+class CostModel:
+    """
+    modelled delays of the simulated mixnet: crypto costs of the nodes, send cost, and link delays
+    """
+
+    def __init__(self, relay_peel: float = RELAY_PEEL_COST, circuit_frame: float = CIRCUIT_FRAME_COST,
+                 server_decrypt: float = SERVER_DECRYPT_COST, onion_layer: float = ONION_LAYER_COST,
+                 send: float = SEND_COST, frame_msg: float = FRAME_MSG_COST, link_latency: float = LINK_LATENCY,
+                 bandwidth: float = LINK_BANDWIDTH) -> None:
+        """
+        init a cost model instance (all costs in seconds)
+        :param relay_peel: decryption and parsing of an onion layer by a relay
+        :param circuit_frame: opening of a circuit frame by a relay
+        :param server_decrypt: decryption of a core message by the server
+        :param onion_layer: building of an onion layer by a client
+        :param send: sending of a message (connection, sendmsg and reply)
+        :param frame_msg: sending of every further message of a batch frame, over the same connection
+        :param link_latency: one-way latency of a link
+        :param bandwidth: bandwidth of a link, in bits per second
+        """
+        self.relay_peel = relay_peel
+        self.circuit_frame = circuit_frame
+        self.server_decrypt = server_decrypt
+        self.onion_layer = onion_layer
+        self.send = send
+        self.frame_msg = frame_msg
+        self.link_latency = link_latency
+        self.bandwidth = bandwidth
+
+    @staticmethod
+    def from_microbench(path: str, **overrides):
+        """
+        calibrate the crypto costs from the measurements of microbench.py (the missing primitives keep their default)
+        :param path: json measurements saved by microbench.py -o
+        :param overrides: costs set explicitly, over the measurements
+        :return: calibrated cost model
+        """
+        with open(path, 'r') as file:
+            results = json.load(file)
+
+        def cost(name: str) -> Optional[float]:
+            return results[name]['us_per_op'] * 1e-6 if name in results else None
+
+        costs = {}
+        if cost('Relay._decrypt_layer') is not None:
+            costs['relay_peel'] = cost('Relay._decrypt_layer') + (cost('Relay._parse_msg') or 0.)
+        if cost('Relay._peel[circuit frame]') is not None:
+            costs['circuit_frame'] = cost('Relay._peel[circuit frame]')
+        if cost('Server._decrypt_msg') is not None:
+            costs['server_decrypt'] = cost('Server._decrypt_msg')
+        # the cost of a layer is the slope of the onion costs
+        onions = sorted((int(name[len('Client.onion_msg['):].split()[0]), res['us_per_op'] * 1e-6)
+                        for name, res in results.items() if name.startswith('Client.onion_msg['))
+        if onions:
+            costs['onion_layer'] = onions[-1][1] / onions[-1][0]
+        # the cost of a further message of a frame is the slope of the sends of a frame (over tcp)
+        frame, single = cost(f'Node.send[tcp] frame of {POOL_SIZE}'), cost('Node.send[tcp]')
+        if frame is not None and single is not None:
+            costs['frame_msg'] = max(frame - single, 0.) / (POOL_SIZE - 1)
+        costs.update({key: value for key, value in overrides.items() if value is not None})
+        return CostModel(**costs)
+
+    def link(self, n_msgs: int = 1) -> float:
+        """
+        :param n_msgs: number of messages sent together (inside a batch frame)
+        :return: delay of messages on a link: latency and transmission of the padded messages
+        """
+        return self.link_latency + n_msgs * MSG_MAX_SIZE * 8 / self.bandwidth
+
+
+class SimRelay:
+    """
+    simulated relay: a single thread peeling the received messages one after the other, and flushing its pool with the
+    mix pool and mixing policy of the live relays
+    """
+
+    def __init__(self, name: str, policy: MixingPolicy, high_water: Optional[int],
+                 backlog: int = LISTEN_BACKLOG) -> None:
+        """
+        init a simulated relay instance
+        :param name: name of the relay in the report
+        :param policy: mixing policy of the relay
+        :param high_water: number of pooled messages over which new messages get a busy reply (None: never busy)
+        :param backlog: number of messages waiting for the thread of the relay, over which new connections are refused
+        """
+        self.name = name
+        self.policy = policy
+        self.high_water = high_water
+        self.backlog = backlog
+        self.pool = MixPool()
+        # messages accepted but not peeled yet
+        self.waiting = 0
+        # virtual time the thread of the relay is busy until, and total busy time
+        self.busy_until = 0.
+        self.busy_time = 0.
+        self.packets_in = 0
+        self.packets_out = 0
+        self.busy_rejected = 0
+        self.refused = 0
+        self.pool_time = 0.
+        self.max_occupancy = 0
+        # integral of the pool occupancy over the virtual time, and time of its last change
+        self._occupancy_area = 0.
+        self._last_change = 0.
+
+    def track(self, now: float) -> None:
+        """
+        account the pool occupancy since its last change (called before every change of the pool)
+        :param now: current virtual time
+        :return:
+        """
+        self._occupancy_area += len(self.pool) * (now - self._last_change)
+        self._last_change = now
+
+    def report(self, end: float) -> dict:
+        """
+        :param end: virtual time of the end of the simulation
+        :return: counters, pool occupancy and utilization of the relay
+        """
+        self.track(end)
+        return {'packets_in': self.packets_in,
+                'packets_out': self.packets_out,
+                'busy_rejected': self.busy_rejected,
+                'refused': self.refused,
+                'pool_time_mean': self.pool_time / self.packets_out if self.packets_out else 0.,
+                'mean_occupancy': self._occupancy_area / end if end > 0 else 0.,
+                'max_occupancy': self.max_occupancy,
+                'stranded': len(self.pool),
+                'utilization': self.busy_time / end if end > 0 else 0.}
+
+
+class Simulation:
+    """
+    discrete-event simulation of the mixnet: clients send rides through chains of relays to a server, on a virtual
+    clock. the relays mix with the live mix pools and policies; sockets are replaced with modelled link delays and
+    threads with modelled crypto and send costs, so a run takes the time of its events, not of the simulated traffic
+    """
+
+    def __init__(self, n_clients: int, n_relays: int, n_chains: int, pool_size: int, arrivals, duration: float,
+                 costs: CostModel, mix_policy: str = POLICY_THRESHOLD, flush_interval: float = None,
+                 high_water: Optional[int] = POOL_HIGH_WATER, n_workers: int = 1, circuit_mode: bool = False) -> None:
+        """
+        init a simulation instance
+        :param n_clients: number of clients (a client sends through the chain of index client % n_chains)
+        :param n_relays: number of relays of every chain
+        :param n_chains: number of independent chains of relays, sharing the server
+        :param pool_size: pool size of every relay
+        :param arrivals: arrival process of the rides (of all the clients together)
+        :param duration: simulated seconds of arrivals
+        :param costs: modelled delays
+        :param mix_policy: mixing policy of the relays
+        :param flush_interval: flush interval of the timed policy, flush deadline of the threshold policy
+        :param high_water: pooled messages over which a relay replies busy (None: never busy)
+        :param n_workers: number of processes decrypting the messages at the server
+        :param circuit_mode: the clients send through circuits: only the first message of a circuit is peeled with
+        the public key of the relays
+        """
+        self.n_clients = n_clients
+        self.duration = duration
+        self.costs = costs
+        self.circuit_mode = circuit_mode
+        self.chains = [[SimRelay(f'Relay-{c}.{i}', make_policy(mix_policy, pool_size, flush_interval), high_water)
+                        for i in range(n_relays)] for c in range(n_chains)]
+        check_high_water(high_water, self.chains[0][0].policy)
+        self.now = 0.
+        self._events = []
+        self._seq = itertools.count()
+        self._arrivals = iter(arrivals.times(duration))
+        self._link = costs.link()
+        # virtual time every client (building its onions one after the other) and every server worker is busy until
+        self._client_busy = [0.] * n_clients
+        self._workers = [0.] * n_workers
+        self._server_busy_time = 0.
+        self._server_waiting = 0
+        self.server_refused = 0
+        # virtual expiry of the circuit of every client
+        self._circuits = {}
+        self.offered = 0
+        self.lost = 0
+        self.client_rejected = 0
+        self.latencies = []
+        self.delivery_times = []
+        self.n_events = 0
+
+    def schedule(self, t: float, handler: callable, *args) -> None:
+        """
+        schedule an event
+        :param t: virtual time of the event
+        :param handler: called with args at time t
+        :return:
+        """
+        heapq.heappush(self._events, (t, next(self._seq), handler, args))
+
+    def in_flight(self) -> int:
+        """
+        :return: number of offered messages neither delivered nor lost yet
+        """
+        return self.offered - len(self.latencies) - self.lost
+
+    def run(self) -> None:
+        """
+        run the simulation until no event is left
+        :return:
+        """
+        self._next_arrival()
+        for chain in self.chains:
+            for relay in chain:
+                if relay.policy.tick is not None:
+                    self.schedule(relay.policy.tick, self._tick, relay)
+        events = self._events
+        while events:
+            self.now, _, handler, args = heapq.heappop(events)
+            handler(*args)
+            self.n_events += 1
+
+    def _next_arrival(self) -> None:
+        """
+        schedule the next arrival of a ride (arrivals are drawn lazily: the run holds a single pending arrival)
+        :return:
+        """
+        t = next(self._arrivals, None)
+        if t is not None:
+            self.schedule(t, self._arrival)
+
+    def _arrival(self) -> None:
+        """
+        a ride arrives: a random client builds its onion (or circuit frame) and sends it to the head relay of its chain
+        :return:
+        """
+        self._next_arrival()
+        self.offered += 1
+        client = random.randrange(self.n_clients)
+        chain = client % len(self.chains)
+        n_layers = len(self.chains[chain])
+        frame = False
+        if self.circuit_mode:
+            # the first message of a circuit is a setup onion, the next ones are frames, until the circuit is renewed
+            expires = self._circuits.get(client)
+            frame = expires is not None and self.now < expires
+            if not frame:
+                self._circuits[client] = self.now + CIRCUIT_TTL * CIRCUIT_RENEW
+        build = self.costs.circuit_frame * n_layers if frame else self.costs.onion_layer * n_layers
+        start = max(self.now, self._client_busy[client])
+        self._client_busy[client] = start + build + self.costs.send
+        packet = SimPacket(self.now, chain, 0, 0., frame)
+        self.schedule(start + build + self.costs.send + self._link, self._deliver, packet, 0)
+
+    def _deliver(self, packet: SimPacket, attempt: int) -> None:
+        """
+        a message reaches its next hop: the server, or a relay which accepts it (and peels it once its thread is free)
+        or replies busy (the sender retries after a backoff, as Node.send)
+        :param packet: delivered message
+        :param attempt: number of the try (from 0)
+        :return:
+        """
+        chain = self.chains[packet.chain]
+        if packet.hop == len(chain):
+            if self._server_waiting >= LISTEN_BACKLOG * len(self._workers):
+                self.server_refused += 1
+                self._retry(packet, attempt)
+                return
+            self._serve(packet)
+            return
+        relay = chain[packet.hop]
+        relay.packets_in += 1
+        if relay.waiting >= relay.backlog:
+            relay.refused += 1
+            self._retry(packet, attempt)
+            return
+        if relay.high_water is not None and len(relay.pool) >= relay.high_water:
+            relay.busy_rejected += 1
+            self._retry(packet, attempt)
+            return
+        cost = self.costs.circuit_frame if packet.frame else self.costs.relay_peel
+        start = max(self.now, relay.busy_until)
+        relay.busy_until = start + cost
+        relay.busy_time += cost
+        relay.waiting += 1
+        self.schedule(relay.busy_until, self._pooled, relay, packet)
+
+    def _retry(self, packet: SimPacket, attempt: int) -> None:
+        """
+        a message was refused or got a busy reply: its sender retries after a backoff, until it gives up
+        :param packet: rejected message
+        :param attempt: number of the rejected try (from 0)
+        :return:
+        """
+        if packet.hop == 0:
+            self.client_rejected += 1
+        if attempt + 1 < MAX_TRIES:
+            self.schedule(self.now + 2 * self.costs.link_latency + Node.backoff(attempt), self._deliver, packet,
+                          attempt + 1)
+        else:
+            self.lost += 1
+
+    def _pooled(self, relay: SimRelay, packet: SimPacket) -> None:
+        """
+        a relay peeled a message: add it to the pool, and flush the pool if the mixing policy decides so
+        :param relay: relay of the message
+        :param packet: peeled message
+        :return:
+        """
+        relay.waiting -= 1
+        relay.track(self.now)
+        relay.pool.add(packet._replace(arrival=self.now))
+        relay.max_occupancy = max(relay.max_occupancy, len(relay.pool))
+        self._flush(relay)
+
+    def _tick(self, relay: SimRelay) -> None:
+        """
+        periodic check of a timed mixing policy (or of a flush deadline), while messages are in flight
+        :param relay: checked relay
+        :return:
+        """
+        self._flush(relay)
+        if self.now < self.duration or self.in_flight() > 0:
+            self.schedule(self.now + relay.policy.tick, self._tick, relay)
+
+    def _flush(self, relay: SimRelay) -> None:
+        """
+        flush the pool of a relay if its mixing policy decides so: the batch is sent by the thread of the relay. all its
+        messages go to the next hop of the chain, so they are sent together, inside batch frames
+        :param relay: flushed relay
+        :return:
+        """
+        limit = relay.policy.flush_size(relay.pool, self.now)
+        if limit <= 0:
+            return
+        relay.track(self.now)
+        batch = relay.pool.take_random(limit)
+        t = max(self.now, relay.busy_until)
+        for idx in range(0, len(batch), BATCH_FRAME_MAX):
+            frame = batch[idx:idx + BATCH_FRAME_MAX]
+            t += self.costs.send + (len(frame) - 1) * self.costs.frame_msg
+            link = self.costs.link(len(frame))
+            for packet in frame:
+                relay.pool_time += self.now - packet.arrival
+                self.schedule(t + link, self._deliver, packet._replace(hop=packet.hop + 1), 0)
+        relay.busy_time += t - max(self.now, relay.busy_until)
+        relay.busy_until = t
+        relay.packets_out += len(batch)
+
+    def _serve(self, packet: SimPacket) -> None:
+        """
+        a message reaches the server: the first free worker decrypts it
+        :param packet: delivered message
+        :return:
+        """
+        worker = min(range(len(self._workers)), key=self._workers.__getitem__)
+        done = max(self.now, self._workers[worker]) + self.costs.server_decrypt
+        self._workers[worker] = done
+        self._server_busy_time += self.costs.server_decrypt
+        self._server_waiting += 1
+        self.schedule(done, self._served, packet)
+
+    def _served(self, packet: SimPacket) -> None:
+        """
+        the server decrypted a message: it is delivered
+        :param packet: delivered message
+        :return:
+        """
+        self._server_waiting -= 1
+        self.latencies.append(self.now - packet.created)
+        self.delivery_times.append(self.now)
+
+    def report(self, warmup_fraction: float = WARMUP_FRACTION) -> dict:
+        """
+        :param warmup_fraction: fraction of the first deliveries ignored by the throughput
+        :return: latency distribution, throughput, and pool occupancy and utilization of every relay
+        """
+        latencies = sorted(self.latencies)
+        delivery_times = sorted(self.delivery_times)
+        end = max(self.now, delivery_times[-1] if delivery_times else 0.)
+        latency = {f'p{q}': percentile(latencies, q) for q in LATENCY_PERCENTILES}
+        latency['mean'] = sum(latencies) / len(latencies) if latencies else 0.
+        latency['max'] = latencies[-1] if latencies else 0.
+        relays = {relay.name: relay.report(end) for chain in self.chains for relay in chain}
+        return {'offered': self.offered,
+                'delivered': len(latencies),
+                'lost': self.lost,
+                'stranded': self.in_flight(),
+                'client_rejected': self.client_rejected,
+                'server_refused': self.server_refused,
+                'latency': latency,
+                'throughput': sustained_throughput(delivery_times, warmup_fraction),
+                'simulated_time': end,
+                'mean_occupancy': sum(r['mean_occupancy'] for r in relays.values()) / len(relays),
+                'max_occupancy': max(r['max_occupancy'] for r in relays.values()),
+                'server_utilization': self._server_busy_time / len(self._workers) / end if end > 0 else 0.,
+                'relays': relays,
+                'events': self.n_events}
+
+
+def run_config(n_clients: int, n_relays: int, n_chains: int, pool_size: int, arrivals, duration: float,
+               costs: CostModel, **kwargs) -> dict:
+    """
+    simulate a configuration of the mixnet
+    :param n_clients: number of clients
+    :param n_relays: number of relays of every chain
+    :param n_chains: number of chains
+    :param pool_size: pool size of every relay
+    :param arrivals: arrival process of the rides
+    :param duration: simulated seconds of arrivals
+    :param costs: modelled delays
+    :param kwargs: other parameters of the simulation
+    :return: report of the run
+    """
+    simulation = Simulation(n_clients, n_relays, n_chains, pool_size, arrivals, duration, costs, **kwargs)
+    start = time.time()
+    simulation.run()
+    wall_time = time.time() - start
+    report = simulation.report()
+    report['config'] = {'n_clients': n_clients, 'n_relays': n_relays, 'n_chains': n_chains, 'pool_size': pool_size,
+                        'arrivals': str(arrivals), 'duration': duration}
+    report['wall_time'] = wall_time
+    return report
+
+
+def config_key(config: dict) -> str:
+    """
+    :param config: configuration of a simulated run
+    :return: name identifying the configuration in the results
+    """
+    return f'clients={config["n_clients"]},relays={config["n_relays"]},chains={config["n_chains"]},' \
+           f'pool={config["pool_size"]}'
+
+
+def init_parser() -> argparse.ArgumentParser:
+    """
+    init the argument parser of the simulator
+    :return: argument parser
+    """
+    parser = argparse.ArgumentParser(description='discrete-event simulation of the mixnet, on a virtual clock')
+    parser.add_argument('--clients', type=int, nargs='+', default=N_CLIENTS, metavar='n',
+                        help=f'numbers of clients to simulate (default: {N_CLIENTS})')
+    parser.add_argument('--relays', type=int, nargs='+', default=N_RELAYS, metavar='n',
+                        help=f'numbers of relays of every chain (default: {N_RELAYS})')
+    parser.add_argument('--chains', type=int, nargs='+', default=N_CHAINS, metavar='n',
+                        help=f'numbers of chains of relays, the clients being spread over them (default: {N_CHAINS})')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=POOL_SIZES, metavar='n',
+                        help=f'pool sizes of the relays (default: {POOL_SIZES})')
+    parser.add_argument('--rate', type=float, default=SIM_RATE, metavar='rides_per_sec',
+                        help=f'rides per second of all the clients together, peak rate for the profile arrivals '
+                             f'(default: {SIM_RATE})')
+    parser.add_argument('--duration', type=float, default=SIM_DURATION, metavar='seconds',
+                        help=f'simulated seconds of arrivals (default: {SIM_DURATION})')
+    parser.add_argument('--arrivals', choices=ARRIVALS, default='poisson',
+                        help='arrival process of the rides (default: poisson)')
+    parser.add_argument('--mix-policy', choices=POLICIES, default=POLICY_THRESHOLD,
+                        help=f'mixing policy of the relays (default: {POLICY_THRESHOLD})')
+    parser.add_argument('--flush-interval', type=float, metavar='seconds',
+                        help='flush interval of the timed policy, flush deadline of the threshold policy')
+    parser.add_argument('--high-water', type=int, default=POOL_HIGH_WATER, metavar='n',
+                        help=f'pooled messages over which a relay replies busy, 0 to disable '
+                             f'(default: {POOL_HIGH_WATER})')
+    parser.add_argument('-w', '--workers', type=int, default=1, metavar='n',
+                        help='processes decrypting the messages at the server (default: 1)')
+    parser.add_argument('--circuits', action='store_true',
+                        help='the clients send through circuits: only setup onions are peeled with the relays RSA keys')
+    parser.add_argument('--calibration', type=str, metavar='filename',
+                        help='json measurements of microbench.py -o to calibrate the crypto costs with')
+    parser.add_argument('--send-cost', type=float, metavar='seconds',
+                        help=f'cost of sending a message (default: {SEND_COST})')
+    parser.add_argument('--link-latency', type=float, metavar='seconds',
+                        help=f'one-way latency of the links (default: {LINK_LATENCY})')
+    parser.add_argument('--bandwidth', type=float, metavar='bits_per_sec',
+                        help=f'bandwidth of the links (default: {LINK_BANDWIDTH:.0f})')
+    parser.add_argument('--seed', type=int, metavar='n',
+                        help='seed of the workload (arrivals and clients); the pools draw from the os CSPRNG, as the '
+                             'live relays')
+    parser.add_argument('-o', '--output', type=str, default='simulation.json', metavar='filename',
+                        help='json file of the results (default: simulation.json)')
+    return parser
+
+
+def main():
+    args = init_parser().parse_args()
+    if args.mix_policy == 'timed' and args.flush_interval is None:
+        raise SystemExit('the timed policy needs --flush-interval')
+    # a relay rejecting messages below the flush threshold would never flush: every run would deliver nothing
+    for pool_size in args.pool_sizes:
+        try:
+            check_high_water(args.high_water or None, make_policy(args.mix_policy, pool_size, args.flush_interval))
+        except ValueError as e:
+            raise SystemExit(f'pool size {pool_size}: {e} (--high-water)')
+    if args.seed is not None:
+        random.seed(args.seed)
+    overrides = {'send': args.send_cost, 'link_latency': args.link_latency, 'bandwidth': args.bandwidth}
+    if args.calibration is not None:
+        costs = CostModel.from_microbench(args.calibration, **overrides)
+    else:
+        costs = CostModel(**{key: value for key, value in overrides.items() if value is not None})
+    results = {'environment': environment_metadata(), 'costs': vars(costs), 'runs': {}}
+    sweep = itertools.product(args.clients, args.relays, args.chains, args.pool_sizes)
+    for n_clients, n_relays, n_chains, pool_size in sweep:
+        run = run_config(n_clients, n_relays, n_chains, pool_size, ARRIVALS[args.arrivals](args.rate),
+                         args.duration, costs, mix_policy=args.mix_policy, flush_interval=args.flush_interval,
+                         high_water=args.high_water or None, n_workers=args.workers, circuit_mode=args.circuits)
+        key = config_key(run['config'])
+        results['runs'][key] = run
+        print(f'{key}: delivered {run["delivered"]}/{run["offered"]} (lost {run["lost"]}, '
+              f'stranded {run["stranded"]}), p50 {run["latency"]["p50"]:.4f}s, p99 {run["latency"]["p99"]:.4f}s, '
+              f'throughput {run["throughput"]:.2f} msgs/second, pool occupancy {run["mean_occupancy"]:.1f} '
+              f'(max {run["max_occupancy"]}), {run["events"]} events in {run["wall_time"]:.1f}s')
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
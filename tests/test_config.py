@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from NetworkNode import utils
+from NetworkNode.config import NodeConfig, ConfigWatcher, POOL_SIZE
+from NetworkNode.mixpool import POLICY_TIMED, POLICY_POOL, TimedPolicy, PoolPolicy
+from NetworkNode.relay import Relay
+from NetworkNode.transport import TRANSPORT_INPROC
+
+
+def write_config(tmp_path, params) -> str:
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(params))
+    return str(path)
+
+
+def test_from_file_node_section_overrides_the_global_parameters(tmp_path):
+    path = write_config(tmp_path, {'pool_size': 32, 'flush_interval': 0.5,
+                                   'nodes': {'127.1.0.2': {'pool_size': 8}}})
+    assert NodeConfig.from_file(path).pool_size == 32
+    assert NodeConfig.from_file(path, '127.1.0.1').pool_size == 32
+    config = NodeConfig.from_file(path, '127.1.0.2')
+    assert (config.pool_size, config.flush_interval) == (8, 0.5)
+
+
+def test_from_file_applies_to_the_base(tmp_path):
+    path = write_config(tmp_path, {'flush_interval': 0.5})
+    config = NodeConfig.from_file(path, base=NodeConfig(pool_size=4, mix_policy=POLICY_TIMED, flush_interval=2))
+    assert (config.pool_size, config.mix_policy, config.flush_interval) == (4, POLICY_TIMED, 0.5)
+    assert isinstance(config.make_policy(), TimedPolicy)
+
+
+def test_from_file_defaults(tmp_path):
+    assert NodeConfig.from_file(write_config(tmp_path, {})) == NodeConfig()
+    assert NodeConfig().pool_size == POOL_SIZE
+
+
+@pytest.mark.parametrize('params', [[1, 2], {'pool_size': 0}, {'pool_size': 4, 'colour': 'red'},
+                                    {'nodes': {'127.1.0.1': {'mix_policy': 'fifo'}}}, {'pool_size': '64'},
+                                    {'flush_interval': '0.5'}, {'high_water': True}, {'timeout': None},
+                                    {'nodes': []}, {'nodes': {'127.1.0.1': 8}}])
+def test_from_file_rejects_invalid_files(tmp_path, params):
+    with pytest.raises(ValueError):
+        NodeConfig.from_file(write_config(tmp_path, params), '127.1.0.1')
+
+
+@pytest.mark.parametrize('kwargs', [{'pool_size': 0}, {'mix_policy': 'fifo'}, {'flush_interval': 0},
+                                    {'mix_policy': POLICY_TIMED}, {'high_water': 0}, {'timeout': 0},
+                                    {'send_timeout': -1}, {'max_tries': 0}, {'onion_pool': -1}])
+def test_validate(kwargs):
+    with pytest.raises(ValueError):
+        NodeConfig(**kwargs)
+
+
+def test_high_water_below_the_flush_threshold():
+    with pytest.raises(ValueError):
+        NodeConfig(pool_size=700, mix_policy=POLICY_POOL, high_water=1024)
+    with pytest.raises(ValueError):
+        NodeConfig(pool_size=2048, high_water=1024)
+    NodeConfig(pool_size=700, mix_policy=POLICY_POOL, high_water=1050)
+    NodeConfig(pool_size=2048, high_water=None)
+    NodeConfig(pool_size=2048, mix_policy=POLICY_TIMED, flush_interval=1, high_water=16)
+
+
+def test_reconfigure_keeps_a_relay_flushing(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'KEYS_PATH', str(tmp_path))
+    with pytest.raises(ValueError):
+        Relay('127.9.2.1', 65432, policy=PoolPolicy(700), transport=TRANSPORT_INPROC)
+    relay = Relay('127.9.2.2', 65432, config=NodeConfig(pool_size=16, mix_policy=POLICY_POOL),
+                  transport=TRANSPORT_INPROC)
+    with pytest.raises(ValueError):
+        relay.reconfigure(NodeConfig(pool_size=700))
+    assert (relay.pool_size, relay.high_water) == (16, NodeConfig().high_water)
+    relay.reconfigure(NodeConfig(pool_size=700, high_water=1050))
+    assert (relay.pool_size, relay.policy.flush_threshold()) == (700, 1050)
+
+
+def test_reload_of_an_invalid_file_keeps_the_configuration(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'KEYS_PATH', str(tmp_path))
+    relay = Relay('127.9.2.3', 65432, config=NodeConfig(pool_size=16), transport=TRANSPORT_INPROC)
+    watcher = ConfigWatcher(write_config(tmp_path, {}), [relay])
+    for params in [{'pool_size': '64'}, {'nodes': {'127.9.2.3': 8}}, {'nodes': ['127.9.2.3']}]:
+        write_config(tmp_path, params)
+        watcher.reload()
+        assert relay.pool_size == 16
+    # the next valid change is applied
+    write_config(tmp_path, {'nodes': {'127.9.2.3': {'pool_size': 32}}})
+    watcher.reload()
+    assert relay.pool_size == 32
+
+
+def test_replace():
+    config = NodeConfig().replace(pool_size=8, high_water=None)
+    assert (config.pool_size, config.high_water) == (8, None)
+    with pytest.raises(ValueError):
+        config.replace(pool_size=-1)
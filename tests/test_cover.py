@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from NetworkNode import utils
+from NetworkNode.node import POST, END, PSEUDONYM_LEN, LAYER_FORMATS
+from NetworkNode.client import Client
+from NetworkNode.relay import Relay
+from NetworkNode.cover import CoverTraffic
+from NetworkNode.transport import TRANSPORT_INPROC
+
+RELAYS = ['127.9.0.1', '127.9.0.2', '127.9.0.30']
+
+
+@pytest.fixture(scope='module', autouse=True)
+def keys_path(tmp_path_factory):
+    # the key pairs of the nodes are generated into a temporary keys directory
+    keys_path = utils.KEYS_PATH
+    utils.KEYS_PATH = str(tmp_path_factory.mktemp('keys'))
+    yield utils.KEYS_PATH
+    utils.KEYS_PATH = keys_path
+
+
+@pytest.fixture(scope='module')
+def relays():
+    relays = [Relay(address, 65432, timeout=1, transport=TRANSPORT_INPROC) for address in RELAYS]
+    Relay.setup_relay_chain(relays)
+    return relays, utils.load_key_pair(('server_pr_key', 'server_pb_key'))[1]
+
+
+def client_of(relays, layer_format: str) -> Client:
+    relays, server_pb_key = relays
+    client = Client('127.9.1.1', layer_format=layer_format)
+    client.set_relays_chain(relays)
+    client.set_host_pb_key(server_pb_key)
+    return client
+
+
+def peeled_lengths(relays, msg: bytes):
+    lengths = []
+    for relay in relays:
+        lengths.append(len(msg))
+        (packet,) = relay._peel(msg)
+        msg = packet.msg
+    return lengths + [len(msg)]
+
+
+@pytest.mark.parametrize('layer_format', LAYER_FORMATS)
+@pytest.mark.parametrize('host, port', [('127.0.0.1', 65432), ('10.0.0.1', 80), ('192.168.100.200', 1)])
+def test_cover_layers_are_sized_like_real_layers(relays, layer_format, host, port):
+    client = client_of(relays, layer_format)
+    relays, _ = relays
+    core_msg = os.urandom(PSEUDONYM_LEN) + POST + b'1;EGGED;2;08:05;Haifa;Tel Aviv' + END
+    real, _ = client._route_msg(host, port, core_msg, path=relays)
+    cover, _ = client.cover_message(relays)
+    assert peeled_lengths(relays, cover) == peeled_lengths(relays, real)
+
+
+def test_layer_lengths_of_padded_destinations(relays):
+    relays, _ = relays
+    assert Client._layer_lengths('0.0.0.0', 0, relays, 256) == Client._layer_lengths('127.0.0.1', 65432, relays, 256)
+
+
+@pytest.mark.parametrize('layer_format', LAYER_FORMATS)
+def test_relay_cover_layers_follow_the_layer_format(relays, layer_format):
+    client = client_of(relays, layer_format)
+    relays, _ = relays
+    real, _ = client._route_msg('127.0.0.1', 65432, os.urandom(PSEUDONYM_LEN) + POST + b'ride' + END, path=relays)
+    (packet,) = relays[0]._peel(real)
+    # the dummy onion injected by the head relay is peeled by the next relays like the ride it mixes with
+    cover = CoverTraffic(relays[0], layer_format=layer_format)._relay_packet()
+    assert peeled_lengths(relays[1:], cover.msg) == peeled_lengths(relays[1:], packet.msg)
@@ -0,0 +1,78 @@
+import pytest
+
+from App.message_app import MotMessage, StationDictionary, decode_binary_columns, decode_binary_messages, \
+    decode_text_columns, BINARY_FORMAT, COLS
+
+DICTIONARY = StationDictionary(['Haifa', 'Tel Aviv', 'Jerusalem'])
+RIDES = [MotMessage(1, 'EGGED', 2, '08:05', 'Haifa', 'Tel Aviv'),
+         MotMessage(999, 'DAN', 9, '23:55', 'Jerusalem', 'Haifa')]
+COLUMNS = [['1', '999'], ['EGGED', 'DAN'], ['2', '9'], ['08:05', '23:55'], ['Haifa', 'Jerusalem'],
+           ['Tel Aviv', 'Haifa']]
+
+
+def test_decode_binary_columns():
+    msgs = [ride.get_binary_message(DICTIONARY) for ride in RIDES]
+    assert decode_binary_columns(msgs, DICTIONARY) == COLUMNS
+    assert decode_binary_messages(msgs, DICTIONARY) == [list(row) for row in zip(*COLUMNS)]
+
+
+def test_decode_text_columns():
+    assert decode_text_columns([ride.get_formatted_message() for ride in RIDES]) == COLUMNS
+
+
+def test_decode_no_messages():
+    assert decode_binary_columns([], DICTIONARY) == [[] for _ in COLS]
+    assert decode_text_columns([]) == [[] for _ in COLS]
+
+
+def test_binary_message_without_magic_byte():
+    msg = RIDES[0].get_binary_message(DICTIONARY)
+    with pytest.raises(ValueError):
+        decode_binary_columns([msg, b'\x00' + msg[1:]], DICTIONARY)
+
+
+def test_binary_message_of_another_dictionary():
+    msg = RIDES[0].get_binary_message(StationDictionary(['Haifa', 'Tel Aviv']))
+    with pytest.raises(ValueError):
+        decode_binary_columns([msg], DICTIONARY)
+
+
+def test_binary_message_of_wrong_size():
+    with pytest.raises(ValueError):
+        decode_binary_columns([b'\x00' * (BINARY_FORMAT.size - 1)], DICTIONARY)
+
+
+def test_unknown_station():
+    with pytest.raises(ValueError):
+        MotMessage(1, 'EGGED', 2, '08:05', 'Eilat', 'Haifa').get_binary_message(DICTIONARY)
+
+
+@pytest.mark.parametrize('ride', [MotMessage(65536, 'EGGED', 2, '08:05', 'Haifa', 'Tel Aviv'),
+                                  MotMessage(-1, 'EGGED', 2, '08:05', 'Haifa', 'Tel Aviv'),
+                                  MotMessage(1, 'EGGED', 256, '08:05', 'Haifa', 'Tel Aviv'),
+                                  MotMessage(1, 'EGGED', 2, '24:00', 'Haifa', 'Tel Aviv'),
+                                  MotMessage(1, 'EGGED', 2, '08:60', 'Haifa', 'Tel Aviv')])
+def test_binary_message_with_out_of_range_field(ride):
+    with pytest.raises(ValueError):
+        ride.get_binary_message(DICTIONARY)
+    # the ride is still sent with the text encoding
+    assert decode_text_columns([ride.get_formatted_message()])[0] == [str(ride.line_number)]
+
+
+def test_operator_index_out_of_range():
+    dictionary = StationDictionary(['Haifa', 'Tel Aviv'], operators=[f'operator-{i}' for i in range(300)])
+    with pytest.raises(ValueError):
+        MotMessage(1, 'operator-256', 2, '08:05', 'Haifa', 'Tel Aviv').get_binary_message(dictionary)
+    assert len(MotMessage(1, 'operator-255', 2, '08:05', 'Haifa', 'Tel Aviv').get_binary_message(dictionary)) == \
+        BINARY_FORMAT.size
+
+
+def test_text_message_with_missing_field():
+    with pytest.raises(ValueError):
+        decode_text_columns([b'1;EGGED;2;08:05;Haifa'])
+
+
+def test_text_messages_with_shifted_fields():
+    # as many fields as two rides in total, but not per ride
+    with pytest.raises(ValueError):
+        decode_text_columns([b'1;EGGED;2;08:05;Haifa;Tel Aviv;extra', b'999;DAN;9;23:55;Jerusalem'])
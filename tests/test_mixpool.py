@@ -0,0 +1,120 @@
+import random
+
+import pytest
+
+from NetworkNode.mixpool import MixPool, ThresholdPolicy, TimedPolicy, PoolPolicy, make_policy, POLICY_THRESHOLD, \
+    POLICY_TIMED, POLICY_POOL
+from NetworkNode.relay import Packet
+
+
+def packet(i: int, arrival: float = 0.) -> Packet:
+    return Packet(f'msg-{i}'.encode(), b'127.0.0.1', b'1', arrival)
+
+
+def pool_of(n: int, **kwargs) -> MixPool:
+    pool = MixPool(**kwargs)
+    for i in range(n):
+        assert pool.add(packet(i, float(i)))
+    return pool
+
+
+def test_take_random_swap_remove():
+    pool = pool_of(100, slots=8)
+    taken = pool.take_random(60)
+    assert len(taken) == 60 and len(pool) == 40
+    taken += pool.take_random(100)
+    # every packet leaves the pool exactly once
+    assert sorted(p.arrival for p in taken) == [float(i) for i in range(100)]
+    assert len(pool) == 0 and pool.take_random(1) == []
+
+
+def test_identical_packets_are_kept_apart():
+    pool = MixPool()
+    pool.add(packet(0))
+    pool.add(packet(0))
+    assert len(pool.take_random(2)) == 2
+
+
+def test_bounded_pool():
+    pool = pool_of(4, slots=64, capacity=4)
+    assert not pool.add(packet(4))
+    assert pool.occupancy() == 1
+    pool.take_random(1)
+    assert pool.add(packet(4))
+
+
+def test_oldest_arrival():
+    pool = MixPool()
+    assert pool.oldest_arrival() is None
+    arrivals = []
+    for _ in range(500):
+        if arrivals and random.random() < 0.4:
+            for taken in pool.take_random(random.randint(1, 3)):
+                arrivals.remove(taken.arrival)
+        else:
+            arrival = random.random()
+            pool.add(packet(0, arrival))
+            arrivals.append(arrival)
+        assert pool.oldest_arrival() == (min(arrivals) if arrivals else None)
+
+
+def test_threshold_policy():
+    policy = ThresholdPolicy(4)
+    assert policy.flush_size(pool_of(3), now=100.) == 0
+    assert policy.flush_size(pool_of(5), now=100.) == 4
+
+
+def test_threshold_policy_deadline():
+    policy = ThresholdPolicy(4, deadline=1.)
+    pool = pool_of(2)
+    assert policy.flush_size(pool, now=0.5) == 0
+    # the oldest packet arrived at 0: the whole pool is flushed at the deadline
+    assert policy.flush_size(pool, now=1.) == 2
+    assert policy.flush_size(MixPool(), now=100.) == 0
+
+
+def test_timed_policy():
+    policy = TimedPolicy(1.)
+    pool = pool_of(3)
+    assert policy.flush_size(pool, now=10.) == 0
+    assert policy.flush_size(pool, now=10.5) == 0
+    assert policy.flush_size(pool, now=11.) == 3
+    assert policy.flush_size(pool, now=11.5) == 0
+
+
+def test_pool_policy_keeps_packets():
+    policy = PoolPolicy(4)
+    assert policy.keep == 2
+    assert policy.flush_size(pool_of(5), now=0.) == 0
+    assert policy.flush_size(pool_of(6), now=0.) == 4
+
+
+def test_reconfigure():
+    policy = PoolPolicy(4)
+    policy.reconfigure(8)
+    assert (policy.pool_size, policy.keep) == (8, 4)
+    policy = PoolPolicy(4, keep=1)
+    policy.reconfigure(8)
+    assert policy.keep == 1
+    policy = TimedPolicy(1.)
+    policy.reconfigure(8)
+    assert policy.interval == 1.
+
+
+def test_flush_threshold():
+    assert ThresholdPolicy(4).flush_threshold() == 4
+    assert ThresholdPolicy(4).flush_threshold(8) == 8
+    assert PoolPolicy(4).flush_threshold() == 6
+    assert PoolPolicy(4).flush_threshold(700) == 1050
+    assert PoolPolicy(4, keep=1).flush_threshold(8) == 9
+    assert TimedPolicy(1.).flush_threshold(8) is None
+
+
+def test_make_policy():
+    assert isinstance(make_policy(POLICY_THRESHOLD, 4), ThresholdPolicy)
+    assert isinstance(make_policy(POLICY_TIMED, 4, 1.), TimedPolicy)
+    assert isinstance(make_policy(POLICY_POOL, 4), PoolPolicy)
+    with pytest.raises(ValueError):
+        make_policy(POLICY_TIMED, 4)
+    with pytest.raises(ValueError):
+        make_policy('fifo', 4)
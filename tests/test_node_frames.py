@@ -0,0 +1,28 @@
+import os
+
+from NetworkNode.node import Node, MSG_MAX_SIZE, BATCH_FRAME, BATCH_FRAME_HEADER
+
+
+def test_batch_frame_round_trip():
+    msgs = [os.urandom(n) for n in (1, 100, MSG_MAX_SIZE // 2, MSG_MAX_SIZE)]
+    data = b''.join(Node.wrap_batch_frame(msgs))
+    assert len(data) == BATCH_FRAME_HEADER.size + len(msgs) * MSG_MAX_SIZE
+    wrapped = Node.unwrap_batch_frame(data)
+    # every message comes back in order, padded to MSG_MAX_SIZE
+    assert len(wrapped) == len(msgs)
+    for msg, unwrapped in zip(msgs, wrapped):
+        assert len(unwrapped) == MSG_MAX_SIZE
+        assert unwrapped[:len(msg)] == msg
+
+
+def test_single_message_is_not_a_batch_frame():
+    msg = Node.wrap_message(b'message')
+    assert Node.unwrap_batch_frame(msg) == [msg]
+    # even if it starts with the marker of a batch frame
+    msg = Node.wrap_message(BATCH_FRAME_HEADER.pack(BATCH_FRAME, 1))
+    assert Node.unwrap_batch_frame(msg) == [msg]
+
+
+def test_truncated_batch_frame_is_a_single_message():
+    data = b''.join(Node.wrap_batch_frame([b'a', b'b']))[:-1]
+    assert Node.unwrap_batch_frame(data) == [data]
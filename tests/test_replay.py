@@ -0,0 +1,52 @@
+import pytest
+
+from NetworkNode.replay import ReplayFilter
+
+CAPACITY = 1000
+
+
+def packets(start: int, stop: int):
+    return [f'packet-{i}'.encode() for i in range(start, stop)]
+
+
+def test_fresh_then_replay():
+    replay_filter = ReplayFilter(CAPACITY)
+    assert not replay_filter.check_and_add(b'packet')
+    assert replay_filter.check_and_add(b'packet')
+
+
+def test_no_false_negatives_across_a_rotation():
+    replay_filter = ReplayFilter(CAPACITY)
+    for packet in packets(0, 2 * CAPACITY):
+        replay_filter.check_and_add(packet)
+    # the last capacity packets are remembered, whichever generation holds them
+    assert all(replay_filter.check_and_add(packet) for packet in packets(CAPACITY, 2 * CAPACITY))
+
+
+def test_second_rotation_forgets_the_oldest_generation():
+    replay_filter = ReplayFilter(CAPACITY)
+    for packet in packets(0, 2 * CAPACITY + 1):
+        replay_filter.check_and_add(packet)
+    # the generation of the first capacity packets was dropped by the second rotation
+    forgotten = sum(not replay_filter.check_and_add(packet) for packet in packets(0, CAPACITY // 2))
+    assert forgotten == CAPACITY // 2
+
+
+def test_false_positive_rate():
+    replay_filter = ReplayFilter(CAPACITY, fp_rate=0.01)
+    for packet in packets(0, CAPACITY):
+        replay_filter.check_and_add(packet)
+    false_positives = sum(replay_filter.check_and_add(packet) for packet in packets(CAPACITY, 2 * CAPACITY))
+    assert false_positives < 5 * 0.01 * CAPACITY
+
+
+def test_memory_cap_lowers_the_capacity():
+    replay_filter = ReplayFilter(10 ** 6, max_bytes=1024)
+    assert replay_filter.capacity < 10 ** 6
+    assert replay_filter.nbytes() <= 1024
+
+
+@pytest.mark.parametrize('kwargs', [{'capacity': 0}, {'fp_rate': 0}, {'fp_rate': 1}, {'max_bytes': 1}])
+def test_invalid_parameters(kwargs):
+    with pytest.raises(ValueError):
+        ReplayFilter(**kwargs)
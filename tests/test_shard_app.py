@@ -0,0 +1,40 @@
+import pytest
+
+from App.shard_app import ShardMap, shard_key, SHARD_ROUND_ROBIN, SHARD_HASH
+
+SHARDS = [('127.0.0.1', 65432), ('127.0.0.1', 65433), ('127.0.0.1', 65434)]
+
+
+def test_assign_round_robin_keeps_a_batch_together():
+    shards = ShardMap(SHARDS, SHARD_ROUND_ROBIN)
+    keys = [shard_key(line) for line in range(5)]
+    # every batch goes to the next shard, whole
+    for shard in SHARDS * 2:
+        assert shards.assign(keys) == {shard: [0, 1, 2, 3, 4]}
+
+
+def test_assign_hash_groups_the_rides_by_line():
+    shards = ShardMap(SHARDS, SHARD_HASH)
+    keys = [shard_key(line) for line in (1, 2, 1, 300, 2, 1)]
+    groups = shards.assign(keys)
+    assert sorted(i for indexes in groups.values() for i in indexes) == list(range(len(keys)))
+    for shard, indexes in groups.items():
+        assert all(shards.pick(keys[i]) == shard for i in indexes)
+    # the rides of a line always reach the same shard
+    assert shards.assign(keys) == groups
+
+
+def test_assign_single_shard():
+    for strategy in (SHARD_ROUND_ROBIN, SHARD_HASH):
+        assert ShardMap(SHARDS[:1], strategy).assign([b'1', b'2']) == {SHARDS[0]: [0, 1]}
+
+
+def test_consecutive():
+    assert ShardMap.consecutive('127.0.0.1', 65432, 3).shards == SHARDS
+
+
+def test_invalid_shard_map():
+    with pytest.raises(ValueError):
+        ShardMap([])
+    with pytest.raises(ValueError):
+        ShardMap(SHARDS, 'random')
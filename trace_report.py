@@ -0,0 +1,65 @@
+import argparse
+import json
+
+from NetworkNode.tracing import stitch_traces, stage_breakdown, breakdown_summary
+
+MS = 1000
+
+
+def init_parser() -> argparse.ArgumentParser:
+    """
+    init the argument parser of the trace report tool
+    :return: argument parser
+    """
+    parser = argparse.ArgumentParser(description='stitch the trace logs written in benchmark tracing mode '
+                                                 '(main.py --trace) into per-message hop timelines, '
+                                                 'and print the latency breakdown of every stage')
+    parser.add_argument('logs', nargs='+', metavar='trace_log',
+                        help='trace log files (e.g. one per process)')
+    parser.add_argument('-t', '--timelines', type=int, default=0, metavar='n',
+                        help='print the timelines of the first n messages')
+    parser.add_argument('-j', '--json', type=str, metavar='filename',
+                        help='save the breakdown summary as json into filename')
+    return parser
+
+
+def print_timeline(trace_id: str, events: list) -> None:
+    """
+    pretty print the hop timeline of a message
+    :param trace_id: trace id of the message
+    :param events: (timestamp, node, stage) events of the message, ordered by time
+    :return:
+    """
+    print(f'message {trace_id}:')
+    start = events[0][0]
+    for timestamp, node, stage in events:
+        print(f'  +{(timestamp - start) * MS:10.3f} ms  {node:<24} {stage}')
+
+
+def print_breakdown(summary: dict) -> None:
+    """
+    pretty print the breakdown summary, slowest segments first
+    :param summary: breakdown summary, as returned by breakdown_summary
+    :return:
+    """
+    print(f'{"segment":<72} {"count":>7} {"mean ms":>10} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10}')
+    for name, seg in sorted(summary.items(), key=lambda item: -item[1]['mean']):
+        print(f'{name:<72} {seg["count"]:>7} {seg["mean"] * MS:>10.3f} {seg["p50"] * MS:>10.3f} '
+              f'{seg["p90"] * MS:>10.3f} {seg["p99"] * MS:>10.3f}')
+
+
+def main():
+    args = init_parser().parse_args()
+    timelines = stitch_traces(args.logs)
+    print(f'stitched {len(timelines)} message timelines\n')
+    for trace_id in list(timelines)[:args.timelines]:
+        print_timeline(trace_id, timelines[trace_id])
+    summary = breakdown_summary(stage_breakdown(timelines))
+    print_breakdown(summary)
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()